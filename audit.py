@@ -0,0 +1,246 @@
+"""
+📜 Registro de auditoría
+Registra validaciones, generaciones y revocaciones en segmentos JSONL de solo
+escritura al final. Los eventos se encolan en memoria y una tarea en segundo
+plano los escribe por lotes en un hilo, así que las peticiones nunca esperan
+al disco. Cada segmento tiene un índice de tiempo (una entrada por lote) para
+exportar rangos de fechas leyendo solo los bloques necesarios.
+
+Las keys no se guardan en claro: se registra su huella (`key_fingerprint`).
+
+Exportar: python audit.py --dir audit --since 2024-01-01T00:00 --until 2024-01-02T00:00 [--event validate] [--key KEY]
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import re
+import struct
+import sys
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+# Entrada del índice de un segmento: timestamp mínimo y máximo del lote, offset y longitud en bytes
+_INDEX_ENTRY = struct.Struct("<ddQQ")
+_SEGMENT_NAME = re.compile(r"^audit-(\d{6})\.jsonl$")
+
+logger = logging.getLogger(__name__)
+
+
+def key_fingerprint(key: str) -> str:
+    """Huella de una key para el registro (los primeros 16 hex de su SHA-256)"""
+    return hashlib.sha256(key.encode("utf-8", "surrogatepass")).hexdigest()[:16]
+
+
+def _segment_path(directory: str, number: int) -> str:
+    return os.path.join(directory, f"audit-{number:06d}.jsonl")
+
+
+def _index_path(segment_path: str) -> str:
+    return segment_path[:-len(".jsonl")] + ".idx"
+
+
+def list_segments(directory: str) -> List[Tuple[int, str]]:
+    """Segmentos del directorio ordenados: [(número, ruta)]"""
+    segments = []
+    for name in os.listdir(directory):
+        match = _SEGMENT_NAME.match(name)
+        if match:
+            segments.append((int(match.group(1)), os.path.join(directory, name)))
+    return sorted(segments)
+
+
+class AuditLog:
+    """Cola de eventos de auditoría con escritura por lotes y rotación por tamaño"""
+
+    def __init__(self, directory: str, segment_bytes: int, flush_interval: float,
+                 batch_size: int, queue_size: int):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.queue_size = queue_size
+        self._queue: List[dict] = []
+        # El evento se crea en run(), dentro del bucle que lo usa (en Python 3.9
+        # un asyncio.Event queda ligado al bucle activo al crearlo)
+        self._wake: Optional[asyncio.Event] = None
+        self._closing = False
+
+        os.makedirs(directory, exist_ok=True)
+        segments = list_segments(directory)
+        self._segment = segments[-1][0] if segments else 1
+        self._segment_size = 0
+        if segments:
+            with open(_segment_path(directory, self._segment), "ab+") as segment:
+                self._segment_size = segment.tell()
+                if self._segment_size:
+                    segment.seek(-1, os.SEEK_END)
+                    if segment.read(1) != b"\n":
+                        # Última línea cortada por una parada brusca: se cierra para no mezclarla con la siguiente
+                        segment.write(b"\n")
+                        self._segment_size += 1
+
+        # Métricas
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.rotations = 0
+        self.failed = 0
+
+    def record(self, event: str, now: float, **fields):
+        """Encola un evento sin bloquear; si la cola está llena se descarta y se cuenta"""
+        if len(self._queue) >= self.queue_size:
+            self.dropped += 1
+            return
+        self._queue.append({"ts": now, "event": event, **fields})
+        if len(self._queue) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    def _write(self, batch: List[dict]):
+        """Escribe un lote al final del segmento actual y su entrada de índice (en un hilo)"""
+        # Un surrogate suelto (p. ej. en user_id) es JSON válido pero no UTF-8: se escribe como \udXXX
+        data = "".join(json.dumps(event, ensure_ascii=False) + "\n" for event in batch).encode("utf-8", "backslashreplace")
+        if self._segment_size and self._segment_size + len(data) > self.segment_bytes:
+            self._segment += 1
+            self._segment_size = 0
+            self.rotations += 1
+
+        path = _segment_path(self.directory, self._segment)
+        timestamps = [event["ts"] for event in batch]
+        with open(path, "ab") as segment:
+            offset = segment.tell()
+            segment.write(data)
+        # El índice se escribe después de los datos: un lote sin entrada se lee hasta el final del archivo
+        with open(_index_path(path), "ab") as index:
+            index.write(_INDEX_ENTRY.pack(min(timestamps), max(timestamps), offset, len(data)))
+        self._segment_size = offset + len(data)
+        self.written += len(batch)
+        self.batches += 1
+
+    async def _flush(self):
+        while self._queue:
+            pending, self._queue = self._queue, []
+            for start in range(0, len(pending), self.batch_size):
+                batch = pending[start:start + self.batch_size]
+                try:
+                    await asyncio.to_thread(self._write, batch)
+                except Exception:
+                    # Disco lleno, permisos...: el lote se pierde y se cuenta, pero la tarea sigue
+                    self.failed += len(batch)
+                    logger.exception("No se pudo escribir un lote de %d eventos de auditoría", len(batch))
+
+    async def run(self):
+        """Bucle de escritura; termina (escribiendo lo pendiente) al llamar a close()"""
+        self._wake = asyncio.Event()
+        while not self._closing:
+            try:
+                await asyncio.wait_for(self._wake.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self._flush()
+        await self._flush()
+
+    def close(self):
+        """Pide a run() que escriba los eventos pendientes y termine"""
+        self._closing = True
+        if self._wake is not None:
+            self._wake.set()
+
+    def metrics(self) -> dict:
+        """Métricas del registro de auditoría para el endpoint de estadísticas"""
+        return {
+            "queued": len(self._queue),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+            "segment": self._segment,
+            "segment_bytes": self._segment_size,
+            "rotations": self.rotations,
+        }
+
+
+def read_index(segment_path: str) -> List[Tuple[float, float, int, int]]:
+    """Entradas (ts mínimo, ts máximo, offset, longitud) del índice de un segmento"""
+    try:
+        with open(_index_path(segment_path), "rb") as index:
+            data = index.read()
+    except FileNotFoundError:
+        return []
+    usable = len(data) - len(data) % _INDEX_ENTRY.size
+    return list(_INDEX_ENTRY.iter_unpack(data[:usable]))
+
+
+def query(directory: str, since: float, until: float, event: Optional[str] = None,
+          fingerprint: Optional[str] = None) -> Iterator[bytes]:
+    """Líneas JSONL de los eventos con since <= ts < until, en orden de escritura
+
+    Solo se leen los bloques cuyo rango de tiempo en el índice se solapa con el pedido.
+    """
+    for _, path in list_segments(directory):
+        entries = read_index(path)
+        blocks = [
+            (offset, offset + length)
+            for low, high, offset, length in entries
+            if high >= since and low < until
+        ]
+        # Un lote escrito sin su entrada de índice (parada brusca) se lee siempre
+        indexed_end = entries[-1][2] + entries[-1][3] if entries else 0
+        size = os.path.getsize(path)
+        if indexed_end < size:
+            blocks.append((indexed_end, size))
+        if not blocks:
+            continue
+
+        with open(path, "rb") as segment:
+            for start, end in blocks:
+                segment.seek(start)
+                for line in segment.read(end - start).splitlines(keepends=True):
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # Línea incompleta (escritura interrumpida)
+                        continue
+                    if not since <= record["ts"] < until:
+                        continue
+                    if event is not None and record["event"] != event:
+                        continue
+                    if fingerprint is not None and record.get("key") != fingerprint:
+                        continue
+                    yield line
+
+
+def _parse_time(value: str) -> float:
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        description="Exporta eventos del registro de auditoría como JSONL por stdout",
+        formatter_class=argparse.RawDescriptionHelpFormatter
+    )
+    parser.add_argument("--dir", default=os.getenv("AUDIT_LOG_DIR") or "audit", help="directorio del registro")
+    parser.add_argument("--since", type=_parse_time, default=0.0, help="fecha ISO inicial (incluida)")
+    parser.add_argument("--until", type=_parse_time, default=float("inf"), help="fecha ISO final (excluida)")
+    parser.add_argument("--event", choices=("validate", "generate", "revoke"), help="tipo de evento")
+    parser.add_argument("--key", help="solo los eventos de esta key (se compara su huella)")
+    args = parser.parse_args()
+
+    fingerprint = key_fingerprint(args.key) if args.key else None
+    output = sys.stdout.buffer
+    try:
+        for line in query(args.dir, args.since, args.until, args.event, fingerprint):
+            output.write(line)
+        output.flush()
+    except BrokenPipeError:
+        # La salida se cerró antes de tiempo (p. ej. `| head`)
+        sys.stderr.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+🔐 Benchmark del almacenamiento por hash
+Compara la memoria por key y las validaciones/s (KeyStore.consume) del backend
+memory (dict de KeyRecord indexado por la key en claro) y del backend hashed
+(hash BLAKE2b de 16 bytes en arrays de tamaño fijo), y extrapola la memoria
+ahorrada por millón de keys.
+
+Uso: python benchmarks/bench_hashed_store.py [--keys N] [--users N]
+"""
+
+import argparse
+import base64
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import STATUS_VALID, create_key_store  # noqa: E402
+
+
+def make_keys(count: int, seed: int = 0):
+    """Keys de 32 caracteres como las de generate_api_key (reproducibles con `seed`)"""
+    rng = random.Random(seed)
+    return [base64.urlsafe_b64encode(rng.getrandbits(192).to_bytes(24, "little")).decode() for _ in range(count)]
+
+
+def populate(backend: str, keys: int, users: int, now: float):
+    """Crea el almacenamiento y sus keys; devuelve (almacenamiento, bytes retenidos)"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    store = create_key_store(backend, "")
+    # Las keys se crean dentro de la medición y la lista se libera: solo cuenta
+    # lo que el almacenamiento retiene de cada una
+    all_keys = make_keys(keys)
+    for user in range(users):
+        store.create_many(all_keys[user::users], f"user_{user}", now, now + 3600, 1000)
+    del all_keys
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return store, size
+
+
+def measure_consume(store, keys, now: float, rounds: int = 3) -> float:
+    """Microsegundos por validación (mejor de varias rondas)"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for key in keys:
+            outcome, _ = store.consume(key, now)
+            assert outcome == STATUS_VALID
+        best = min(best, time.perf_counter() - start)
+    return best / len(keys) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=200_000, help="número de keys (200000)")
+    parser.add_argument("--users", type=int, default=1000, help="usuarios entre los que se reparten (1000)")
+    args = parser.parse_args()
+
+    now = time.time()
+    lookups = make_keys(args.keys)[:100_000]
+
+    results = {}
+    for backend in ("memory", "hashed"):
+        store, size = populate(backend, args.keys, args.users, now)
+        results[backend] = (size, measure_consume(store, lookups, now))
+        del store
+
+    print(f"Keys: {args.keys:,}  |  usuarios: {args.users:,}")
+    # bytes por key = MB por millón de keys
+    print(f"{'Backend':<10}{'bytes/key':>12}{'µs/validación':>16}")
+    for backend, (size, micros) in results.items():
+        print(f"{backend:<10}{size / args.keys:>12.0f}{micros:>16.2f}")
+    saved = (results["memory"][0] - results["hashed"][0]) / args.keys
+    print(f"Memoria ahorrada: {saved:.0f} MB por millón de keys "
+          f"({saved * args.keys / results['memory'][0]:.0%})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+📏 Benchmark de registros de keys
+Compara memoria y rendimiento de validación entre el formato anterior
+(dict con fechas ISO) y KeyRecord (__slots__ con fechas epoch)
+
+Uso: python benchmarks/bench_records.py [--keys N]
+"""
+
+import argparse
+import os
+import secrets
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import KeyRecord  # noqa: E402
+
+
+def build_dicts(keys):
+    """Construye registros con el formato anterior de keys_database"""
+    now = datetime.now()
+    return {
+        key: {
+            "key": key,
+            "user_id": f"user_{i % 1000}",
+            "created_at": (now + timedelta(microseconds=i)).isoformat(),
+            "expires_at": (now + timedelta(hours=24, microseconds=i)).isoformat(),
+            "max_uses": 1000,
+            "current_uses": 0,
+            "is_active": True
+        }
+        for i, key in enumerate(keys)
+    }
+
+
+def build_records(keys):
+    """Construye registros KeyRecord"""
+    now = time.time()
+    return {
+        key: KeyRecord(key, f"user_{i % 1000}", now + i * 1e-6, now + 24 * 3600 + i * 1e-6, 1000)
+        for i, key in enumerate(keys)
+    }
+
+
+def validate_dicts(database, keys):
+    """Validación con el formato anterior: fromisoformat en cada comprobación"""
+    for key in keys:
+        info = database[key]
+        if info["is_active"] and datetime.now() <= datetime.fromisoformat(info["expires_at"]) \
+                and info["current_uses"] < info["max_uses"]:
+            info["current_uses"] += 1
+
+
+def validate_records(database, keys):
+    """Validación con KeyRecord: comparación directa de epoch"""
+    now = time.time()
+    for key in keys:
+        record = database[key]
+        if record.is_active and now <= record.expires_at and record.current_uses < record.max_uses:
+            record.current_uses += 1
+
+
+def measure_memory(builder, keys):
+    """Memoria (bytes) usada por los registros, sin contar las keys compartidas"""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    database = builder(keys)
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    size = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    return size, database
+
+
+def measure_throughput(validator, database, keys, rounds=3):
+    """Validaciones por segundo (mejor de varias rondas)"""
+    best = float("inf")
+    for _ in range(rounds):
+        start = time.perf_counter()
+        validator(database, keys)
+        best = min(best, time.perf_counter() - start)
+    return len(keys) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=200_000, help="número de keys (200000)")
+    args = parser.parse_args()
+
+    keys = [secrets.token_urlsafe(24) for _ in range(args.keys)]
+
+    dict_bytes, dicts = measure_memory(build_dicts, keys)
+    dict_rate = measure_throughput(validate_dicts, dicts, keys)
+    del dicts
+
+    record_bytes, records = measure_memory(build_records, keys)
+    record_rate = measure_throughput(validate_records, records, keys)
+
+    print(f"Keys: {args.keys:,}")
+    print(f"{'formato':<22}{'bytes/key':>12}{'validaciones/s':>18}")
+    print(f"{'dict + ISO':<22}{dict_bytes / args.keys:>12.0f}{dict_rate:>18,.0f}")
+    print(f"{'KeyRecord + epoch':<22}{record_bytes / args.keys:>12.0f}{record_rate:>18,.0f}")
+    print(f"Ahorro de memoria: {1 - record_bytes / dict_bytes:.0%}, "
+          f"aceleración: {record_rate / dict_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+⚡ Benchmark de respuestas rápidas
+Compara peticiones/s de /validate-key y /generate-key con y sin
+FAST_RESPONSES, llamando a la aplicación ASGI directamente (sin red) para
+medir solo el coste de FastAPI, la validación y la serialización
+
+Uso: python benchmarks/bench_responses.py [--requests N]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+os.environ.setdefault("SECRET_KEY", "benchmark")
+
+import config  # noqa: E402
+import main  # noqa: E402
+from responses import orjson  # noqa: E402
+
+ADMIN_HEADERS = [(b"authorization", b"Bearer admin_token_123")]
+
+
+async def call(path: str, payload: dict, headers=()) -> bytes:
+    """Ejecuta una petición POST contra la aplicación ASGI y devuelve el cuerpo"""
+    body = json.dumps(payload).encode()
+    scope = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "method": "POST",
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "query_string": b"",
+        "root_path": "",
+        "headers": [(b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()), *headers],
+        "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+    }
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    chunks = []
+
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+
+    await main.app(scope, receive, send)
+    return b"".join(chunks)
+
+
+async def measure(path: str, payloads, headers=()) -> float:
+    """Peticiones/s de una serie de peticiones secuenciales"""
+    start = time.perf_counter()
+    for payload in payloads:
+        await call(path, payload, headers)
+    elapsed = time.perf_counter() - start
+    return len(payloads) / elapsed
+
+
+async def run(requests: int):
+    # Keys con usos suficientes para todas las validaciones y una revocada
+    created = await call("/generate-key", {"user_id": "bench", "max_uses": 10 ** 9}, ADMIN_HEADERS)
+    valid_key = json.loads(created)["data"]["key"]
+    revoked_key = json.loads(await call("/generate-key", {"user_id": "bench"}, ADMIN_HEADERS))["data"]["key"]
+    main.key_store.revoke(revoked_key, time.time())
+
+    workloads = [
+        ("validate-key (válida)", "/validate-key", [{"key": valid_key}] * requests, ()),
+        ("validate-key (revocada)", "/validate-key", [{"key": revoked_key}] * requests, ()),
+        ("generate-key", "/generate-key", [{"user_id": "bench"}] * requests, ADMIN_HEADERS),
+    ]
+
+    print(f"Peticiones por carga: {requests:,}  |  orjson: {'sí' if orjson else 'no'}")
+    print(f"{'Carga':<26}{'Antes (req/s)':>16}{'Después (req/s)':>18}{'Mejora':>10}")
+    for name, path, payloads, headers in workloads:
+        config.FAST_RESPONSES = False
+        await measure(path, payloads[:200], headers)  # Calentamiento
+        before = await measure(path, payloads, headers)
+        config.FAST_RESPONSES = True
+        await measure(path, payloads[:200], headers)
+        after = await measure(path, payloads, headers)
+        print(f"{name:<26}{before:>16,.0f}{after:>18,.0f}{after / before:>9.2f}x")
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=5000, help="peticiones por carga (5000)")
+    args = parser.parse_args()
+    asyncio.run(run(args.requests))
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,94 @@
+"""
+🧠 Benchmark del almacenamiento compartido
+Compara validaciones/s (KeyStore.consume) de los backends memory, sqlite y
+shared en un proceso, y después lanza varios procesos que consumen a la vez
+las mismas keys de la tabla compartida, con usos solo para la mitad de los
+intentos, para comprobar que ningún límite de usos se supera y medir el
+rendimiento agregado.
+
+Uso: python benchmarks/bench_shared_store.py [--keys N] [--ops N] [--processes N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from store import STATUS_VALID, create_key_store  # noqa: E402
+
+USES_PER_KEY = 50
+
+
+def populate(store, keys: int, now: float, uses: int = USES_PER_KEY):
+    store.create_many([f"key{i:027d}" for i in range(keys)], "bench", now, now + 3600, uses)
+
+
+def consume_loop(store, keys: int, ops: int, offset: int, now: float) -> int:
+    """Consume `ops` veces recorriendo las keys; devuelve cuántos usos fueron válidos"""
+    valid = 0
+    for i in range(ops):
+        outcome, _ = store.consume(f"key{(i + offset) % keys:027d}", now)
+        valid += outcome == STATUS_VALID
+    return valid
+
+
+def worker(path: str, capacity: int, keys: int, ops: int, offset: int, now: float, results):
+    store = create_key_store("shared", path, capacity=capacity)
+    start = time.perf_counter()
+    valid = consume_loop(store, keys, ops, offset, now)
+    results.put((valid, time.perf_counter() - start))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--keys", type=int, default=10000, help="keys almacenadas (10000)")
+    parser.add_argument("--ops", type=int, default=100000, help="validaciones por proceso (100000)")
+    parser.add_argument("--processes", type=int, default=4, help="procesos concurrentes sobre la tabla compartida (4)")
+    args = parser.parse_args()
+
+    now = time.time()
+    directory = tempfile.mkdtemp()
+    capacity = args.keys * 2
+
+    print(f"Keys: {args.keys:,}  |  validaciones: {args.ops:,}  |  usos por key: {USES_PER_KEY}")
+    print(f"{'Backend':<10}{'validaciones/s':>16}{'µs/validación':>16}")
+    for backend in ("memory", "sqlite", "shared"):
+        store = create_key_store(backend, os.path.join(directory, f"{backend}.store"), capacity=capacity)
+        populate(store, args.keys, now)
+        start = time.perf_counter()
+        consume_loop(store, args.keys, args.ops, 0, now)
+        elapsed = time.perf_counter() - start
+        print(f"{backend:<10}{args.ops / elapsed:>16,.0f}{elapsed / args.ops * 1e6:>16.2f}")
+
+    # Varios procesos sobre la misma tabla compartida, con usos para la mitad de los intentos
+    path = os.path.join(directory, "concurrent.store")
+    uses = max(1, args.processes * args.ops // (2 * args.keys))
+    populate(create_key_store("shared", path, capacity=capacity), args.keys, now, uses)
+    results = multiprocessing.Queue()
+    processes = [
+        multiprocessing.Process(target=worker, args=(path, capacity, args.keys, args.ops, p * 7, now, results))
+        for p in range(args.processes)
+    ]
+    start = time.perf_counter()
+    for process in processes:
+        process.start()
+    outcomes = [results.get() for _ in processes]
+    elapsed = time.perf_counter() - start
+    for process in processes:
+        process.join()
+
+    valid = sum(count for count, _ in outcomes)
+    expected = min(args.keys * uses, args.processes * args.ops)
+    print(f"\n{args.processes} procesos: {args.processes * args.ops / elapsed:,.0f} validaciones/s agregadas")
+    print(f"Usos válidos: {valid:,} (máximo posible {expected:,}) {'✅' if valid == expected else '❌'}")
+    stats = create_key_store("shared", path, capacity=capacity).stats(now)
+    print(f"uses_consumed en /stats: {stats['uses_consumed']:,}  |  exhausted_keys: {stats['exhausted_keys']:,}")
+    sys.exit(0 if valid == expected else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+🥶 Benchmark de arranque en frío
+Mide lo que paga una función serverless (Vercel) al arrancar: el tiempo de
+importación de main.py desglosado por módulo y paquete (python -X importtime)
+y el tiempo hasta la primera respuesta, lanzando procesos nuevos cada vez.
+
+Uso: python benchmarks/bench_startup.py [--runs N] [--top N] [--output resultados.json]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Proceso hijo: importa la aplicación y atiende /health y /validate-key
+# llamando a la aplicación ASGI directamente
+_FIRST_RESPONSE_SCRIPT = r"""
+import asyncio, json, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+
+async def request(method, path, body=b""):
+    messages = [{"type": "http.request", "body": body, "more_body": False}]
+    status = []
+    async def receive():
+        return messages.pop() if messages else {"type": "http.disconnect"}
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1",
+        "method": method, "scheme": "http", "path": path, "raw_path": path.encode(),
+        "query_string": b"", "root_path": "", "client": ("127.0.0.1", 50000),
+        "server": ("127.0.0.1", 8000),
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+    }
+    await main.app(scope, receive, send)
+    return status[0]
+
+async def run():
+    await request("GET", "/health")
+    first = time.perf_counter()
+    await request("POST", "/validate-key", b'{"key": "inexistente"}')
+    validate = time.perf_counter()
+    await request("POST", "/validate-key", b'{"key": "inexistente"}')
+    warm = time.perf_counter()
+    return first, validate, warm
+
+first, validate, warm = asyncio.run(run())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "first_response_ms": (first - imported) * 1000,
+    "first_validate_ms": (validate - first) * 1000,
+    "warm_validate_ms": (warm - validate) * 1000,
+}))
+"""
+
+
+def child_env() -> dict:
+    env = dict(os.environ)
+    env.setdefault("SECRET_KEY", "benchmark")
+    env["PYTHONWARNINGS"] = "ignore"
+    return env
+
+
+def import_breakdown():
+    """Tiempos de -X importtime de `import main`: {módulo: (propio_us, acumulado_us)}"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True
+    )
+    modules = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|")
+        modules[name.strip()] = (int(own), int(cumulative))
+    return modules
+
+
+def first_response():
+    """Tiempos de arranque de un proceso nuevo, medidos desde fuera y desde dentro"""
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", _FIRST_RESPONSE_SCRIPT],
+        cwd=ROOT, env=child_env(), capture_output=True, text=True, check=True
+    )
+    timings = json.loads(result.stdout.strip().splitlines()[-1])
+    # Incluye el arranque del intérprete y la salida del proceso
+    timings["process_ms"] = (time.perf_counter() - start) * 1000
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5, help="procesos por medición (5)")
+    parser.add_argument("--top", type=int, default=15, help="módulos más lentos a mostrar (15)")
+    parser.add_argument("--output", help="archivo JSON donde guardar los resultados")
+    args = parser.parse_args()
+
+    # Importación: mediana por módulo entre ejecuciones
+    runs = [import_breakdown() for _ in range(args.runs)]
+    own = defaultdict(list)
+    for modules in runs:
+        for name, (self_us, _) in modules.items():
+            own[name].append(self_us)
+    own_median = {name: statistics.median(values) for name, values in own.items()}
+    total_ms = statistics.median(modules["main"][1] for modules in runs) / 1000
+
+    packages = defaultdict(float)
+    for name, value in own_median.items():
+        packages[name.split(".")[0]] += value
+
+    print(f"📦 import main: {total_ms:.1f} ms (mediana de {args.runs})\n")
+    print(f"{'Paquete':<28}{'ms':>8}")
+    for name, value in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<28}{value / 1000:>8.1f}")
+    print(f"\n{'Módulo (tiempo propio)':<48}{'ms':>8}")
+    for name, value in sorted(own_median.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<48}{value / 1000:>8.1f}")
+
+    # Primera respuesta
+    samples = [first_response() for _ in range(args.runs)]
+    first = {field: statistics.median(sample[field] for sample in samples) for field in samples[0]}
+    print("\n⏱️  Arranque en frío (mediana):")
+    print(f"  proceso completo (intérprete + import + 3 peticiones): {first['process_ms']:.1f} ms")
+    print(f"  import main:                                           {first['import_ms']:.1f} ms")
+    print(f"  primera respuesta (/health):                           {first['first_response_ms']:.2f} ms")
+    print(f"  primera validación:                                    {first['first_validate_ms']:.2f} ms")
+    print(f"  validación en caliente:                                {first['warm_validate_ms']:.2f} ms")
+
+    if args.output:
+        results = {
+            "python": sys.version.split()[0],
+            "runs": args.runs,
+            "import_ms": total_ms,
+            "packages_ms": {name: value / 1000 for name, value in sorted(packages.items(), key=lambda item: -item[1])},
+            "modules_ms": {name: value / 1000 for name, value in sorted(own_median.items(), key=lambda item: -item[1])[:args.top]},
+            "first_response": first,
+        }
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResultados guardados en {args.output}")
+
+
+if __name__ == "__main__":
+    main()
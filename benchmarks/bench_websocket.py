@@ -0,0 +1,165 @@
+"""
+🔌 Benchmark del canal WebSocket
+Compara validaciones/s de POST /validate-key (conexiones HTTP keep-alive, una
+petición en curso por conexión) y de /ws/validate (mensajes enviados sin
+esperar respuesta, con como mucho --window pendientes por conexión) contra un
+servidor uvicorn real: arranca uno local con la configuración por defecto (o
+la de las variables de entorno), o usa --url.
+
+Con el servidor local (en Linux) también informa los µs de CPU que el servidor
+gasta por validación, que no dependen de lo que consuma el propio cliente.
+
+Requiere httpx y websockets (pip install httpx websockets).
+
+Uso: python benchmarks/bench_websocket.py [--messages N] [--connections N] [--window N] [--url URL]
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+from typing import List, Optional
+
+import httpx
+import websockets
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ADMIN_HEADERS = {"Authorization": "Bearer admin_token_123"}
+SEED_KEYS = 1000
+
+
+def start_server():
+    """Arranca uvicorn en un puerto libre; devuelve (proceso, URL)"""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    env = dict(os.environ, SECRET_KEY="benchmark")
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=env
+    )
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            httpx.get(f"{url}/health")
+            return process, url
+        except httpx.TransportError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("El servidor no arrancó")
+
+
+def server_cpu_seconds(pid: Optional[int]) -> Optional[float]:
+    """CPU (usuario + sistema) consumida por el proceso del servidor, si se puede leer"""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+
+
+async def measure(bench, pid: Optional[int], messages: int):
+    """Ejecuta un benchmark; devuelve (validaciones/s, µs de CPU del servidor por validación o None)"""
+    cpu = server_cpu_seconds(pid)
+    rate = await bench
+    if cpu is None:
+        return rate, None
+    return rate, (server_cpu_seconds(pid) - cpu) / messages * 1e6
+
+
+async def seed_keys(client: httpx.AsyncClient) -> List[str]:
+    response = await client.post(
+        "/generate-keys", json={"user_id": "bench", "count": SEED_KEYS, "max_uses": 10 ** 9}, headers=ADMIN_HEADERS
+    )
+    response.raise_for_status()
+    return response.json()["data"]["keys"]
+
+
+async def bench_http(url: str, keys: List[str], messages: int, connections: int) -> float:
+    """Validaciones/s con `connections` conexiones keep-alive"""
+    per_connection = messages // connections
+
+    async def worker(offset: int):
+        async with httpx.AsyncClient(base_url=url) as client:
+            for i in range(per_connection):
+                response = await client.post("/validate-key", json={"key": keys[(offset + i) % len(keys)]})
+                assert response.json()["success"]
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n * per_connection) for n in range(connections)))
+    return per_connection * connections / (time.perf_counter() - start)
+
+
+async def bench_websocket(url: str, keys: List[str], messages: int, connections: int, window: int) -> float:
+    """Validaciones/s con `connections` WebSockets y `window` mensajes pendientes por conexión"""
+    per_connection = messages // connections
+    ws_url = url.replace("http", "ws", 1) + "/ws/validate"
+
+    async def worker(offset: int):
+        async with websockets.connect(ws_url) as ws:
+            slots = asyncio.Semaphore(window)
+
+            async def sender():
+                for i in range(per_connection):
+                    await slots.acquire()
+                    await ws.send(json.dumps({"id": i, "key": keys[(offset + i) % len(keys)]}))
+
+            async def receiver():
+                for _ in range(per_connection):
+                    assert json.loads(await ws.recv())["success"]
+                    slots.release()
+
+            await asyncio.gather(sender(), receiver())
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker(n * per_connection) for n in range(connections)))
+    return per_connection * connections / (time.perf_counter() - start)
+
+
+async def run(args, url: str, pid: Optional[int]):
+    async with httpx.AsyncClient(base_url=url) as client:
+        keys = await seed_keys(client)
+    # Calentamiento de ambos caminos
+    await bench_http(url, keys, 200, 1)
+    await bench_websocket(url, keys, 200, 1, args.window)
+
+    http_rate, http_cpu = await measure(bench_http(url, keys, args.messages, args.connections), pid, args.messages)
+    ws_rate, ws_cpu = await measure(
+        bench_websocket(url, keys, args.messages, args.connections, args.window), pid, args.messages
+    )
+    print(f"Validaciones: {args.messages:,}  |  conexiones: {args.connections}  |  ventana WebSocket: {args.window}")
+    print(f"{'camino':<22}{'validaciones/s':>16}{'µs CPU servidor':>18}")
+    for name, rate, cpu in (("POST /validate-key", http_rate, http_cpu), ("/ws/validate", ws_rate, ws_cpu)):
+        print(f"{name:<22}{rate:>16,.0f}{cpu:>18.1f}" if cpu is not None else f"{name:<22}{rate:>16,.0f}{'-':>18}")
+    print(f"Aceleración: {ws_rate / http_rate:.1f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=20000, help="validaciones por camino (20000)")
+    parser.add_argument("--connections", type=int, default=4, help="conexiones concurrentes (4)")
+    parser.add_argument("--window", type=int, default=64, help="mensajes pendientes por WebSocket (64)")
+    parser.add_argument("--url", help="servidor ya arrancado")
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_server()
+    try:
+        asyncio.run(run(args, url.rstrip("/"), process.pid if process is not None else None))
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+
+if __name__ == "__main__":
+    main()
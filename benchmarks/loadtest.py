@@ -0,0 +1,225 @@
+"""
+🏋️ Pruebas de carga de la API
+Lanza cargas concurrentes contra la aplicación (en el mismo proceso vía ASGI,
+o contra un servidor con --url) e informa peticiones/s y latencias
+p50/p95/p99. Los resultados se guardan en JSON para comparar ejecuciones y
+detectar regresiones con --baseline.
+
+Cargas:
+  validate  POST /validate-key con keys válidas
+  generate  POST /generate-key
+  mixed     POST /validate-key con un 50% de keys inexistentes y un 10% de revocadas
+  stats     GET /stats y GET /keys (página de 100) con un almacenamiento grande
+
+Uso:
+  python benchmarks/loadtest.py --workload all --requests 5000 --concurrency 50
+  python benchmarks/loadtest.py --url http://127.0.0.1:8000 --output run.json
+  python benchmarks/loadtest.py --baseline run.json --max-regression 10
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import secrets
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+ADMIN_HEADERS = {"Authorization": "Bearer admin_token_123"}
+WORKLOADS = ("validate", "generate", "mixed", "stats")
+
+# Keys que se crean de antemano para las cargas de validación
+SEED_KEYS = 1000
+
+
+def make_client(url: Optional[str]) -> httpx.AsyncClient:
+    """Cliente contra un servidor, o contra la aplicación en este proceso"""
+    if url:
+        limits = httpx.Limits(max_connections=1000, max_keepalive_connections=1000)
+        return httpx.AsyncClient(base_url=url, limits=limits, timeout=30)
+
+    os.environ.setdefault("SECRET_KEY", "loadtest")
+    import main
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://loadtest")
+
+
+async def generate_keys(client: httpx.AsyncClient, count: int, max_uses: int) -> List[str]:
+    """Crea `count` keys con POST /generate-keys"""
+    keys = []
+    while len(keys) < count:
+        response = await client.post(
+            "/generate-keys",
+            json={"user_id": "loadtest", "count": min(10000, count - len(keys)), "max_uses": max_uses},
+            headers=ADMIN_HEADERS
+        )
+        response.raise_for_status()
+        keys += response.json()["data"]["keys"]
+    return keys
+
+
+async def prepare(client: httpx.AsyncClient, workload: str, store_size: int) -> Callable:
+    """Prepara los datos de una carga y devuelve la función que lanza cada petición"""
+    if workload == "generate":
+        return lambda i: client.post("/generate-key", json={"user_id": f"user_{i % 100}"}, headers=ADMIN_HEADERS)
+
+    if workload == "stats":
+        stats = (await client.get("/stats", headers=ADMIN_HEADERS)).json()
+        missing = store_size - stats.get("total_keys", 0)
+        if missing > 0:
+            await generate_keys(client, missing, 1)
+        return lambda i: (
+            client.get("/stats", headers=ADMIN_HEADERS) if i % 2
+            else client.get("/keys", params={"limit": 100}, headers=ADMIN_HEADERS)
+        )
+
+    keys = await generate_keys(client, SEED_KEYS, 10 ** 9)
+    if workload == "validate":
+        return lambda i: client.post("/validate-key", json={"key": keys[i % len(keys)]})
+
+    revoked = keys[:SEED_KEYS // 10]
+    for key in revoked:
+        await client.delete(f"/revoke-key/{key}", headers=ADMIN_HEADERS)
+    valid = keys[len(revoked):]
+    invalid = [secrets.token_urlsafe(24)[:32] for _ in range(SEED_KEYS)]
+
+    def mixed(i):
+        bucket = i % 10
+        if bucket < 5:
+            key = invalid[i % len(invalid)]
+        elif bucket == 5:
+            key = revoked[i % len(revoked)]
+        else:
+            key = valid[i % len(valid)]
+        return client.post("/validate-key", json={"key": key})
+    return mixed
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    """Percentil por rango más cercano de una lista ordenada"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+async def run_workload(send: Callable, requests: int, concurrency: int) -> Dict:
+    """Lanza `requests` peticiones con `concurrency` tareas y resume las latencias"""
+    latencies: List[float] = []
+    statuses: Dict[int, int] = {}
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await send(i)
+            except httpx.HTTPError:
+                errors += 1
+                continue
+            latencies.append(time.perf_counter() - start)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "duration_seconds": round(elapsed, 4),
+        "requests_per_second": round(requests / elapsed, 1),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 3) if latencies else 0.0,
+            "p50": round(percentile(latencies, 0.50) * 1000, 3),
+            "p95": round(percentile(latencies, 0.95) * 1000, 3),
+            "p99": round(percentile(latencies, 0.99) * 1000, 3),
+            "max": round(latencies[-1] * 1000, 3) if latencies else 0.0,
+        },
+        "statuses": {str(code): count for code, count in sorted(statuses.items())},
+        "errors": errors,
+    }
+
+
+def compare(results: Dict, baseline: Dict, max_regression: float) -> List[str]:
+    """Compara con una ejecución anterior; devuelve las regresiones que superan el umbral (%)"""
+    regressions = []
+    print(f"\nComparación con {baseline.get('timestamp', 'la ejecución anterior')}:")
+    for name, current in results["workloads"].items():
+        previous = baseline.get("workloads", {}).get(name)
+        if previous is None:
+            continue
+        rps_change = (current["requests_per_second"] / previous["requests_per_second"] - 1) * 100
+        p95_change = (current["latency_ms"]["p95"] / max(previous["latency_ms"]["p95"], 1e-9) - 1) * 100
+        print(f"  {name:<10} req/s {rps_change:+7.1f}%   p95 {p95_change:+7.1f}%")
+        if rps_change < -max_regression:
+            regressions.append(f"{name}: req/s {rps_change:+.1f}%")
+        if p95_change > max_regression:
+            regressions.append(f"{name}: p95 {p95_change:+.1f}%")
+    return regressions
+
+
+async def run(args) -> Dict:
+    workloads = WORKLOADS if args.workload == "all" else (args.workload,)
+    results = {
+        "timestamp": datetime.now().isoformat(),
+        "target": args.url or "asgi",
+        "python": platform.python_version(),
+        "workloads": {},
+    }
+    print(f"Destino: {results['target']}  |  peticiones: {args.requests:,}  |  concurrencia: {args.concurrency}")
+    print(f"{'Carga':<10}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errores':>9}  estados")
+
+    async with make_client(args.url) as client:
+        for workload in workloads:
+            send = await prepare(client, workload, args.store_size)
+            # Calentamiento
+            await run_workload(send, min(200, args.requests), args.concurrency)
+            summary = await run_workload(send, args.requests, args.concurrency)
+            results["workloads"][workload] = summary
+            latency = summary["latency_ms"]
+            print(
+                f"{workload:<10}{summary['requests_per_second']:>10,.0f}{latency['p50']:>10.2f}"
+                f"{latency['p95']:>10.2f}{latency['p99']:>10.2f}{summary['errors']:>9}  {summary['statuses']}"
+            )
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workload", choices=WORKLOADS + ("all",), default="all", help="carga a ejecutar (all)")
+    parser.add_argument("--requests", type=int, default=5000, help="peticiones por carga (5000)")
+    parser.add_argument("--concurrency", type=int, default=50, help="peticiones simultáneas (50)")
+    parser.add_argument("--store-size", type=int, default=100_000, help="keys almacenadas para la carga stats (100000)")
+    parser.add_argument("--url", help="URL de un servidor en marcha (por defecto, la aplicación en este proceso)")
+    parser.add_argument("--output", help="archivo JSON donde guardar los resultados")
+    parser.add_argument("--baseline", help="resultados JSON de una ejecución anterior para comparar")
+    parser.add_argument("--max-regression", type=float, default=10.0, help="regresión máxima tolerada en %% (10)")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"\nResultados guardados en {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            regressions = compare(results, json.load(f), args.max_regression)
+        if regressions:
+            print("❌ Regresiones: " + ", ".join(regressions))
+            sys.exit(1)
+        print("✅ Sin regresiones")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""
+🌸 Caché negativa con filtro de Bloom
+Responde "la key no existe" sin consultar el almacenamiento para las keys
+inventadas o aleatorias que envían los escáneres. Un filtro de Bloom no tiene
+falsos negativos: si dice que una key no está, no está.
+"""
+
+import hashlib
+import math
+import secrets
+from typing import Iterable, Optional
+
+
+class BloomFilter:
+    """Filtro de Bloom sobre un bytearray con doble hashing (Kirsch-Mitzenmacher)"""
+
+    def __init__(self, capacity: int, fp_rate: float):
+        capacity = max(1, capacity)
+        self.capacity = capacity
+        self.fp_rate = fp_rate
+        self.size = max(8, int(-capacity * math.log(fp_rate) / (math.log(2) ** 2)))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+        self._bits = bytearray((self.size + 7) // 8)
+        # Sal aleatoria: las posiciones no se pueden precalcular desde fuera
+        self._salt = secrets.token_bytes(16)
+
+    def _positions(self, key: str):
+        data = key.encode("utf-8", "surrogatepass")
+        digest = hashlib.blake2b(data, digest_size=16, key=self._salt).digest()
+        h1 = int.from_bytes(digest[:8], "little")
+        h2 = int.from_bytes(digest[8:], "little") | 1
+        size = self.size
+        return [(h1 + i * h2) % size for i in range(self.hashes)]
+
+    def add(self, key: str):
+        bits = self._bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: str) -> bool:
+        bits = self._bits
+        for position in self._positions(key):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    @property
+    def memory_bytes(self) -> int:
+        return len(self._bits)
+
+
+class NegativeCache:
+    """Filtro de Bloom de las keys existentes, con reconstrucción periódica y métricas.
+
+    Se actualiza al crear keys y se reconstruye desde el almacenamiento para
+    olvidar las keys desalojadas y recoger las creadas por otros procesos.
+    Mientras no se haya construido por primera vez (`ready`), no rechaza nada.
+    """
+
+    def __init__(self, capacity: int, fp_rate: float, ready: bool):
+        self.min_capacity = capacity
+        self.fp_rate = fp_rate
+        self.ready = ready
+        self._filter = BloomFilter(capacity, fp_rate)
+        self._next: Optional[BloomFilter] = None
+
+        # Métricas
+        self.checks = 0
+        self.rejected = 0
+        self.false_positives = 0
+        self.rebuilds = 0
+
+    @property
+    def overfull(self) -> bool:
+        """Indica si el filtro tiene más keys que su capacidad (sube la tasa de falsos positivos)"""
+        return self._filter.count > self._filter.capacity
+
+    def add(self, key: str):
+        self._filter.add(key)
+        if self._next is not None:
+            self._next.add(key)
+
+    def add_many(self, keys: Iterable[str]):
+        for key in keys:
+            self.add(key)
+
+    def might_contain(self, key: str) -> bool:
+        """False solo si la key seguro que no existe"""
+        if not self.ready:
+            return True
+        self.checks += 1
+        if key in self._filter:
+            return True
+        self.rejected += 1
+        return False
+
+    def start_rebuild(self, expected: int) -> BloomFilter:
+        """Empieza un filtro nuevo; las keys creadas durante la reconstrucción se añaden a ambos"""
+        self._next = BloomFilter(max(self.min_capacity, 2 * expected), self.fp_rate)
+        return self._next
+
+    def finish_rebuild(self):
+        """Sustituye el filtro actual por el reconstruido"""
+        self._filter, self._next = self._next, None
+        self.ready = True
+        self.rebuilds += 1
+
+    def metrics(self) -> dict:
+        """Métricas de la caché negativa para el endpoint de estadísticas"""
+        return {
+            "ready": self.ready,
+            "keys": self._filter.count,
+            "capacity": self._filter.capacity,
+            "fp_rate": self.fp_rate,
+            "hashes": self._filter.hashes,
+            "memory_bytes": self._filter.memory_bytes,
+            "checks": self.checks,
+            "rejected": self.rejected,
+            "false_positives": self.false_positives,
+            "rebuilds": self.rebuilds,
+        }
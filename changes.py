@@ -0,0 +1,82 @@
+"""
+🔁 Feed de cambios
+Registro en memoria de las mutaciones de keys (creación, consumo, revocación y
+desalojo) con un número de secuencia creciente, para que las réplicas de
+lectura (replica.py) mantengan una copia local. Los eventos se guardan ya
+serializados en un buffer circular de tamaño fijo; una réplica que se quede
+atrás más que el buffer tiene que descargar una instantánea.
+
+Cada arranque del primario tiene una época distinta: las secuencias de épocas
+diferentes no son comparables.
+
+Eventos (todos llevan seq, op y ts):
+  create       keys, user_id, created_at, expires_at, max_uses, rate_limit, rate_limit_window
+  consume      key, uses (usos tras consumir)
+  revoke       key
+  revoke_user  user_id
+  evict        keys
+"""
+
+import asyncio
+import secrets
+from typing import List, Optional
+
+from responses import dumps
+
+
+class ChangeFeed:
+    """Buffer circular de eventos de cambio con secuencias contiguas"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.epoch = secrets.token_hex(8)
+        self.last_seq = 0
+        self._ring: List[Optional[bytes]] = [None] * capacity
+        # Se crea al esperar, dentro del bucle de eventos (ver AuditLog.run)
+        self._changed: Optional[asyncio.Event] = None
+
+    def append(self, op: str, now: float, **fields) -> int:
+        """Añade un evento y devuelve su seq"""
+        seq = self.last_seq + 1
+        self._ring[seq % self.capacity] = dumps({"seq": seq, "op": op, "ts": now, **fields})
+        self.last_seq = seq
+        if self._changed is not None:
+            self._changed.set()
+            self._changed = None
+        return seq
+
+    @property
+    def first_seq(self) -> int:
+        """Seq del evento más antiguo que sigue en el buffer"""
+        return max(1, self.last_seq - self.capacity + 1)
+
+    def since(self, seq: int, limit: int) -> Optional[List[bytes]]:
+        """Eventos JSON con seq > `seq` (como mucho `limit`), en orden.
+
+        Devuelve None si alguno de ellos ya salió del buffer.
+        """
+        if seq + 1 < self.first_seq:
+            return None
+        end = min(self.last_seq, seq + limit)
+        return [self._ring[i % self.capacity] for i in range(seq + 1, end + 1)]
+
+    async def wait(self, seq: int, timeout: float) -> bool:
+        """Espera a que haya eventos posteriores a `seq`; False si pasa `timeout` sin ninguno"""
+        if self.last_seq > seq:
+            return True
+        if self._changed is None:
+            self._changed = asyncio.Event()
+        try:
+            await asyncio.wait_for(self._changed.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    def metrics(self) -> dict:
+        """Métricas del feed para el endpoint de estadísticas"""
+        return {
+            "epoch": self.epoch,
+            "last_seq": self.last_seq,
+            "first_seq": self.first_seq if self.last_seq else None,
+            "capacity": self.capacity,
+        }
@@ -0,0 +1,122 @@
+"""
+⚙️ Configuración de la API
+Valores leídos de variables de entorno, con valores por defecto para desarrollo local
+"""
+
+import os
+import secrets
+import warnings
+
+# Backend de almacenamiento de keys: "memory", "sqlite", "shared" (tabla en
+# memoria compartida por los workers del host; ver serve.py) o "hashed" (en
+# memoria, guardando solo un hash de 16 bytes de cada key; ver hashedstore.py)
+KEY_STORE_BACKEND = os.getenv("KEY_STORE", "memory")
+
+# Ruta del archivo SQLite (backend "sqlite") o de la tabla mapeada en memoria (backend "shared")
+KEY_STORE_PATH = os.getenv("KEY_STORE_PATH", "keys.tbl" if KEY_STORE_BACKEND == "shared" else "keys.db")
+
+# Máximo de keys almacenadas a la vez en la tabla compartida (se fija al crear el archivo)
+SHARED_STORE_CAPACITY = int(os.getenv("SHARED_STORE_CAPACITY", "1000000"))
+
+# Espera máxima (ms) del backend "sqlite" y de los buckets compartidos del límite
+# de peticiones (RATE_LIMIT_SHARED_PATH) cuando otro proceso está escribiendo.
+# La espera bloquea el bucle de eventos del worker: pasado este tiempo la
+# petición responde 503 en lugar de seguir esperando
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "100"))
+
+# Desalojo de keys expiradas/agotadas: intervalo entre barridos (0 lo desactiva),
+# periodo de gracia tras expirar o agotarse y máximo de keys por lote
+SWEEP_INTERVAL_SECONDS = float(os.getenv("SWEEP_INTERVAL_SECONDS", "60"))
+EVICTION_GRACE_SECONDS = float(os.getenv("EVICTION_GRACE_SECONDS", "3600"))
+SWEEP_BATCH_SIZE = int(os.getenv("SWEEP_BATCH_SIZE", "10000"))
+
+# Horas de eventos (generadas, usos, revocadas) que se conservan para GET /stats
+STATS_HOURLY_WINDOW = int(os.getenv("STATS_HOURLY_WINDOW", "48"))
+
+# Máximo de keys por petición a POST /generate-keys
+MAX_GENERATE_COUNT = int(os.getenv("MAX_GENERATE_COUNT", "100000"))
+
+# Clave secreta para firmar keys y encriptar datos. Debe ser la misma en todos
+# los workers y arranques; si falta se genera una temporal para desarrollo
+SECRET_KEY = os.getenv("SECRET_KEY")
+if not SECRET_KEY:
+    SECRET_KEY = secrets.token_urlsafe(32)
+    warnings.warn(
+        "SECRET_KEY no está configurada: se usa una clave temporal; "
+        "las keys firmadas y los datos encriptados no sobrevivirán a un reinicio"
+    )
+
+# Formato de las keys generadas: "random" (32 caracteres) o "signed" (firmadas con SECRET_KEY)
+KEY_FORMAT = os.getenv("KEY_FORMAT", "random")
+
+# Caché negativa (filtro de Bloom) de keys inexistentes: "auto" la activa solo con
+# el backend "memory"; con backends compartidos entre procesos, una key creada en
+# otro proceso se rechaza hasta la siguiente reconstrucción
+NEGATIVE_CACHE = os.getenv("NEGATIVE_CACHE", "auto")
+NEGATIVE_CACHE_FP_RATE = float(os.getenv("NEGATIVE_CACHE_FP_RATE", "0.01"))
+NEGATIVE_CACHE_CAPACITY = int(os.getenv("NEGATIVE_CACHE_CAPACITY", "100000"))
+NEGATIVE_CACHE_REBUILD_SECONDS = float(os.getenv("NEGATIVE_CACHE_REBUILD_SECONDS", "3600"))
+
+# Límite de peticiones por cliente (token bucket): "ruta=peticiones_por_segundo/ráfaga,...",
+# p. ej. "/validate-key=20/50,/validate-keys=5/10,/key-info=20/50". Las rutas con
+# parámetros se indican por su prefijo (/key-info cubre /key-info/{key}).
+# Desactivado por defecto: detrás de un proxy todos los clientes llegan con la
+# misma IP salvo que se active RATE_LIMIT_TRUST_FORWARDED
+RATE_LIMITS = os.getenv("RATE_LIMITS", "")
+# Máximo de clientes con bucket en memoria (LRU); los menos recientes se olvidan
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+# Agrupar también por prefijo de key en las rutas con la key en la URL
+RATE_LIMIT_BY_KEY_PREFIX = os.getenv("RATE_LIMIT_BY_KEY_PREFIX", "false").lower() == "true"
+# Usar la primera IP de X-Forwarded-For (solo detrás de un proxy de confianza)
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "false").lower() == "true"
+# Archivo SQLite para compartir los buckets entre workers (vacío: buckets por proceso)
+RATE_LIMIT_SHARED_PATH = os.getenv("RATE_LIMIT_SHARED_PATH", "")
+
+# Respuestas rápidas en los endpoints más usados: bytes JSON escritos directamente
+# (con orjson si está instalado) sin construir ni revalidar modelos pydantic.
+# Las respuestas son JSON equivalente (solo cambia la forma de algunos floats)
+FAST_RESPONSES = os.getenv("FAST_RESPONSES", "false").lower() == "true"
+
+# Registro de auditoría de validaciones, generaciones y revocaciones: directorio
+# de los segmentos JSONL (vacío lo desactiva), tamaño máximo de cada segmento,
+# segundos entre escrituras, eventos por lote y máximo de eventos en cola
+AUDIT_LOG_DIR = os.getenv("AUDIT_LOG_DIR", "")
+AUDIT_SEGMENT_BYTES = int(os.getenv("AUDIT_SEGMENT_BYTES", str(64 * 1024 * 1024)))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "1"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "1000"))
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "100000"))
+
+# Feed de cambios para réplicas de lectura: eventos conservados en memoria
+# (0 lo desactiva) y segundos entre heartbeats del stream SSE. Cada worker
+# tiene su propio feed: el primario debe ejecutarse con un solo worker
+CHANGE_FEED_SIZE = int(os.getenv("CHANGE_FEED_SIZE", "0"))
+CHANGE_FEED_HEARTBEAT_SECONDS = float(os.getenv("CHANGE_FEED_HEARTBEAT_SECONDS", "15"))
+
+# Modo réplica: URL del primario cuyo feed se sigue (vacío: este proceso es primario)
+# y token de administrador para leerlo
+REPLICA_OF = os.getenv("REPLICA_OF", "")
+REPLICA_TOKEN = os.getenv("REPLICA_TOKEN", "admin_token_123")
+
+# Idempotency-Key en /generate-key y /generate-keys: resultados guardados por
+# proceso (0 lo desactiva), máximo de keys generadas entre todos ellos y segundos
+# que se conservan. Los resultados llevan las keys en claro: con el backend
+# "hashed" está desactivado salvo que se configure explícitamente
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "0" if KEY_STORE_BACKEND == "hashed" else "10000"))
+IDEMPOTENCY_MAX_KEYS = int(os.getenv("IDEMPOTENCY_MAX_KEYS", "1000000"))
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+# Perfilado de peticiones (profiler.py, GET /debug/profile). Desactivado no añade
+# ningún middleware; activado perfila la fracción PROFILE_SAMPLE_RATE de las
+# peticiones y las que llevan la cabecera X-Debug-Profile firmada con un token
+# de administrador
+PROFILING = os.getenv("PROFILING", "false").lower() == "true"
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+# Tiempo mínimo entre muestras de la pila durante una petición perfilada
+PROFILE_INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_SECONDS", "0.0001"))
+# Máximo de pilas distintas por ruta (el resto se acumula en "[otras pilas]")
+PROFILE_MAX_STACKS = int(os.getenv("PROFILE_MAX_STACKS", "5000"))
+
+# Canal WebSocket /ws/validate: conexiones simultáneas por worker y validaciones
+# pendientes por conexión antes de dejar de leer mensajes (backpressure)
+WS_MAX_CONNECTIONS = int(os.getenv("WS_MAX_CONNECTIONS", "1000"))
+WS_MAX_IN_FLIGHT = int(os.getenv("WS_MAX_IN_FLIGHT", "64"))
@@ -0,0 +1,77 @@
+"""
+📊 Contadores de estadísticas
+Contadores mantenidos de forma incremental al generar, consumir, revocar,
+expirar y desalojar keys, para que GET /stats se lea en tiempo constante
+"""
+
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Contadores de estado (describen las keys almacenadas en este momento)
+STATE_FIELDS = (
+    "total_keys",
+    "active_keys",
+    "revoked_keys",
+    "expired_keys",
+    "exhausted_keys",
+    "uses_consumed",
+)
+TOTAL, ACTIVE, REVOKED, EXPIRED, EXHAUSTED, USES = range(len(STATE_FIELDS))
+
+# Eventos contados por hora
+HOURLY_FIELDS = ("generated", "uses", "revoked")
+GENERATED, HOURLY_USES, HOURLY_REVOKED = range(len(HOURLY_FIELDS))
+
+
+def hour_of(timestamp: float) -> int:
+    """Inicio (epoch) de la hora que contiene `timestamp`"""
+    return int(timestamp // 3600) * 3600
+
+
+def state_dict(values: List[int]) -> Dict[str, int]:
+    """Convierte una lista de contadores de estado en un dict"""
+    return dict(zip(STATE_FIELDS, values))
+
+
+class KeyCounters:
+    """Contadores globales, por usuario y por hora de un almacenamiento en memoria"""
+
+    def __init__(self, hourly_window: int):
+        self.totals = [0] * len(STATE_FIELDS)
+        self.users: Dict[str, List[int]] = {}
+        # Hora -> contadores de eventos; solo se conservan las últimas `hourly_window`
+        self.hourly: "OrderedDict[int, List[int]]" = OrderedDict()
+        self.hourly_window = hourly_window
+
+    def add(self, user_id: str, field: int, delta: int = 1):
+        """Suma `delta` a un contador de estado global y del usuario"""
+        self.totals[field] += delta
+        user = self.users.get(user_id)
+        if user is None:
+            user = self.users[user_id] = [0] * len(STATE_FIELDS)
+        user[field] += delta
+        if field == TOTAL and user[TOTAL] == 0:
+            # El usuario ya no tiene keys almacenadas
+            del self.users[user_id]
+
+    def event(self, now: float, field: int, count: int = 1):
+        """Cuenta eventos en la hora actual"""
+        hour = hour_of(now)
+        counts = self.hourly.get(hour)
+        if counts is None:
+            counts = self.hourly[hour] = [0] * len(HOURLY_FIELDS)
+            while len(self.hourly) > self.hourly_window:
+                self.hourly.popitem(last=False)
+        counts[field] += count
+
+    def user(self, user_id: str) -> Optional[List[int]]:
+        """Contadores de estado de un usuario, o None si no tiene keys"""
+        return self.users.get(user_id)
+
+    def hourly_list(self, since: int) -> List[dict]:
+        """Eventos por hora posteriores a `since`, de la más antigua a la más reciente"""
+        return [
+            {"hour": hour, **dict(zip(HOURLY_FIELDS, counts))}
+            for hour, counts in self.hourly.items()
+            if hour > since
+        ]
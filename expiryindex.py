@@ -0,0 +1,198 @@
+"""
+⏳ Índices de expiración sobre arrays
+Equivalentes a los heaps de MemoryKeyStore para los almacenamientos de
+registros de tamaño fijo (sharedstore.py, hashedstore.py), guardados en
+arrays por campo (array o memoryview de un mmap), donde un heapq de tuplas
+ocuparía más que el propio registro:
+- IndexedHeap: min-heap de registros que guarda la posición de cada uno, para
+  eliminarlo o cambiar su prioridad en O(log n) sin dejar entradas obsoletas
+- ExpiryGroups: keys aún no contadas como expiradas, agrupadas por expiración
+"""
+
+from typing import List, Tuple
+
+
+class IndexedHeap:
+    """Min-heap de registros (enteros >= 0) por prioridad.
+
+    `priorities` y `slots` guardan las entradas del heap y `positions[registro]`
+    su posición + 1 (0 si no está en el heap); `size` es una secuencia de un
+    elemento con el número de entradas. Si `priorities` y `slots` son arrays
+    se amplían al llenarse; `positions` debe cubrir todos los registros.
+    """
+
+    def __init__(self, priorities, slots, positions, size):
+        self.priorities = priorities
+        self.slots = slots
+        self.positions = positions
+        self.size = size
+
+    def __len__(self):
+        return self.size[0]
+
+    def __contains__(self, slot: int) -> bool:
+        return self.positions[slot] > 0
+
+    def peek(self) -> Tuple[float, int]:
+        """(prioridad, registro) de la entrada mínima (con el heap no vacío)"""
+        return self.priorities[0], self.slots[0]
+
+    def priority(self, slot: int) -> float:
+        """Prioridad de un registro que está en el heap"""
+        return self.priorities[self.positions[slot] - 1]
+
+    def push(self, slot: int, priority: float):
+        n = self.size[0]
+        if n == len(self.priorities):
+            self.priorities.append(priority)
+            self.slots.append(slot)
+        self.size[0] = n + 1
+        self._sift_up(n, slot, priority)
+
+    def update(self, slot: int, priority: float):
+        """Cambia la prioridad de un registro que está en el heap"""
+        self._place(self.positions[slot] - 1, slot, priority)
+
+    def remove(self, slot: int) -> bool:
+        """Saca un registro del heap; False si no estaba"""
+        i = self.positions[slot] - 1
+        if i < 0:
+            return False
+        self.positions[slot] = 0
+        n = self.size[0] - 1
+        self.size[0] = n
+        if i < n:
+            # La última entrada ocupa el hueco
+            self._place(i, self.slots[n], self.priorities[n])
+        return True
+
+    def _place(self, i: int, slot: int, priority: float):
+        if i > 0 and priority < self.priorities[(i - 1) >> 1]:
+            self._sift_up(i, slot, priority)
+        else:
+            self._sift_down(i, slot, priority)
+
+    def _sift_up(self, i: int, slot: int, priority: float):
+        priorities, slots, positions = self.priorities, self.slots, self.positions
+        while i > 0:
+            parent = (i - 1) >> 1
+            if priorities[parent] <= priority:
+                break
+            moved = slots[parent]
+            priorities[i] = priorities[parent]
+            slots[i] = moved
+            positions[moved] = i + 1
+            i = parent
+        priorities[i] = priority
+        slots[i] = slot
+        positions[slot] = i + 1
+
+    def _sift_down(self, i: int, slot: int, priority: float):
+        priorities, slots, positions = self.priorities, self.slots, self.positions
+        n = self.size[0]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and priorities[child + 1] < priorities[child]:
+                child += 1
+            if priorities[child] >= priority:
+                break
+            moved = slots[child]
+            priorities[i] = priorities[child]
+            slots[i] = moved
+            positions[moved] = i + 1
+            i = child
+        priorities[i] = priority
+        slots[i] = slot
+        positions[slot] = i + 1
+
+
+class ExpiryGroups:
+    """Keys aún no contadas como expiradas, agrupadas por (expires_at, etiqueta).
+
+    Las keys creadas seguidas con la misma expiración y etiqueta (un
+    create_many) forman un grupo con una sola entrada en el heap, así que
+    contar como expiradas las keys de un lote cuesta lo mismo que una sola.
+    Una key cuenta como expirada si su expires_at es anterior a la marca
+    `watermark`, que advance() hace avanzar.
+
+    `heap` ordena los grupos pendientes por expires_at; `expires`, `counts` y
+    `tags` son los campos de cada grupo, `free` la pila de grupos libres y
+    `slot_groups[registro]` el grupo de cada key. `state` guarda [grupos
+    libres en `free`, grupos usados, último grupo + 1] y `watermark`, la marca;
+    ambos son secuencias, como `size` en IndexedHeap. Los arrays de grupos se
+    amplían si son arrays; `slot_groups` debe cubrir todos los registros.
+    """
+
+    def __init__(self, heap: IndexedHeap, expires, counts, tags, slot_groups, free, state, watermark):
+        self.heap = heap
+        self.expires = expires
+        self.counts = counts
+        self.tags = tags
+        self.slot_groups = slot_groups
+        self.free = free
+        self.state = state
+        self.watermark = watermark
+
+    def add(self, slot: int, expires_at: float, tag: int = 0) -> bool:
+        """Añade una key; devuelve True si ya cuenta como expirada"""
+        state = self.state
+        group = state[2] - 1
+        if group < 0 or self.expires[group] != expires_at or self.tags[group] != tag or not self.counts[group]:
+            group = self._allocate()
+            self.expires[group] = expires_at
+            self.counts[group] = 0
+            self.tags[group] = tag
+            state[2] = group + 1
+            if expires_at >= self.watermark[0]:
+                self.heap.push(group, expires_at)
+        self.counts[group] += 1
+        self.slot_groups[slot] = group
+        return group not in self.heap
+
+    def remove(self, slot: int) -> Tuple[bool, int]:
+        """Quita una key; devuelve (ya contaba como expirada, etiqueta de su grupo)"""
+        group = self.slot_groups[slot]
+        counted = group not in self.heap
+        self.counts[group] -= 1
+        if not self.counts[group]:
+            self.heap.remove(group)
+            self._release(group)
+        return counted, self.tags[group]
+
+    def advance(self, now: float) -> List[Tuple[int, int]]:
+        """Cuenta como expiradas las keys con expires_at < now; devuelve [(etiqueta, keys)]"""
+        heap = self.heap
+        expired = []
+        while len(heap) and heap.peek()[0] < now:
+            group = heap.peek()[1]
+            heap.remove(group)
+            expired.append((self.tags[group], self.counts[group]))
+        if now > self.watermark[0]:
+            self.watermark[0] = now
+        return expired
+
+    def _allocate(self) -> int:
+        state = self.state
+        if state[0]:
+            state[0] -= 1
+            return self.free[state[0]]
+        group = state[1]
+        state[1] = group + 1
+        if group == len(self.expires):
+            self.expires.append(0.0)
+            self.counts.append(0)
+            self.tags.append(0)
+            self.heap.positions.append(0)
+        return group
+
+    def _release(self, group: int):
+        state = self.state
+        if state[0] == len(self.free):
+            self.free.append(group)
+        else:
+            self.free[state[0]] = group
+        state[0] += 1
+        if state[2] == group + 1:
+            state[2] = 0
@@ -0,0 +1,455 @@
+"""
+🔐 Almacenamiento por hash de la key
+Almacenamiento en memoria del proceso que no guarda las keys en claro: cada
+key se identifica por los 16 bytes de su BLAKE2b, en una tabla hash de
+direccionamiento abierto sobre arrays compactos (un array por campo, indexado
+por número de registro). Una validación calcula el hash una vez y lo busca en
+la tabla; la key en claro solo aparece en la respuesta de generación.
+
+Los listados muestran el identificador de cada key ("h." + hash en
+hexadecimal), que sirve para revocarla pero no para validarla.
+
+Frente a MemoryKeyStore (un dict de KeyRecord, heaps de expiración e índices
+con la key como cadena), cada key ocupa unos pocos campos de tamaño fijo:
+ver benchmarks/bench_hashed_store.py. Los índices de expiración también son
+arrays (expiryindex.py), así que las estadísticas y el desalojo no recorren
+la tabla.
+"""
+
+import hashlib
+from array import array
+from bisect import bisect_right
+from itertools import compress
+from typing import Dict, List, Optional
+
+from counters import (
+    TOTAL, ACTIVE, REVOKED, EXPIRED, EXHAUSTED, USES,
+    GENERATED, HOURLY_USES, HOURLY_REVOKED, KeyCounters, hour_of, state_dict,
+)
+from store import (
+    STATUS_VALID, STATUS_INVALID, STATUS_REVOKED, STATUS_EXPIRED, STATUS_EXHAUSTED, STATUS_RATE_LIMITED,
+    KeyRecord, KeyStore, gcra,
+)
+from expiryindex import ExpiryGroups, IndexedHeap
+
+DIGEST_SIZE = 16
+KEY_ID_PREFIX = "h."
+_KEY_ID_LENGTH = len(KEY_ID_PREFIX) + 2 * DIGEST_SIZE
+
+# Máxima ocupación de la tabla hash (incluidas las lápidas) antes de reconstruirla
+_MAX_LOAD = 0.5
+_MIN_INDEX_SIZE = 16
+
+_NEVER = float("inf")
+
+
+def key_digest(key: str) -> bytes:
+    """Hash de 16 bytes con el que se almacena una key"""
+    return hashlib.blake2b(key.encode("utf-8", "surrogatepass"), digest_size=DIGEST_SIZE).digest()
+
+
+class HashedKeyStore(KeyStore):
+    """Keys indexadas por su BLAKE2b de 16 bytes en arrays de tamaño fijo por campo.
+
+    Los registros eliminados se reutilizan (lista de libres); las keys de cada
+    usuario forman una lista doblemente enlazada y un array de (seq, registro)
+    da el orden de creación, como en la tabla compartida (sharedstore.py).
+    """
+
+    def __init__(self, hourly_window: int = 48):
+        self._digests = bytearray()
+        # Campos por registro; seq 0 indica un registro libre
+        self._seqs = array("q")
+        self._users = array("i")
+        self._created = array("d")
+        self._expires = array("d")
+        self._max_uses = array("q")
+        self._uses = array("q")
+        self._active = bytearray()
+        self._rate_limits = array("q")
+        self._rate_windows = array("d")
+        self._tats = array("d")
+        self._prev = array("i")
+        self._next = array("i")
+        # Posición en el heap de desalojo y grupo de expiración de cada registro
+        self._eviction_positions = array("i")
+        self._expiry_groups = array("i")
+        self._columns = (
+            self._seqs, self._users, self._created, self._expires, self._max_uses,
+            self._uses, self._active, self._rate_limits, self._rate_windows, self._tats,
+            self._prev, self._next, self._eviction_positions, self._expiry_groups,
+        )
+        self._free = array("i")
+        self._live = 0
+
+        # Tabla hash: número de registro + 1 (0 vacía, -1 lápida)
+        self._index = array("i", bytes(4 * _MIN_INDEX_SIZE))
+        self._index_mask = _MIN_INDEX_SIZE - 1
+        self._index_used = 0
+
+        # Usuarios: nombre (una sola cadena por usuario), primera y última key y número de keys
+        self._user_names: List[Optional[str]] = []
+        self._user_ids: Dict[str, int] = {}
+        self._user_heads = array("i")
+        self._user_tails = array("i")
+        self._user_counts = array("i")
+        self._free_users = array("i")
+
+        # Orden de creación para la paginación; las entradas de registros
+        # eliminados se saltan y se compactan cuando son mayoría
+        self._next_seq = 1
+        self._order_seqs = array("q")
+        self._order_slots = array("i")
+        self._order_stale = 0
+
+        # Índices de expiración, como los heaps de MemoryKeyStore: registros por
+        # momento de desalojo (expires_at, o el momento en que se agotó) y keys
+        # aún no contadas como expiradas, agrupadas por lote y usuario
+        self._eviction = IndexedHeap(array("d"), array("i"), self._eviction_positions, array("q", [0]))
+        self._pending_expiry = ExpiryGroups(
+            IndexedHeap(array("d"), array("i"), array("i"), array("q", [0])),
+            array("d"), array("i"), array("i"), self._expiry_groups, array("i"),
+            array("q", [0, 0, 0]), array("d", [0.0])
+        )
+
+        self._counters = KeyCounters(hourly_window)
+
+    # Tabla hash
+
+    def _find(self, digest: bytes) -> int:
+        """Registro con ese hash, o -1 si no existe"""
+        index, mask, digests = self._index, self._index_mask, self._digests
+        i = int.from_bytes(digest, "little") & mask
+        while True:
+            entry = index[i]
+            if entry == 0:
+                return -1
+            if entry > 0:
+                start = (entry - 1) * DIGEST_SIZE
+                if digests[start:start + DIGEST_SIZE] == digest:
+                    return entry - 1
+            i = (i + 1) & mask
+
+    def _lookup(self, key: str) -> int:
+        """Registro de una key en claro o de su identificador ("h." + hash), o -1"""
+        if len(key) == _KEY_ID_LENGTH and key.startswith(KEY_ID_PREFIX):
+            try:
+                return self._find(bytes.fromhex(key[len(KEY_ID_PREFIX):]))
+            except ValueError:
+                pass
+        return self._find(key_digest(key))
+
+    def _index_insert(self, digest: bytes, slot: int):
+        index, mask = self._index, self._index_mask
+        i = int.from_bytes(digest, "little") & mask
+        while index[i] > 0:
+            i = (i + 1) & mask
+        if index[i] == 0:
+            self._index_used += 1
+        index[i] = slot + 1
+
+    def _index_remove(self, digest: bytes, slot: int):
+        index, mask = self._index, self._index_mask
+        i = int.from_bytes(digest, "little") & mask
+        while index[i] != slot + 1:
+            i = (i + 1) & mask
+        # La lápida sigue contando como ocupada hasta la siguiente reconstrucción
+        index[i] = -1
+
+    def _rebuild_index(self, live: int):
+        """Reconstruye la tabla sin lápidas, a la mitad de la ocupación máxima"""
+        size = _MIN_INDEX_SIZE
+        while size * _MAX_LOAD < 2 * live:
+            size *= 2
+        index = array("i", bytes(4 * size))
+        mask = size - 1
+        digests = self._digests
+        for slot in compress(range(len(self._seqs)), self._seqs):
+            start = slot * DIGEST_SIZE
+            i = int.from_bytes(digests[start:start + DIGEST_SIZE], "little") & mask
+            while index[i]:
+                i = (i + 1) & mask
+            index[i] = slot + 1
+        self._index, self._index_mask, self._index_used = index, mask, self._live
+
+    # Registros y usuarios
+
+    def _digest(self, slot: int) -> bytes:
+        start = slot * DIGEST_SIZE
+        return bytes(self._digests[start:start + DIGEST_SIZE])
+
+    def _record(self, slot: int) -> KeyRecord:
+        return KeyRecord(
+            KEY_ID_PREFIX + self._digest(slot).hex(), self._user_names[self._users[slot]],
+            self._created[slot], self._expires[slot], self._max_uses[slot], self._uses[slot],
+            bool(self._active[slot]), self._seqs[slot],
+            self._rate_limits[slot], self._rate_windows[slot], self._tats[slot]
+        )
+
+    def _user_slots(self, user_id: str) -> List[int]:
+        """Registros de un usuario en orden de creación"""
+        uid = self._user_ids.get(user_id)
+        slots = []
+        slot = self._user_heads[uid] if uid is not None else -1
+        while slot >= 0:
+            slots.append(slot)
+            slot = self._next[slot]
+        return slots
+
+    def _add_user(self, user_id: str) -> int:
+        """Entrada de un usuario, creándola si aún no tiene keys"""
+        uid = self._user_ids.get(user_id)
+        if uid is not None:
+            return uid
+        if self._free_users:
+            uid = self._free_users.pop()
+            self._user_names[uid] = user_id
+            self._user_heads[uid] = self._user_tails[uid] = -1
+        else:
+            uid = len(self._user_names)
+            self._user_names.append(user_id)
+            self._user_heads.append(-1)
+            self._user_tails.append(-1)
+            self._user_counts.append(0)
+        self._user_ids[user_id] = uid
+        return uid
+
+    def _insert(self, key: str, user_id: str, created_at: float, expires_at: float, max_uses: int,
+                rate_limit: int, rate_limit_window: float) -> int:
+        digest = key_digest(key)
+        if self._find(digest) >= 0:
+            raise ValueError("La key ya existe")
+        # Se reconstruye antes de ocupar el registro nuevo, que se inserta después
+        if self._index_used + 1 > _MAX_LOAD * (self._index_mask + 1):
+            self._rebuild_index(self._live + 1)
+        uid = self._add_user(user_id)
+        tail = self._user_tails[uid]
+        seq = self._next_seq
+        self._next_seq += 1
+        values = (
+            seq, uid, created_at, expires_at, max_uses,
+            0, 1, rate_limit, rate_limit_window, 0.0, tail, -1, 0, 0,
+        )
+
+        # Registro libre: primero los liberados, después uno nuevo al final
+        if self._free:
+            slot = self._free.pop()
+            self._digests[slot * DIGEST_SIZE:(slot + 1) * DIGEST_SIZE] = digest
+            for column, value in zip(self._columns, values):
+                column[slot] = value
+        else:
+            slot = len(self._seqs)
+            self._digests += digest
+            for column, value in zip(self._columns, values):
+                column.append(value)
+
+        # Al final de la lista del usuario
+        if tail >= 0:
+            self._next[tail] = slot
+        else:
+            self._user_heads[uid] = slot
+        self._user_tails[uid] = slot
+        self._user_counts[uid] += 1
+
+        self._index_insert(digest, slot)
+        self._eviction.push(slot, expires_at)
+        self._order_seqs.append(seq)
+        self._order_slots.append(slot)
+        self._live += 1
+        return slot
+
+    def _remove(self, slot: int):
+        """Elimina una key de la tabla, de su usuario y de los contadores"""
+        uid = self._users[slot]
+        user_id = self._user_names[uid]
+        counters = self._counters
+        counters.add(user_id, ACTIVE if self._active[slot] else REVOKED, -1)
+        if self._uses[slot] >= self._max_uses[slot]:
+            counters.add(user_id, EXHAUSTED, -1)
+        if self._pending_expiry.remove(slot)[0]:
+            counters.add(user_id, EXPIRED, -1)
+        counters.add(user_id, USES, -self._uses[slot])
+        # TOTAL al final: al llegar a 0 se elimina la entrada del usuario
+        counters.add(user_id, TOTAL, -1)
+
+        prev, nxt = self._prev[slot], self._next[slot]
+        if prev >= 0:
+            self._next[prev] = nxt
+        else:
+            self._user_heads[uid] = nxt
+        if nxt >= 0:
+            self._prev[nxt] = prev
+        else:
+            self._user_tails[uid] = prev
+        self._user_counts[uid] -= 1
+        if not self._user_counts[uid]:
+            del self._user_ids[user_id]
+            self._user_names[uid] = None
+            self._free_users.append(uid)
+
+        self._index_remove(self._digest(slot), slot)
+        self._eviction.remove(slot)
+        self._seqs[slot] = 0
+        self._expires[slot] = _NEVER
+        self._free.append(slot)
+        self._live -= 1
+
+        self._order_stale += 1
+        if self._order_stale > len(self._order_seqs) // 2:
+            self._compact_order()
+
+    def _compact_order(self):
+        """Elimina del orden de creación los registros eliminados"""
+        seqs = self._seqs
+        alive = [(seq, slot) for seq, slot in zip(self._order_seqs, self._order_slots) if seqs[slot] == seq]
+        self._order_seqs = array("q", [seq for seq, _ in alive])
+        self._order_slots = array("i", [slot for _, slot in alive])
+        self._order_stale = 0
+
+    def memory_bytes(self) -> int:
+        """Bytes de los arrays de la tabla (sin los nombres de usuario ni los contadores)"""
+        groups = self._pending_expiry
+        arrays = (
+            *self._columns, self._index, self._free, self._order_seqs, self._order_slots,
+            self._eviction.priorities, self._eviction.slots, groups.heap.priorities, groups.heap.slots,
+            groups.heap.positions, groups.expires, groups.counts, groups.tags, groups.free,
+        )
+        return len(self._digests) + sum(len(column) * getattr(column, "itemsize", 1) for column in arrays)
+
+    # Interfaz KeyStore
+
+    def create(self, key, user_id, created_at, expires_at, max_uses, rate_limit=0, rate_limit_window=0.0):
+        slot = self._insert(key, user_id, created_at, expires_at, max_uses, rate_limit, float(rate_limit_window))
+        counters = self._counters
+        counters.add(user_id, TOTAL)
+        counters.add(user_id, ACTIVE)
+        counters.event(created_at, GENERATED)
+        if self._pending_expiry.add(slot, expires_at, self._users[slot]):
+            counters.add(user_id, EXPIRED)
+        return self._record(slot)
+
+    def consume(self, key, now):
+        slot = self._find(key_digest(key))
+        if slot < 0:
+            return STATUS_INVALID, None
+        if not self._active[slot]:
+            return STATUS_REVOKED, None
+        if now > self._expires[slot]:
+            return STATUS_EXPIRED, None
+        uses, max_uses = self._uses[slot], self._max_uses[slot]
+        if uses >= max_uses:
+            return STATUS_EXHAUSTED, None
+        rate_limit = self._rate_limits[slot]
+        if rate_limit:
+            tat = gcra(self._tats[slot], now, rate_limit, self._rate_windows[slot])
+            if tat is None:
+                return STATUS_RATE_LIMITED, None
+            self._tats[slot] = tat
+
+        uses += 1
+        self._uses[slot] = uses
+        user_id = self._user_names[self._users[slot]]
+        self._counters.add(user_id, USES)
+        self._counters.event(now, HOURLY_USES)
+        if uses >= max_uses:
+            # Agotada: se desaloja a partir de ahora en lugar de al expirar
+            if now < self._eviction.priority(slot):
+                self._eviction.update(slot, now)
+            self._counters.add(user_id, EXHAUSTED)
+        return STATUS_VALID, self._record(slot)
+
+    def get(self, key):
+        # Solo con la key en claro: /key-info es público
+        slot = self._find(key_digest(key))
+        return self._record(slot) if slot >= 0 else None
+
+    def list(self):
+        for slot in compress(range(len(self._seqs)), self._seqs):
+            yield self._record(slot)
+
+    def page(self, after, limit, key_filter, now):
+        records = []
+        if key_filter.user_id is not None:
+            slots = self._user_slots(key_filter.user_id)
+            seqs = [self._seqs[slot] for slot in slots]
+        else:
+            slots, seqs = self._order_slots, self._order_seqs
+        for i in range(bisect_right(seqs, after), len(slots)):
+            slot = slots[i]
+            if self._seqs[slot] != seqs[i]:
+                continue
+            record = self._record(slot)
+            if not key_filter.matches(record, now):
+                continue
+            records.append(record)
+            if len(records) == limit:
+                more = i + 1 < len(slots)
+                return records, record.seq if more else None
+        return records, None
+
+    def revoke(self, key, now):
+        slot = self._lookup(key)
+        if slot < 0:
+            return False
+        if self._active[slot]:
+            self._active[slot] = 0
+            user_id = self._user_names[self._users[slot]]
+            self._counters.add(user_id, ACTIVE, -1)
+            self._counters.add(user_id, REVOKED)
+            self._counters.event(now, HOURLY_REVOKED)
+        return True
+
+    def user_keys(self, user_id):
+        return [self._record(slot) for slot in self._user_slots(user_id)]
+
+    def revoke_user(self, user_id, now):
+        revoked = 0
+        for slot in self._user_slots(user_id):
+            if self._active[slot]:
+                self._active[slot] = 0
+                revoked += 1
+        if revoked:
+            self._counters.add(user_id, ACTIVE, -revoked)
+            self._counters.add(user_id, REVOKED, revoked)
+            self._counters.event(now, HOURLY_REVOKED, revoked)
+        return revoked
+
+    def _advance_expired(self, now: float):
+        """Cuenta como expiradas las keys cuyo expires_at ya pasó (O(log n) por lote de keys)"""
+        names = self._user_names
+        for uid, count in self._pending_expiry.advance(now):
+            self._counters.add(names[uid], EXPIRED, count)
+
+    def stats(self, now):
+        self._advance_expired(now)
+        stats = state_dict(self._counters.totals)
+        stats["hourly"] = self._counters.hourly_list(hour_of(now) - self._counters.hourly_window * 3600)
+        return stats
+
+    def user_stats(self, user_id, now):
+        self._advance_expired(now)
+        values = self._counters.user(user_id)
+        return state_dict(values) if values is not None else None
+
+    def users_stats(self, now):
+        self._advance_expired(now)
+        return {user_id: state_dict(values) for user_id, values in self._counters.users.items()}
+
+    def evict(self, cutoff, limit):
+        # El heap solo contiene keys vivas: cada entrada extraída es una key desalojada
+        expired = exhausted = 0
+        evicted = []
+        heap = self._eviction
+        while len(heap) and expired + exhausted < limit:
+            at, slot = heap.peek()
+            if at > cutoff:
+                break
+            if self._uses[slot] >= self._max_uses[slot]:
+                exhausted += 1
+            else:
+                expired += 1
+            evicted.append(KEY_ID_PREFIX + self._digest(slot).hex())
+            self._remove(slot)
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+        return expired, exhausted
@@ -0,0 +1,110 @@
+"""
+🔁 Peticiones idempotentes
+Caché de resultados por cabecera Idempotency-Key para que los reintentos de
+un cliente (timeouts, cortes de red) no generen keys nuevas: una petición
+repetida recibe el resultado de la primera sin volver a generar ni almacenar
+nada.
+
+Los resultados viven en un LRU con caducidad (TTL) en la memoria de cada
+proceso, acotado por número de entradas y por keys guardadas en total: con
+varios workers, una repetición que llega a otro worker no se reconoce y
+genera keys nuevas.
+"""
+
+import time
+from collections import OrderedDict
+from typing import Any, Callable, List, Tuple
+
+# Longitud máxima de la cabecera Idempotency-Key
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyConflict(Exception):
+    """La misma Idempotency-Key se reutilizó con una petición distinta"""
+
+
+class IdempotencyCache:
+    """Resultados por Idempotency-Key en un LRU de como máximo `max_entries`
+    entradas y `max_keys` keys generadas entre todas ellas"""
+
+    def __init__(self, max_entries: int, ttl: float, max_keys: int, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.clock = clock
+        # Entradas: [caduca, huella de la petición, resultado, keys del resultado]
+        self._entries: "OrderedDict[str, List[Any]]" = OrderedDict()
+        self._keys = 0
+
+        # Métricas
+        self.hits = 0
+        self.conflicts = 0
+        self.evictions = 0
+        self.oversized = 0
+
+    def run(self, key: str, fingerprint: bytes, produce: Callable[[], Any],
+            size: Callable[[Any], int] = lambda result: 1) -> Tuple[Any, bool]:
+        """Devuelve (resultado, repetida): el de `produce()` la primera vez y el
+        guardado en las repeticiones con la misma huella.
+
+        `produce()` es síncrono: ninguna otra petición del proceso se ejecuta
+        mientras tanto, así que no hay repeticiones que esperen a una petición en
+        curso. Si falla no se guarda nada y la excepción llega a la petición.
+        `size(resultado)` es el número de keys que se cuentan para `max_keys`.
+        """
+        entry = self._lookup(key)
+        if entry is not None:
+            if entry[1] != fingerprint:
+                self.conflicts += 1
+                raise IdempotencyConflict(key)
+            self.hits += 1
+            return entry[2], True
+
+        result = produce()
+        keys = size(result)
+        if keys > self.max_keys:
+            # No cabe ni sola: se responde sin guardarla
+            self.oversized += 1
+            return result, False
+        self._entries[key] = [self.clock() + self.ttl, fingerprint, result, keys]
+        self._keys += keys
+        self._evict()
+        return result, False
+
+    def _lookup(self, key: str):
+        """Entrada vigente de `key` (las caducadas se eliminan)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[0] <= self.clock():
+            del self._entries[key]
+            self._keys -= entry[3]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _evict(self):
+        """Elimina las entradas caducadas más antiguas y las que sobran del LRU"""
+        entries = self._entries
+        now = self.clock()
+        while entries:
+            oldest = next(iter(entries.values()))
+            if oldest[0] > now and len(entries) <= self.max_entries and self._keys <= self.max_keys:
+                return
+            _, entry = entries.popitem(last=False)
+            self._keys -= entry[3]
+            self.evictions += 1
+
+    def metrics(self) -> dict:
+        """Métricas de la caché para el endpoint de estadísticas"""
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "keys": self._keys,
+            "max_keys": self.max_keys,
+            "ttl_seconds": self.ttl,
+            "replayed": self.hits,
+            "conflicts": self.conflicts,
+            "evictions": self.evictions,
+            "oversized": self.oversized,
+        }
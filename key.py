@@ -1,16 +1,43 @@
 """
 🔑 Generador de Keys - Script para crear nuevas keys de acceso
 Conecta con la API local para generar keys únicas
+
+Modo interactivo: python key.py
+Modo masivo:      ADMIN_TOKEN=... python key.py --bulk usuarios.csv --output keys.jsonl
+
+En modo masivo se lee un CSV (con cabecera) o JSONL con las columnas user_id,
+duration_hours, max_uses y, opcionalmente, count (keys por fila, generadas con
+POST /generate-keys) y la cuota por ventana rate_limit (usos) y rate_limit_window
+(segundos, 60 por defecto). Las keys se generan en paralelo con conexiones
+reutilizadas, reintentos y espera exponencial. Código de salida: 0 si todas
+las filas se generaron y 1 si alguna falló.
 """
 
+import argparse
+import csv
+import os
 import requests
+import secrets
 import json
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configuración de la API
 API_BASE_URL = "http://127.0.0.1:8000"
-ADMIN_TOKEN = "admin_token_123"  # Token de administrador
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "admin_token_123")  # Token de administrador
+
+# Modo masivo: reintentos (solo errores de conexión y respuestas en las que el
+# servidor no llegó a generar la key) y cada cuántos segundos se muestra el progreso
+BULK_RETRIES = 5
+BULK_BACKOFF_SECONDS = 0.5
+BULK_RETRY_STATUSES = (429, 503)
+BULK_PROGRESS_SECONDS = 2.0
 
 def print_banner():
     """Muestra el banner del generador de keys"""
@@ -159,7 +186,203 @@ def main():
     print("\n" + "=" * 60)
     input("Presiona Enter para salir...")
 
+# ---------------------------------------------------------------------------
+# Modo masivo
+# ---------------------------------------------------------------------------
+
+_thread_local = threading.local()
+
+def get_session():
+    """Sesión HTTP del hilo actual con reintentos y espera exponencial"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        # Las lecturas fallidas (timeouts) no se reintentan: el servidor puede haber
+        # generado ya las keys y la Idempotency-Key solo evita duplicados si el
+        # reintento llega al mismo worker (la caché es de cada proceso)
+        retries = Retry(
+            total=BULK_RETRIES, connect=BULK_RETRIES, read=0,
+            status=BULK_RETRIES, status_forcelist=BULK_RETRY_STATUSES,
+            allowed_methods=frozenset({"POST"}), backoff_factor=BULK_BACKOFF_SECONDS,
+            respect_retry_after_header=True, raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        session.headers["Authorization"] = f"Bearer {ADMIN_TOKEN}"
+        _thread_local.session = session
+    return session
+
+def read_rows(stream, jsonl):
+    """Lee las filas de entrada como stream: (número de línea, dict o línea JSON sin decodificar)"""
+    if jsonl:
+        for number, line in enumerate(stream, 1):
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield number, line
+    else:
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+
+def parse_row(row):
+    """Valida una fila y devuelve (user_id, duration_hours, max_uses, count, cuota)
+
+    La cuota son los campos rate_limit y rate_limit_window del payload (vacía si
+    la fila no tiene rate_limit).
+    """
+    if isinstance(row, str):
+        row = json.loads(row)
+    if not isinstance(row, dict):
+        raise ValueError("se esperaba un objeto JSON")
+    user_id = str(row.get("user_id") or "").strip()
+    if not user_id:
+        raise ValueError("user_id vacío")
+    duration_hours = int(row.get("duration_hours") or 24)
+    max_uses = int(row.get("max_uses") or 1)
+    count = int(row.get("count") or 1)
+    if duration_hours <= 0 or max_uses <= 0 or count <= 0:
+        raise ValueError("duration_hours, max_uses y count deben ser mayores a 0")
+    quota = {}
+    if row.get("rate_limit"):
+        quota = {"rate_limit": int(row["rate_limit"]), "rate_limit_window": int(row.get("rate_limit_window") or 60)}
+        if quota["rate_limit"] <= 0 or quota["rate_limit_window"] <= 0:
+            raise ValueError("rate_limit y rate_limit_window deben ser mayores a 0")
+    return user_id, duration_hours, max_uses, count, quota
+
+def provision_row(base_url, line, row):
+    """Genera las keys de una fila; nunca lanza excepciones"""
+    try:
+        user_id, duration_hours, max_uses, count, quota = parse_row(row)
+    except (ValueError, TypeError) as e:
+        return [{"line": line, "error": f"Fila inválida: {str(e)}"}]
+
+    base = {"line": line, "user_id": user_id, "duration_hours": duration_hours, "max_uses": max_uses}
+    payload = {"user_id": user_id, "duration_hours": duration_hours, "max_uses": max_uses, **quota}
+    # La misma en todos los reintentos de la fila
+    headers = {"Idempotency-Key": secrets.token_urlsafe(16)}
+    try:
+        if count == 1:
+            response = get_session().post(f"{base_url}/generate-key", json=payload, headers=headers, timeout=30)
+        else:
+            response = get_session().post(
+                f"{base_url}/generate-keys", json={**payload, "count": count}, headers=headers, timeout=120
+            )
+        if response.status_code != 200:
+            return [{**base, "error": f"HTTP {response.status_code}: {response.text[:200]}"}]
+
+        data = response.json()["data"]
+        keys = [data["key"]] if count == 1 else data["keys"]
+        return [{**base, "key": key, "expires_at": data["expires_at"]} for key in keys]
+    except requests.exceptions.RequestException as e:
+        return [{**base, "error": f"Error de conexión: {str(e)}"}]
+    except (ValueError, KeyError) as e:
+        return [{**base, "error": f"Respuesta inesperada: {str(e)}"}]
+
+class BulkWriter:
+    """Escribe los resultados en JSONL o CSV y muestra el progreso por stderr"""
+
+    CSV_FIELDS = ("line", "user_id", "duration_hours", "max_uses", "key", "expires_at", "error")
+
+    def __init__(self, output, format):
+        self.output = output
+        self.csv = csv.DictWriter(output, self.CSV_FIELDS, lineterminator="\n") if format == "csv" else None
+        if self.csv is not None:
+            self.csv.writeheader()
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.rows = 0
+        self.keys = 0
+        self.errors = 0
+
+    def write(self, results):
+        if self.csv is not None:
+            self.csv.writerows(results)
+        else:
+            self.output.write("".join(json.dumps(result, ensure_ascii=False) + "\n" for result in results))
+        self.rows += 1
+        for result in results:
+            if "error" in result:
+                self.errors += 1
+            else:
+                self.keys += 1
+        now = time.perf_counter()
+        if now - self.last_report >= BULK_PROGRESS_SECONDS:
+            self.last_report = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        prefix = "🏁 Total" if final else "⏳ Progreso"
+        print(
+            f"{prefix}: {self.rows} filas | 🔑 {self.keys} keys | ❌ {self.errors} errores | "
+            f"{self.keys / elapsed:.0f} keys/s | {elapsed:.1f}s",
+            file=sys.stderr
+        )
+
+def run_bulk(args):
+    """Genera las keys de un CSV/JSONL y escribe el resultado en formato legible por máquinas"""
+    base_url = args.url.rstrip("/")
+    if not check_api_status():
+        print(f"❌ Error: La API no está funcionando en {base_url}", file=sys.stderr)
+        return 1
+
+    jsonl = args.input_format == "jsonl" or (
+        args.input_format == "auto" and args.bulk.endswith((".jsonl", ".ndjson"))
+    )
+    window = args.window or args.workers * 2
+    print(
+        f"🚀 Generación masiva contra {base_url} ({'JSONL' if jsonl else 'CSV'}, "
+        f"{args.workers} conexiones, hasta {window} peticiones en curso)",
+        file=sys.stderr
+    )
+
+    source = sys.stdin if args.bulk == "-" else open(args.bulk, encoding="utf-8", newline="")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8", newline="")
+    writer = BulkWriter(output, args.format)
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            # Ventana acotada de peticiones en curso; los resultados se escriben en orden de entrada
+            pending = deque()
+            for line, row in read_rows(source, jsonl):
+                if len(pending) >= window:
+                    writer.write(pending.popleft().result())
+                pending.append(executor.submit(provision_row, base_url, line, row))
+            while pending:
+                writer.write(pending.popleft().result())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    writer.report(final=True)
+    return 1 if writer.errors else 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generador de keys (interactivo o masivo)")
+    parser.add_argument("--bulk", metavar="ARCHIVO", help="genera keys para las filas de ARCHIVO (o '-' para stdin) sin preguntar")
+    parser.add_argument("--input-format", choices=("auto", "csv", "jsonl"), default="auto", help="formato de entrada (por defecto según la extensión; CSV para stdin)")
+    parser.add_argument("--output", default="-", help="archivo de resultados (por defecto stdout)")
+    parser.add_argument("--format", choices=("jsonl", "csv"), default="jsonl", help="formato de salida (por defecto jsonl)")
+    parser.add_argument("--url", default=API_BASE_URL, help=f"URL de la API (por defecto {API_BASE_URL})")
+    parser.add_argument("--workers", type=int, default=8, help="conexiones simultáneas (por defecto 8)")
+    parser.add_argument("--window", type=int, default=0, help="peticiones en curso como máximo (por defecto 2 x workers)")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    API_BASE_URL = args.url.rstrip("/")
+    if args.bulk:
+        try:
+            sys.exit(run_bulk(args))
+        except KeyboardInterrupt:
+            print("\n⚠️  Operación cancelada por el usuario", file=sys.stderr)
+            sys.exit(130)
+        except (OSError, csv.Error) as e:
+            print(f"❌ {str(e)}", file=sys.stderr)
+            sys.exit(1)
+
     try:
         main()
     except KeyboardInterrupt:
@@ -1,23 +1,91 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import FastAPI, HTTPException, Depends, Header, Query, Request, WebSocket, WebSocketDisconnect, status
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from pydantic import BaseModel
-from typing import List, Optional
+from fastapi.requests import HTTPConnection
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from pydantic import BaseModel, Field
+from typing import Any, Callable, List, Optional, Tuple
+from contextlib import asynccontextmanager
+import asyncio
+import csv
+import hashlib
+import io
 import json
 import os
 import secrets
 import string
-from datetime import datetime, timedelta
-from cryptography.fernet import Fernet
-import base64
+import time
+from datetime import datetime
+
+import config
+from store import (
+    STATUS_VALID, STATUS_INVALID, STATUS_REVOKED, STATUS_EXPIRED, STATUS_EXHAUSTED, STATUS_RATE_LIMITED,
+    KeyFilter, StoreBusy, create_key_store, quota_dict, to_iso,
+)
+from sweeper import ExpirySweeper
+from bloom import NegativeCache
+from tokens import KEY_ID_LENGTH, KeySigner, derive_key, is_signed_key
+from responses import FastJSONResponse, ResponseTemplate, api_body, dumps
+from metrics import Metrics, MetricsMiddleware
+from audit import AuditLog, key_fingerprint
+from changes import ChangeFeed
+from idempotency import MAX_KEY_LENGTH, IdempotencyCache, IdempotencyConflict
+from ratelimit import LocalBuckets, RateLimiter, RateLimitMiddleware, SharedBuckets, parse_limits
+
+# Tareas en segundo plano durante la vida de la aplicación
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Arranca las tareas en segundo plano al iniciar y las detiene al apagar"""
+    tasks = []
+    audit_task = asyncio.create_task(audit_log.run()) if audit_log is not None else None
+    if replica is not None:
+        tasks.append(asyncio.create_task(replica.run()))
+    elif config.SWEEP_INTERVAL_SECONDS > 0:
+        # En una réplica las keys se desalojan siguiendo los eventos del primario
+        tasks.append(asyncio.create_task(sweeper.run()))
+    if negative_cache is not None:
+        if not negative_cache.ready:
+            await rebuild_negative_cache()
+        tasks.append(asyncio.create_task(negative_cache_loop()))
+    yield
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if replica is not None:
+        await replica.close()
+    if audit_task is not None:
+        # Se escriben los eventos pendientes antes de salir
+        audit_log.close()
+        await audit_task
 
 # Crear la aplicación FastAPI
 app = FastAPI(
     title="Key Generator & Validator API",
     description="API para generar y verificar keys de acceso",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
+# Límite de peticiones por cliente (se añade antes que CORS para que las
+# respuestas 429 también lleven las cabeceras CORS)
+rate_limiter = None
+rate_limits = parse_limits(config.RATE_LIMITS)
+if rate_limits:
+    if config.RATE_LIMIT_SHARED_PATH:
+        # Un bucket inactivo más que su tiempo de recarga completa equivale a uno lleno
+        max_idle = max(burst / rate for rate, burst in rate_limits.values())
+        rate_buckets = SharedBuckets(config.RATE_LIMIT_SHARED_PATH, max_idle, config.SQLITE_BUSY_TIMEOUT_MS)
+    else:
+        rate_buckets = LocalBuckets(config.RATE_LIMIT_MAX_CLIENTS)
+    rate_limiter = RateLimiter(
+        rate_limits,
+        rate_buckets,
+        clock=time.time,
+        by_key_prefix=config.RATE_LIMIT_BY_KEY_PREFIX,
+        trust_forwarded=config.RATE_LIMIT_TRUST_FORWARDED
+    )
+    app.add_middleware(RateLimitMiddleware, limiter=rate_limiter, routes=app.routes)
+
 # Configurar CORS
 app.add_middleware(
     CORSMiddleware,
@@ -27,23 +95,165 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Configuración de seguridad
-SECRET_KEY = Fernet.generate_key()
-cipher_suite = Fernet(SECRET_KEY)
+# Métricas Prometheus (el middleware más externo: mide también las respuestas 429)
+request_metrics = Metrics(
+    (STATUS_VALID, STATUS_INVALID, STATUS_REVOKED, STATUS_EXPIRED, STATUS_EXHAUSTED, STATUS_RATE_LIMITED)
+)
+app.add_middleware(MetricsMiddleware, metrics=request_metrics)
+
+# Configuración de seguridad (SECRET_KEY viene de la configuración, compartida por todos los workers)
+SECRET_KEY = config.SECRET_KEY
+key_signer = KeySigner(derive_key(SECRET_KEY, b"key-signing"))
 security = HTTPBearer()
 
-# Almacenamiento de keys (en producción usarías una base de datos)
-keys_database = {}
+# Tokens de administrador (en producción, verificarías contra una base de datos de tokens válidos)
+ADMIN_TOKENS = ["admin_token_123", "super_admin_456"]  # Ejemplo
+
+# Perfilado de peticiones (desactivado si PROFILING es false: sin middleware).
+# Es el middleware más externo, así que sus pilas incluyen también los demás
+profiler = None
+if config.PROFILING:
+    from profiler import Profiler, ProfilerMiddleware
+    profiler = Profiler(
+        config.PROFILE_SAMPLE_RATE,
+        config.PROFILE_INTERVAL_SECONDS,
+        config.PROFILE_MAX_STACKS,
+        ADMIN_TOKENS
+    )
+    app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+# Almacenamiento de keys (backend configurable: memoria, SQLite, memoria compartida
+# o memoria por hash; una réplica guarda siempre su copia en memoria)
+key_store = create_key_store(
+    "memory" if config.REPLICA_OF else config.KEY_STORE_BACKEND, config.KEY_STORE_PATH,
+    config.STATS_HOURLY_WINDOW, config.SHARED_STORE_CAPACITY, config.SQLITE_BUSY_TIMEOUT_MS
+)
+
+# Modo réplica: copia de solo lectura que sigue el feed de cambios del primario
+replica = None
+if config.REPLICA_OF:
+    from replica import PrimaryUnavailable, Replica, check_key
+    replica = Replica(config.REPLICA_OF, config.REPLICA_TOKEN, key_store)
+
+# Feed de cambios para las réplicas (desactivado si CHANGE_FEED_SIZE es 0)
+change_feed = None
+if config.CHANGE_FEED_SIZE > 0 and replica is None:
+    if config.KEY_STORE_BACKEND == "hashed":
+        # Los eventos y la instantánea llevan las keys en claro, que este backend no guarda
+        raise ValueError("El feed de cambios (CHANGE_FEED_SIZE) no es compatible con KEY_STORE=hashed")
+    change_feed = ChangeFeed(config.CHANGE_FEED_SIZE)
+    key_store.on_evict = lambda keys: change_feed.append("evict", time.time(), keys=keys)
+
+# Desalojo de keys expiradas y agotadas
+sweeper = ExpirySweeper(
+    key_store,
+    interval=config.SWEEP_INTERVAL_SECONDS,
+    grace=config.EVICTION_GRACE_SECONDS,
+    batch_size=config.SWEEP_BATCH_SIZE
+)
+
+
+@app.exception_handler(StoreBusy)
+async def store_busy_handler(request: Request, exc: StoreBusy):
+    """Otro proceso tiene bloqueada la base de datos (KEY_STORE=sqlite): 503, no 500"""
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Almacenamiento ocupado, reintenta en unos instantes"},
+        headers={"Retry-After": "1"}
+    )
+
+# Caché negativa de keys inexistentes (filtro de Bloom)
+# (no en una réplica: sus keys llegan por el feed sin pasar por los endpoints; ni con
+# el backend "hashed": la reconstrucción necesita las keys en claro)
+negative_cache = None
+if replica is None and config.KEY_STORE_BACKEND != "hashed" and (
+    config.NEGATIVE_CACHE == "on" or (config.NEGATIVE_CACHE == "auto" and config.KEY_STORE_BACKEND == "memory")
+):
+    # Con el backend en memoria el almacenamiento empieza vacío: el filtro ya está listo
+    negative_cache = NegativeCache(
+        config.NEGATIVE_CACHE_CAPACITY,
+        config.NEGATIVE_CACHE_FP_RATE,
+        ready=config.KEY_STORE_BACKEND == "memory"
+    )
+
+# Registro de auditoría (desactivado si AUDIT_LOG_DIR está vacío)
+audit_log = None
+if config.AUDIT_LOG_DIR:
+    audit_log = AuditLog(
+        config.AUDIT_LOG_DIR,
+        segment_bytes=config.AUDIT_SEGMENT_BYTES,
+        flush_interval=config.AUDIT_FLUSH_SECONDS,
+        batch_size=config.AUDIT_BATCH_SIZE,
+        queue_size=config.AUDIT_QUEUE_SIZE
+    )
+
+# Resultados de /generate-key y /generate-keys por Idempotency-Key (desactivado con 0 entradas)
+idempotency_cache = None
+if config.IDEMPOTENCY_MAX_ENTRIES > 0:
+    idempotency_cache = IdempotencyCache(
+        config.IDEMPOTENCY_MAX_ENTRIES, config.IDEMPOTENCY_TTL_SECONDS, config.IDEMPOTENCY_MAX_KEYS
+    )
+
+# Número máximo de keys por petición de validación por lotes
+MAX_BATCH_SIZE = 1000
+
+# Tamaño máximo de página de GET /keys y tamaño de los bloques de la exportación NDJSON
+MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 500
+
+# Mensajes de validación por estado
+VALIDATION_MESSAGES = {
+    STATUS_VALID: "Key válida",
+    STATUS_INVALID: "Key inválida",
+    STATUS_REVOKED: "Key revocada",
+    STATUS_EXPIRED: "Key expirada",
+    STATUS_EXHAUSTED: "Key ha alcanzado el límite de usos",
+    STATUS_RATE_LIMITED: "Key ha superado su cuota de usos; reintenta más tarde",
+}
+_OUTCOMES_BY_MESSAGE = {message: outcome for outcome, message in VALIDATION_MESSAGES.items()}
+
+# Respuestas de fallo precodificadas (mismo formato que ApiResponse; solo cambia el timestamp)
+FAILURE_TEMPLATES = {
+    outcome: ResponseTemplate(False, message)
+    for outcome, message in VALIDATION_MESSAGES.items()
+    if outcome != STATUS_VALID
+}
+_KEY_NOT_FOUND_BODY = dumps({"detail": "Key no encontrada"})
+
+def failure_response(outcome: str, now: float) -> Response:
+    """Respuesta de validación fallida sin pasar por ApiResponse"""
+    return Response(FAILURE_TEMPLATES[outcome].render(to_iso(now)), media_type="application/json")
+
+def json_response(content) -> JSONResponse:
+    """JSONResponse, o FastJSONResponse con FAST_RESPONSES activado"""
+    if config.FAST_RESPONSES:
+        return FastJSONResponse(content)
+    return JSONResponse(content)
 
 # Modelos de datos
+# max_uses se guarda como entero de 64 bits con signo (y sin signo en las keys
+# firmadas, ver issue_keys); la expiración tiene que caber en un datetime; la
+# tabla compartida guarda rate_limit en 32 bits
+MAX_USES_LIMIT = 2 ** 63 - 1
+MAX_DURATION_HOURS = 100 * 365 * 24
+MAX_RATE_LIMIT = 2 ** 31 - 1
+
 class KeyRequest(BaseModel):
     user_id: str
-    duration_hours: int = 24  # Duración por defecto: 24 horas
-    max_uses: int = 1  # Usos máximos por defecto: 1
+    duration_hours: int = Field(24, ge=-MAX_DURATION_HOURS, le=MAX_DURATION_HOURS)  # Duración por defecto: 24 horas
+    max_uses: int = Field(1, ge=-MAX_USES_LIMIT - 1, le=MAX_USES_LIMIT)  # Usos máximos por defecto: 1
+    rate_limit: Optional[int] = Field(None, ge=1, le=MAX_RATE_LIMIT)  # Usos máximos por ventana (None: sin cuota)
+    rate_limit_window: int = Field(60, ge=1, le=MAX_DURATION_HOURS * 3600)  # Duración de la ventana de la cuota en segundos
+
+class KeyBatchRequest(KeyRequest):
+    count: int = Field(..., ge=1)
 
 class KeyValidation(BaseModel):
     key: str
 
+class KeyBatchValidation(BaseModel):
+    keys: List[str]
+
 class KeyInfo(BaseModel):
     key: str
     user_id: str
@@ -52,6 +262,12 @@ class KeyInfo(BaseModel):
     max_uses: int
     current_uses: int
     is_active: bool
+    rate_limit: Optional[int] = None
+    rate_limit_window: Optional[float] = None
+
+class KeyPage(BaseModel):
+    items: List[KeyInfo]
+    next_cursor: Optional[str] = None
 
 class ApiResponse(BaseModel):
     success: bool
@@ -59,38 +275,253 @@ class ApiResponse(BaseModel):
     data: Optional[dict] = None
     timestamp: str
 
+# Alfabeto de las keys y tabla para traducir bytes aleatorios a caracteres.
+# Los bytes >= 248 (el mayor múltiplo de 62 que cabe en un byte) se descartan
+# para que todos los caracteres sean equiprobables (sin sesgo de módulo)
+KEY_ALPHABET = string.ascii_letters + string.digits
+_KEY_BYTE_LIMIT = 256 - 256 % len(KEY_ALPHABET)
+_KEY_TABLE = bytes(ord(KEY_ALPHABET[b % len(KEY_ALPHABET)]) for b in range(256))
+_KEY_REJECTED = bytes(range(_KEY_BYTE_LIMIT, 256))
+
+# Función para generar keys únicas en bloque
+def generate_keys(count: int, length: int = 32) -> List[str]:
+    """Genera `count` keys seguras con lecturas de aleatoriedad en bloque"""
+    needed = count * length
+    chars = b""
+    while len(chars) < needed:
+        # Se descarta ~3% de los bytes: se pide un pequeño margen extra
+        missing = needed - len(chars)
+        raw = secrets.token_bytes(missing + missing // 16 + 16)
+        chars += raw.translate(_KEY_TABLE, _KEY_REJECTED)
+    text = chars[:needed].decode("ascii")
+    return [text[i:i + length] for i in range(0, needed, length)]
+
 # Función para generar keys únicas
 def generate_key(length: int = 32) -> str:
     """Genera una key única y segura"""
-    alphabet = string.ascii_letters + string.digits
-    return ''.join(secrets.choice(alphabet) for _ in range(length))
+    return generate_keys(1, length)[0]
+
+# Función para emitir keys en el formato configurado
+def issue_keys(count: int, user_id: str, now: float, duration_hours: int, max_uses: int):
+    """Genera `count` keys y devuelve (keys, expires_at)
+
+    Con KEY_FORMAT=signed cada key lleva sus datos firmados; la expiración se
+    redondea al segundo para coincidir con la que va dentro de la key.
+    """
+    expires_at = now + duration_hours * 3600
+    if config.KEY_FORMAT != "signed":
+        return generate_keys(count), expires_at
+
+    expires_at = float(int(expires_at))
+    if max_uses < 0 or expires_at < 0:
+        # Van dentro de la key como enteros de 64 bits sin signo
+        raise HTTPException(
+            status_code=422,
+            detail="Las keys firmadas necesitan max_uses >= 0 y una expiración posterior a 1970"
+        )
+    keys = [
+        key_signer.sign(key_id, user_id, int(expires_at), max_uses)
+        for key_id in generate_keys(count, KEY_ID_LENGTH)
+    ]
+    return keys, expires_at
+
+# Función para rechazar keys sin consultar el almacenamiento
+def precheck_key(key: str, now: float) -> Optional[str]:
+    """Rechaza en CPU las keys firmadas falsificadas, mal formadas o expiradas
+    y las keys que la caché negativa sabe que no existen.
+
+    Devuelve None si hay que consultar el almacenamiento.
+    """
+    if is_signed_key(key):
+        claims = key_signer.verify(key)
+        if claims is None:
+            return STATUS_INVALID
+        if now > claims.expires_at:
+            return STATUS_EXPIRED
+    if negative_cache is not None and not negative_cache.might_contain(key):
+        return STATUS_INVALID
+    return None
+
+# Función para contar los falsos positivos de la caché negativa
+def note_store_miss(outcome: str):
+    """Cuenta una key que pasó la caché negativa pero no existe en el almacenamiento"""
+    if outcome == STATUS_INVALID and negative_cache is not None and negative_cache.ready:
+        negative_cache.false_positives += 1
+
+# Funciones para los datos de las respuestas de validación
+def validation_data(record, now: float) -> dict:
+    """Datos de una validación correcta; incluye la cuota si la key tiene"""
+    data = {
+        "user_id": record.user_id,
+        "remaining_uses": record.max_uses - record.current_uses,
+        "expires_at": to_iso(record.expires_at)
+    }
+    if record.rate_limit:
+        data["quota"] = quota_dict(record, now)
+    return data
+
+def quota_exceeded_data(key: str, now: float) -> Optional[dict]:
+    """Datos de una validación rechazada por la cuota: cuándo se puede reintentar"""
+    record = key_store.get(key)
+    if record is None or not record.rate_limit:
+        return None
+    return {"quota": quota_dict(record, now)}
+
+# Función para identificar al cliente en el registro de auditoría
+def client_host(connection: HTTPConnection) -> Optional[str]:
+    """IP del cliente que hizo la petición (o abrió el WebSocket)"""
+    return connection.client.host if connection.client else None
+
+# Función para validar y consumir una key
+def consume_key(key: str, now: float):
+    """Como KeyStore.consume, pero rechaza antes las keys firmadas inválidas y publica el consumo en el feed"""
+    outcome = precheck_key(key, now)
+    if outcome is not None:
+        return outcome, None
+    outcome, record = key_store.consume(key, now)
+    note_store_miss(outcome)
+    if record is not None and change_feed is not None:
+        change_feed.append("consume", now, key=key, uses=record.current_uses)
+    return outcome, record
+
+def record_validation(key: str, now: float, outcome: str, record, client: Optional[str]):
+    """Cuenta una validación en las métricas y la registra en la auditoría"""
+    request_metrics.validation(outcome)
+    if audit_log is not None:
+        audit_log.record(
+            "validate", now, client=client, key=key_fingerprint(key),
+            outcome=outcome, user_id=record.user_id if record is not None else None
+        )
+
+def validation_result(key: str, now: float, outcome: str, record) -> dict:
+    """success, message y data de la respuesta de /validate-key para un resultado"""
+    message = VALIDATION_MESSAGES[outcome]
+    if outcome == STATUS_RATE_LIMITED:
+        return {"success": False, "message": message, "data": quota_exceeded_data(key, now)}
+    if record is None:
+        return {"success": False, "message": message, "data": None}
+    return {"success": True, "message": message, "data": validation_data(record, now)}
+
+# Función para validar y consumir varias keys
+def consume_keys(keys: List[str], now: float):
+    """Como KeyStore.consume_many, pero rechaza antes las keys firmadas inválidas"""
+    outcomes = [precheck_key(key, now) for key in keys]
+    pending = [key for key, outcome in zip(keys, outcomes) if outcome is None]
+    consumed = key_store.consume_many(pending, now) if pending else []
+    for outcome, _ in consumed:
+        note_store_miss(outcome)
+    consumed = iter(consumed)
+    return [next(consumed) if outcome is None else (outcome, None) for outcome in outcomes]
+
+# Reconstrucción periódica de la caché negativa
+async def rebuild_negative_cache():
+    """Reconstruye el filtro desde el almacenamiento por bloques, cediendo el bucle de eventos"""
+    new_filter = negative_cache.start_rebuild(key_store.stats(time.time())["total_keys"])
+    after = 0
+    key_filter = KeyFilter()
+    while after is not None:
+        records, after = key_store.page(after, EXPORT_CHUNK_SIZE, key_filter, 0.0)
+        for record in records:
+            new_filter.add(record.key)
+        await asyncio.sleep(0)
+    negative_cache.finish_rebuild()
+
+async def negative_cache_loop():
+    """Reconstruye la caché cada NEGATIVE_CACHE_REBUILD_SECONDS o cuando se llena"""
+    loop = asyncio.get_running_loop()
+    last_rebuild = loop.time()
+    while True:
+        await asyncio.sleep(min(config.NEGATIVE_CACHE_REBUILD_SECONDS, 5))
+        if negative_cache.overfull or loop.time() - last_rebuild >= config.NEGATIVE_CACHE_REBUILD_SECONDS:
+            await rebuild_negative_cache()
+            last_rebuild = loop.time()
+
+# Cifrado Fernet: cryptography se importa en el primer uso para no pagar su
+# carga en el arranque en frío (ningún endpoint lo usa en cada petición)
+_cipher_suite = None
+
+def get_cipher_suite():
+    """Devuelve el cifrador Fernet, creándolo en la primera llamada"""
+    global _cipher_suite
+    if _cipher_suite is None:
+        import base64
+        from cryptography.fernet import Fernet
+        _cipher_suite = Fernet(base64.urlsafe_b64encode(derive_key(SECRET_KEY, b"fernet")))
+    return _cipher_suite
 
 # Función para encriptar datos
 def encrypt_data(data: str) -> str:
     """Encripta datos usando Fernet"""
-    return cipher_suite.encrypt(data.encode()).decode()
+    return get_cipher_suite().encrypt(data.encode()).decode()
 
 # Función para desencriptar datos
 def decrypt_data(encrypted_data: str) -> str:
     """Desencripta datos usando Fernet"""
     try:
-        return cipher_suite.decrypt(encrypted_data.encode()).decode()
+        return get_cipher_suite().decrypt(encrypted_data.encode()).decode()
     except:
         return None
 
 # Función para verificar token de administrador
 async def verify_admin_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
     """Verifica si el token es válido para operaciones de administrador"""
-    # En producción, verificarías contra una base de datos de tokens válidos
-    admin_tokens = ["admin_token_123", "super_admin_456"]  # Ejemplo
-    
-    if credentials.credentials not in admin_tokens:
+    if credentials.credentials not in ADMIN_TOKENS:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Token de administrador inválido"
         )
     return credentials.credentials
 
+# Función para rechazar escrituras en una réplica
+async def primary_only():
+    """Las réplicas son de solo lectura: las escrituras se hacen en el primario"""
+    if replica is not None:
+        raise HTTPException(
+            status_code=status.HTTP_405_METHOD_NOT_ALLOWED,
+            detail=f"Réplica de solo lectura; usa el primario: {replica.primary_url}"
+        )
+
+# Función para reenviar al primario las validaciones que consumen usos
+async def forward_to_primary(path: str, payload: dict):
+    """Reenvía una validación al primario y devuelve su respuesta httpx"""
+    try:
+        return await replica.forward(path, payload)
+    except PrimaryUnavailable:
+        raise HTTPException(status_code=503, detail="Primario no disponible")
+
+def forwarded_outcome(result: dict) -> str:
+    """Estado de validación que corresponde al mensaje de una respuesta del primario"""
+    return _OUTCOMES_BY_MESSAGE.get(result.get("message"), STATUS_INVALID)
+
+# Función para no repetir la generación en los reintentos de un cliente
+_REPLAYED_HEADERS = {"Idempotent-Replayed": "true"}
+
+def run_idempotent(idempotency_key: Optional[str], route: str, admin_token: str, request_data: Any,
+                   produce: Callable[[], Any], size: Callable[[Any], int] = lambda result: 1) -> Tuple[Any, bool]:
+    """Ejecuta `produce()` una sola vez por Idempotency-Key y devuelve (resultado, repetida)
+
+    Las keys de idempotencia son propias de cada token de administrador y ruta;
+    reutilizar una con otros datos de petición responde 422. `size` da las keys
+    de un resultado (límite IDEMPOTENCY_MAX_KEYS).
+    """
+    if idempotency_key is None or idempotency_cache is None:
+        return produce(), False
+    if not idempotency_key or len(idempotency_key) > MAX_KEY_LENGTH:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Idempotency-Key debe tener entre 1 y {MAX_KEY_LENGTH} caracteres"
+        )
+
+    scope = f"{key_fingerprint(admin_token)}:{route}:{idempotency_key}"
+    fingerprint = hashlib.blake2b(dumps(request_data), digest_size=16).digest()
+    try:
+        return idempotency_cache.run(scope, fingerprint, produce, size)
+    except IdempotencyConflict:
+        raise HTTPException(
+            status_code=422,
+            detail="Idempotency-Key ya usada con una petición distinta"
+        )
+
 # Endpoints
 @app.get("/")
 async def root():
@@ -102,10 +533,16 @@ async def root():
         "timestamp": datetime.now().isoformat(),
         "endpoints": {
             "generate_key": "/generate-key",
+            "generate_keys": "/generate-keys",
             "validate_key": "/validate-key",
+            "validate_keys": "/validate-keys",
+            "validate_websocket": "/ws/validate",
             "get_key_info": "/key-info/{key}",
             "list_keys": "/keys",
-            "revoke_key": "/revoke-key/{key}"
+            "revoke_key": "/revoke-key/{key}",
+            "user_keys": "/users/{user_id}/keys",
+            "changes": "/changes",
+            "metrics": "/metrics"
         }
     }
 
@@ -114,147 +551,766 @@ async def health_check():
     """Verificar el estado de la API"""
     return {"status": "healthy", "timestamp": datetime.now().isoformat()}
 
-@app.post("/generate-key", response_model=ApiResponse)
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Métricas de este worker en formato de texto de Prometheus"""
+    return Response(
+        request_metrics.render(key_store.stats(time.time())),
+        media_type="text/plain; version=0.0.4"
+    )
+
+def create_key(key_request: KeyRequest, admin_token: str):
+    """Genera y almacena una key; devuelve (datos de la respuesta, instante de creación)"""
+    # Generar key única y calcular fechas (epoch en segundos)
+    now = time.time()
+    (new_key,), expires_at = issue_keys(
+        1, key_request.user_id, now, key_request.duration_hours, key_request.max_uses
+    )
+
+    # Almacenar en la base de datos
+    key_store.create(
+        new_key, key_request.user_id, now, expires_at, key_request.max_uses,
+        key_request.rate_limit or 0, key_request.rate_limit_window
+    )
+    if negative_cache is not None:
+        negative_cache.add(new_key)
+    if change_feed is not None:
+        change_feed.append(
+            "create", now, keys=[new_key], user_id=key_request.user_id,
+            created_at=now, expires_at=expires_at, max_uses=key_request.max_uses,
+            rate_limit=key_request.rate_limit or 0, rate_limit_window=key_request.rate_limit_window
+        )
+    request_metrics.generated += 1
+    if audit_log is not None:
+        audit_log.record(
+            "generate", now, actor=key_fingerprint(admin_token),
+            user_id=key_request.user_id, key=key_fingerprint(new_key), count=1
+        )
+
+    data = {
+        "key": new_key,
+        "user_id": key_request.user_id,
+        "expires_at": to_iso(expires_at),
+        "max_uses": key_request.max_uses
+    }
+    if key_request.rate_limit:
+        data["rate_limit"] = key_request.rate_limit
+        data["rate_limit_window"] = key_request.rate_limit_window
+    return data, now
+
+@app.post("/generate-key", response_model=ApiResponse, dependencies=[Depends(primary_only)])
 async def generate_key_endpoint(
     key_request: KeyRequest,
-    admin_token: str = Depends(verify_admin_token)
+    response: Response,
+    admin_token: str = Depends(verify_admin_token),
+    idempotency_key: Optional[str] = Header(None)
 ):
-    """Genera una nueva key de acceso"""
+    """Genera una nueva key de acceso
+
+    Con la cabecera `Idempotency-Key`, repetir la petición devuelve la misma
+    respuesta (con `Idempotent-Replayed: true`) sin generar otra key.
+    """
     try:
-        # Generar key única
-        new_key = generate_key()
-        
-        # Calcular fechas
-        now = datetime.now()
-        expires_at = now + timedelta(hours=key_request.duration_hours)
-        
-        # Crear información de la key
-        key_info = {
-            "key": new_key,
-            "user_id": key_request.user_id,
-            "created_at": now.isoformat(),
-            "expires_at": expires_at.isoformat(),
-            "max_uses": key_request.max_uses,
-            "current_uses": 0,
-            "is_active": True
-        }
-        
-        # Almacenar en la base de datos
-        keys_database[new_key] = key_info
-        
+        (data, now), replayed = run_idempotent(
+            idempotency_key, "/generate-key", admin_token, dict(key_request),
+            lambda: create_key(key_request, admin_token)
+        )
+        headers = _REPLAYED_HEADERS if replayed else None
+        if config.FAST_RESPONSES:
+            return Response(
+                api_body(True, "Key generada exitosamente", data, to_iso(now)),
+                media_type="application/json",
+                headers=headers
+            )
+
+        if headers:
+            response.headers.update(headers)
         return ApiResponse(
             success=True,
             message="Key generada exitosamente",
-            data={
-                "key": new_key,
-                "user_id": key_request.user_id,
-                "expires_at": expires_at.isoformat(),
-                "max_uses": key_request.max_uses
-            },
-            timestamp=now.isoformat()
+            data=data,
+            timestamp=to_iso(now)
+        )
+
+    except (HTTPException, StoreBusy):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+def _generated_rows(keys: List[str], user_id: str, expires_at: str, max_uses: int, format: str):
+    """Genera la salida de /generate-keys por bloques en NDJSON o CSV"""
+    for start in range(0, len(keys), EXPORT_CHUNK_SIZE):
+        chunk = keys[start:start + EXPORT_CHUNK_SIZE]
+        if format == "ndjson":
+            yield "".join(
+                json.dumps(
+                    {"key": key, "user_id": user_id, "expires_at": expires_at, "max_uses": max_uses},
+                    ensure_ascii=False, separators=(",", ":")
+                ) + "\n"
+                for key in chunk
+            )
+        else:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer, lineterminator="\n")
+            if start == 0:
+                writer.writerow(("key", "user_id", "expires_at", "max_uses"))
+            writer.writerows((key, user_id, expires_at, max_uses) for key in chunk)
+            yield buffer.getvalue()
+
+def create_keys(batch_request: KeyBatchRequest, admin_token: str):
+    """Genera y almacena un lote de keys; devuelve (keys, expiración ISO, instante de creación)"""
+    now = time.time()
+    new_keys, expires_at = issue_keys(
+        batch_request.count, batch_request.user_id, now,
+        batch_request.duration_hours, batch_request.max_uses
+    )
+    key_store.create_many(
+        new_keys, batch_request.user_id, now, expires_at, batch_request.max_uses,
+        batch_request.rate_limit or 0, batch_request.rate_limit_window
+    )
+    if negative_cache is not None:
+        negative_cache.add_many(new_keys)
+    if change_feed is not None:
+        change_feed.append(
+            "create", now, keys=new_keys, user_id=batch_request.user_id,
+            created_at=now, expires_at=expires_at, max_uses=batch_request.max_uses,
+            rate_limit=batch_request.rate_limit or 0, rate_limit_window=batch_request.rate_limit_window
+        )
+    request_metrics.generated += len(new_keys)
+    if audit_log is not None:
+        audit_log.record(
+            "generate", now, actor=key_fingerprint(admin_token),
+            user_id=batch_request.user_id, count=len(new_keys)
+        )
+    return new_keys, to_iso(expires_at), now
+
+@app.post("/generate-keys", response_model=ApiResponse, dependencies=[Depends(primary_only)])
+async def generate_keys_endpoint(
+    batch_request: KeyBatchRequest,
+    format: str = Query("json", pattern="^(json|ndjson|csv)$"),
+    admin_token: str = Depends(verify_admin_token),
+    idempotency_key: Optional[str] = Header(None)
+):
+    """Genera varias keys con los mismos parámetros (solo administradores)
+
+    Todas las keys se almacenan en una sola transacción. Con `format=ndjson`
+    o `format=csv` el resultado se envía como stream. Con la cabecera
+    `Idempotency-Key`, repetir la petición devuelve las mismas keys.
+    """
+    if batch_request.count > config.MAX_GENERATE_COUNT:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {config.MAX_GENERATE_COUNT} keys por petición"
         )
-        
+
+    try:
+        # La caché guarda la lista de keys (las mismas cadenas que el almacenamiento)
+        # y la respuesta se vuelve a formatear en cada repetición
+        (new_keys, expires_iso, now), replayed = run_idempotent(
+            idempotency_key, "/generate-keys", admin_token, {**dict(batch_request), "format": format},
+            lambda: create_keys(batch_request, admin_token), lambda result: len(result[0])
+        )
+        headers = _REPLAYED_HEADERS if replayed else None
+
+        if format != "json":
+            media_type = "application/x-ndjson" if format == "ndjson" else "text/csv"
+            return StreamingResponse(
+                _generated_rows(new_keys, batch_request.user_id, expires_iso, batch_request.max_uses, format),
+                media_type=media_type,
+                headers=headers
+            )
+
+        # Se devuelve JSONResponse para no revalidar la lista de keys contra ApiResponse
+        response = json_response(content={
+            "success": True,
+            "message": "Keys generadas exitosamente",
+            "data": {
+                "count": len(new_keys),
+                "user_id": batch_request.user_id,
+                "expires_at": expires_iso,
+                "max_uses": batch_request.max_uses,
+                "keys": new_keys
+            },
+            "timestamp": to_iso(now)
+        })
+        if headers:
+            response.headers.update(headers)
+        return response
+
+    except (HTTPException, StoreBusy):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 @app.post("/validate-key", response_model=ApiResponse)
-async def validate_key_endpoint(key_validation: KeyValidation):
+async def validate_key_endpoint(key_validation: KeyValidation, request: Request):
     """Valida una key de acceso"""
     try:
         key = key_validation.key
-        
-        if key not in keys_database:
-            return ApiResponse(
-                success=False,
-                message="Key inválida",
-                timestamp=datetime.now().isoformat()
-            )
-        
-        key_info = keys_database[key]
-        
-        # Verificar si la key está activa
-        if not key_info["is_active"]:
+        now = time.time()
+        if replica is not None:
+            # La réplica responde los rechazos; las keys válidas consumen usos en el primario
+            outcome = precheck_key(key, now) or check_key(key_store, key, now)
+            if outcome == STATUS_VALID:
+                response = await forward_to_primary("/validate-key", {"key": key})
+                if response.status_code == 200:
+                    request_metrics.validation(forwarded_outcome(response.json()))
+                return Response(response.content, status_code=response.status_code, media_type="application/json")
+            record = None
+        else:
+            outcome, record = consume_key(key, now)
+        record_validation(key, now, outcome, record, client_host(request) if audit_log is not None else None)
+
+        if outcome == STATUS_RATE_LIMITED:
+            # Como el resto de rechazos, pero indicando cuándo reintentar
+            data = quota_exceeded_data(key, now)
+            if config.FAST_RESPONSES:
+                return Response(
+                    api_body(False, VALIDATION_MESSAGES[outcome], data, to_iso(now)),
+                    media_type="application/json"
+                )
             return ApiResponse(
                 success=False,
-                message="Key revocada",
-                timestamp=datetime.now().isoformat()
+                message=VALIDATION_MESSAGES[outcome],
+                data=data,
+                timestamp=to_iso(now)
             )
-        
-        # Verificar si ha expirado
-        expires_at = datetime.fromisoformat(key_info["expires_at"])
-        if datetime.now() > expires_at:
+
+        if outcome == STATUS_INVALID or (record is None and config.FAST_RESPONSES):
+            return failure_response(outcome, now)
+
+        if record is None:
             return ApiResponse(
                 success=False,
-                message="Key expirada",
-                timestamp=datetime.now().isoformat()
+                message=VALIDATION_MESSAGES[outcome],
+                timestamp=to_iso(now)
             )
-        
-        # Verificar si se ha excedido el límite de usos
-        if key_info["current_uses"] >= key_info["max_uses"]:
-            return ApiResponse(
-                success=False,
-                message="Key ha alcanzado el límite de usos",
-                timestamp=datetime.now().isoformat()
+
+        data = validation_data(record, now)
+        if config.FAST_RESPONSES:
+            return Response(
+                api_body(True, VALIDATION_MESSAGES[outcome], data, to_iso(now)),
+                media_type="application/json"
             )
-        
-        # Incrementar contador de usos
-        key_info["current_uses"] += 1
-        
+
         return ApiResponse(
             success=True,
-            message="Key válida",
-            data={
-                "user_id": key_info["user_id"],
-                "remaining_uses": key_info["max_uses"] - key_info["current_uses"],
-                "expires_at": key_info["expires_at"]
-            },
-            timestamp=datetime.now().isoformat()
+            message=VALIDATION_MESSAGES[outcome],
+            data=data,
+            timestamp=to_iso(now)
+        )
+
+    except (HTTPException, StoreBusy):
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/validate-keys", response_model=ApiResponse)
+async def validate_keys_endpoint(batch: KeyBatchValidation, request: Request):
+    """Valida varias keys en una sola petición, manteniendo el orden de entrada"""
+    if len(batch.keys) > MAX_BATCH_SIZE:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Máximo {MAX_BATCH_SIZE} keys por petición"
         )
-        
+
+    try:
+        # Un único timestamp para todo el lote
+        now = time.time()
+
+        # Los resultados fallidos son constantes y se comparten entre elementos
+        failures = {}
+        results = []
+        valid_count = 0
+        client = client_host(request) if audit_log is not None else None
+        if replica is not None:
+            return await replica_validate_keys(batch.keys, now, client)
+        for key, (outcome, record) in zip(batch.keys, consume_keys(batch.keys, now)):
+            if record is not None and change_feed is not None:
+                change_feed.append("consume", now, key=key, uses=record.current_uses)
+            record_validation(key, now, outcome, record, client)
+            message = VALIDATION_MESSAGES[outcome]
+            if outcome == STATUS_RATE_LIMITED:
+                results.append({"success": False, "message": message, "data": quota_exceeded_data(key, now)})
+                continue
+            if record is None:
+                result = failures.get(message)
+                if result is None:
+                    result = failures[message] = {"success": False, "message": message, "data": None}
+                results.append(result)
+                continue
+
+            valid_count += 1
+            results.append({
+                "success": True,
+                "message": message,
+                "data": validation_data(record, now)
+            })
+
+        # Se devuelve JSONResponse para evitar revalidar el lote contra ApiResponse
+        return json_response(content={
+            "success": True,
+            "message": "Lote validado",
+            "data": {
+                "total": len(results),
+                "valid": valid_count,
+                "invalid": len(results) - valid_count,
+                "results": results
+            },
+            "timestamp": to_iso(now)
+        })
+
+    except (HTTPException, StoreBusy):
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+async def replica_validate_keys(keys: List[str], now: float, client: Optional[str]):
+    """/validate-keys en una réplica: los rechazos se responden con la copia local
+    y las keys válidas se reenvían en un solo lote al primario, que consume los usos
+    """
+    outcomes = [precheck_key(key, now) or check_key(key_store, key, now) for key in keys]
+    pending = [key for key, outcome in zip(keys, outcomes) if outcome == STATUS_VALID]
+    forwarded = iter(())
+    if pending:
+        response = await forward_to_primary("/validate-keys", {"keys": pending})
+        if response.status_code != 200:
+            return Response(response.content, status_code=response.status_code, media_type="application/json")
+        forwarded = iter(response.json()["data"]["results"])
+
+    failures = {}
+    results = []
+    for key, outcome in zip(keys, outcomes):
+        if outcome == STATUS_VALID:
+            result = next(forwarded)
+            request_metrics.validation(forwarded_outcome(result))
+            results.append(result)
+            continue
+
+        # Las validaciones reenviadas se auditan en el primario
+        request_metrics.validation(outcome)
+        if audit_log is not None:
+            audit_log.record("validate", now, client=client, key=key_fingerprint(key), outcome=outcome, user_id=None)
+        message = VALIDATION_MESSAGES[outcome]
+        result = failures.get(message)
+        if result is None:
+            result = failures[message] = {"success": False, "message": message, "data": None}
+        results.append(result)
+
+    valid_count = sum(result["success"] for result in results)
+    return json_response(content={
+        "success": True,
+        "message": "Lote validado",
+        "data": {
+            "total": len(results),
+            "valid": valid_count,
+            "invalid": len(results) - valid_count,
+            "results": results
+        },
+        "timestamp": to_iso(now)
+    })
+
+# Canal WebSocket de validación para validadores de alta frecuencia
+websocket_stats = {"connections": 0, "opened": 0, "rejected": 0, "messages": 0, "invalid_messages": 0}
+
+_WS_INVALID_MESSAGE = 'Mensaje inválido: se esperaba {"id": ..., "key": "..."}'
+
+def _ws_error(message_id, message: str, status_code: int) -> dict:
+    """Resultado de un mensaje al que /validate-key habría respondido con un error HTTP"""
+    return {"id": message_id, "success": False, "message": message, "data": None, "status": status_code}
+
+@app.websocket("/ws/validate")
+async def validate_key_websocket(websocket: WebSocket):
+    """Valida keys por un WebSocket persistente, sin el coste de una petición HTTP por key
+
+    Cada mensaje {"id": ..., "key": "..."} recibe {"id", "success", "message", "data",
+    "timestamp"} con la misma semántica que POST /validate-key (y "status" cuando el
+    endpoint HTTP habría respondido con un error). Los mensajes se pueden enviar sin
+    esperar respuesta; los resultados llevan el id del mensaje y pueden llegar en otro
+    orden: en una réplica, las keys válidas responden cuando contesta el primario.
+
+    Backpressure: con WS_MAX_IN_FLIGHT validaciones pendientes, o mientras el cliente
+    no lee sus resultados, se dejan de leer mensajes.
+    """
+    if websocket_stats["connections"] >= config.WS_MAX_CONNECTIONS:
+        websocket_stats["rejected"] += 1
+        await websocket.close(code=1013)  # Try Again Later
+        return
+    await websocket.accept()
+    websocket_stats["connections"] += 1
+    websocket_stats["opened"] += 1
+
+    client = client_host(websocket)
+    send_lock = asyncio.Lock()
+    in_flight = asyncio.Semaphore(config.WS_MAX_IN_FLIGHT)
+    pending = set()
+
+    async def send(result: dict):
+        text = dumps(result).decode()
+        async with send_lock:
+            try:
+                await websocket.send_text(text)
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                # El servidor (websockets, wsproto) lanza sus propios errores al escribir
+                # en una conexión ya cerrada: se trata como una desconexión
+                raise WebSocketDisconnect(code=1006) from e
+
+    async def forward(message_id, key: str):
+        """Reenvía al primario una key válida en la copia local (réplicas)"""
+        try:
+            try:
+                response = await forward_to_primary("/validate-key", {"key": key})
+            except HTTPException as e:
+                result = _ws_error(message_id, e.detail, e.status_code)
+            else:
+                body = response.json()
+                if response.status_code == 200:
+                    request_metrics.validation(forwarded_outcome(body))
+                    result = {"id": message_id, **body}
+                else:
+                    result = _ws_error(message_id, body.get("detail", ""), response.status_code)
+            await send(result)
+        except WebSocketDisconnect:
+            # El cliente cerró la conexión antes de recibir el resultado
+            pass
+        finally:
+            in_flight.release()
+
+    try:
+        while True:
+            text = await websocket.receive_text()
+            websocket_stats["messages"] += 1
+            now = time.time()
+            message_id = None
+            try:
+                message = json.loads(text)
+                message_id = message.get("id")
+                key = message["key"]
+                if not isinstance(key, str):
+                    raise TypeError(key)
+            except (ValueError, AttributeError, KeyError, TypeError):
+                websocket_stats["invalid_messages"] += 1
+                await send(_ws_error(message_id, _WS_INVALID_MESSAGE, 422))
+                continue
+
+            try:
+                if replica is not None:
+                    outcome = precheck_key(key, now) or check_key(key_store, key, now)
+                    if outcome == STATUS_VALID:
+                        await in_flight.acquire()
+                        task = asyncio.create_task(forward(message_id, key))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                        continue
+                    record = None
+                else:
+                    outcome, record = consume_key(key, now)
+                record_validation(key, now, outcome, record, client)
+                result = {"id": message_id, **validation_result(key, now, outcome, record), "timestamp": to_iso(now)}
+            except StoreBusy:
+                result = _ws_error(message_id, "Almacenamiento ocupado, reintenta en unos instantes", 503)
+            except Exception as e:
+                result = _ws_error(message_id, str(e), 500)
+            await send(result)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        websocket_stats["connections"] -= 1
+        for task in pending:
+            task.cancel()
+
 @app.get("/key-info/{key}", response_model=KeyInfo)
 async def get_key_info(key: str):
     """Obtiene información detallada de una key"""
-    if key not in keys_database:
+    if precheck_key(key, time.time()) == STATUS_INVALID:
+        return Response(_KEY_NOT_FOUND_BODY, status_code=404, media_type="application/json")
+
+    record = key_store.get(key)
+    if record is None:
         raise HTTPException(status_code=404, detail="Key no encontrada")
     
-    return KeyInfo(**keys_database[key])
+    return KeyInfo(**record.to_dict())
 
-@app.get("/keys", response_model=List[KeyInfo])
-async def list_keys(admin_token: str = Depends(verify_admin_token)):
-    """Lista todas las keys (solo administradores)"""
-    return [KeyInfo(**key_info) for key_info in keys_database.values()]
+def _ndjson_lines(records) -> str:
+    """Serializa registros como líneas NDJSON"""
+    return "".join(
+        json.dumps(record.to_dict(), ensure_ascii=False, separators=(",", ":")) + "\n"
+        for record in records
+    )
+
+async def _export_keys(after: int, key_filter: KeyFilter):
+    """Genera la exportación NDJSON por bloques, en memoria constante"""
+    while True:
+        records, after = key_store.page(after, EXPORT_CHUNK_SIZE, key_filter, time.time())
+        if records:
+            yield _ndjson_lines(records)
+        if after is None:
+            return
+        # Ceder el bucle de eventos entre bloques
+        await asyncio.sleep(0)
+
+@app.get("/keys", response_model=KeyPage)
+async def list_keys(
+    limit: int = Query(100, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None,
+    user_id: Optional[str] = None,
+    active: Optional[bool] = None,
+    expired: Optional[bool] = None,
+    exhausted: Optional[bool] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    format: str = Query("json", pattern="^(json|ndjson)$"),
+    admin_token: str = Depends(verify_admin_token)
+):
+    """Lista las keys por páginas en orden de creación (solo administradores)
+
+    `next_cursor` se pasa como `cursor` para obtener la siguiente página.
+    Con `format=ndjson` se exportan todas las keys que cumplen los filtros
+    como un stream NDJSON (una key por línea), ignorando `limit`.
+    """
+    try:
+        after = int(cursor) if cursor else 0
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
 
-@app.delete("/revoke-key/{key}", response_model=ApiResponse)
+    key_filter = KeyFilter(
+        user_id=user_id,
+        active=active,
+        expired=expired,
+        exhausted=exhausted,
+        created_from=created_from.timestamp() if created_from else None,
+        created_to=created_to.timestamp() if created_to else None
+    )
+
+    if format == "ndjson":
+        return StreamingResponse(_export_keys(after, key_filter), media_type="application/x-ndjson")
+
+    records, next_seq = key_store.page(after, limit, key_filter, time.time())
+    # Se devuelve JSONResponse para no construir un KeyInfo por cada key
+    return json_response(content={
+        "items": [record.to_dict() for record in records],
+        "next_cursor": str(next_seq) if next_seq is not None else None
+    })
+
+@app.delete("/revoke-key/{key}", response_model=ApiResponse, dependencies=[Depends(primary_only)])
 async def revoke_key(key: str, admin_token: str = Depends(verify_admin_token)):
     """Revoca una key (solo administradores)"""
-    if key not in keys_database:
+    now = time.time()
+    revoked = key_store.revoke(key, now)
+    if audit_log is not None:
+        audit_log.record(
+            "revoke", now, actor=key_fingerprint(admin_token), key=key_fingerprint(key), count=int(revoked)
+        )
+    if not revoked:
         raise HTTPException(status_code=404, detail="Key no encontrada")
-    
-    keys_database[key]["is_active"] = False
+    if change_feed is not None:
+        change_feed.append("revoke", now, key=key)
     
     return ApiResponse(
         success=True,
         message="Key revocada exitosamente",
         data={"key": key},
-        timestamp=datetime.now().isoformat()
+        timestamp=to_iso(now)
+    )
+
+@app.get("/users/{user_id}/keys", response_model=List[KeyInfo])
+async def list_user_keys(user_id: str, admin_token: str = Depends(verify_admin_token)):
+    """Lista las keys de un usuario en orden de creación (solo administradores)"""
+    return json_response(content=[record.to_dict() for record in key_store.user_keys(user_id)])
+
+@app.delete("/users/{user_id}/keys", response_model=ApiResponse, dependencies=[Depends(primary_only)])
+async def revoke_user_keys(user_id: str, admin_token: str = Depends(verify_admin_token)):
+    """Revoca todas las keys de un usuario (solo administradores)"""
+    now = time.time()
+    revoked = key_store.revoke_user(user_id, now)
+    if revoked and change_feed is not None:
+        change_feed.append("revoke_user", now, user_id=user_id)
+    if audit_log is not None:
+        audit_log.record(
+            "revoke", now, actor=key_fingerprint(admin_token), user_id=user_id, count=revoked
+        )
+
+    return ApiResponse(
+        success=True,
+        message="Keys del usuario revocadas exitosamente",
+        data={"user_id": user_id, "revoked": revoked},
+        timestamp=to_iso(now)
     )
 
 @app.get("/stats")
-async def get_stats(admin_token: str = Depends(verify_admin_token)):
-    """Obtiene estadísticas de las keys (solo administradores)"""
-    total_keys = len(keys_database)
-    active_keys = sum(1 for k in keys_database.values() if k["is_active"])
-    expired_keys = sum(1 for k in keys_database.values() if datetime.now() > datetime.fromisoformat(k["expires_at"]))
-    
-    return {
-        "total_keys": total_keys,
-        "active_keys": active_keys,
-        "expired_keys": expired_keys,
-        "timestamp": datetime.now().isoformat()
-    }
+async def get_stats(
+    user_id: Optional[str] = None,
+    by_user: bool = False,
+    exact: bool = False,
+    admin_token: str = Depends(verify_admin_token)
+):
+    """Obtiene estadísticas de las keys (solo administradores)
+
+    Los contadores se mantienen de forma incremental y se leen en tiempo constante.
+    - `user_id`: añade los contadores de ese usuario
+    - `by_user`: añade los contadores de todos los usuarios
+    - `exact`: recalcula los contadores recorriendo todas las keys e informa la diferencia
+    """
+    now = time.time()
+    stats = key_store.stats(now)
+    for entry in stats["hourly"]:
+        entry["hour"] = to_iso(entry["hour"])
+
+    if user_id is not None:
+        stats["user"] = key_store.user_stats(user_id, now)
+    if by_user:
+        stats["users"] = key_store.users_stats(now)
+    if exact:
+        exact_stats = key_store.exact_stats(now)
+        stats["exact"] = exact_stats
+        stats["drift"] = {field: stats[field] - value for field, value in exact_stats.items()}
+
+    stats["sweeper"] = sweeper.metrics()
+    if negative_cache is not None:
+        stats["negative_cache"] = negative_cache.metrics()
+    if rate_limiter is not None:
+        stats["rate_limit"] = rate_limiter.metrics()
+    if audit_log is not None:
+        stats["audit"] = audit_log.metrics()
+    if idempotency_cache is not None:
+        stats["idempotency"] = idempotency_cache.metrics()
+    if change_feed is not None:
+        stats["change_feed"] = change_feed.metrics()
+    if replica is not None:
+        stats["replica"] = replica.metrics()
+    stats["websocket"] = dict(websocket_stats)
+    if profiler is not None:
+        stats["profiler"] = profiler.metrics()
+    stats["timestamp"] = to_iso(now)
+    return stats
+
+# Perfilado de peticiones
+def require_profiler():
+    """404 si el perfilado está desactivado"""
+    if profiler is None:
+        raise HTTPException(status_code=404, detail="Perfilado desactivado (PROFILING=false)")
+
+@app.get("/debug/profile", response_class=PlainTextResponse)
+async def get_profile(route: Optional[str] = None, admin_token: str = Depends(verify_admin_token)):
+    """Pilas de las peticiones perfiladas en formato collapsed (solo administradores)
+
+    Cada línea es "MÉTODO ruta;marco;...;marco microsegundos", lista para
+    flamegraph.pl, inferno o speedscope. `route` filtra por plantilla de ruta.
+    """
+    require_profiler()
+    return PlainTextResponse(profiler.collapsed(route))
+
+@app.delete("/debug/profile", response_model=ApiResponse)
+async def reset_profile(admin_token: str = Depends(verify_admin_token)):
+    """Descarta las pilas acumuladas (solo administradores)"""
+    require_profiler()
+    profiler.reset()
+    return ApiResponse(
+        success=True,
+        message="Perfil reiniciado",
+        data=None,
+        timestamp=to_iso(time.time())
+    )
+
+# Feed de cambios para las réplicas de lectura
+def require_change_feed():
+    """404 si este proceso no publica feed de cambios"""
+    if change_feed is None:
+        raise HTTPException(status_code=404, detail="Feed de cambios desactivado (CHANGE_FEED_SIZE=0)")
+
+_EVENTS_GONE_DETAIL = "Los eventos pedidos ya no están en el feed; descarga /changes/snapshot"
+
+@app.get("/changes")
+async def list_changes(
+    since: int = Query(0, ge=0),
+    limit: int = Query(MAX_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    admin_token: str = Depends(verify_admin_token)
+):
+    """Eventos de cambio con seq mayor que `since` (solo administradores)
+
+    Responde 410 si alguno ya salió del buffer: hay que descargar la instantánea.
+    """
+    require_change_feed()
+    events = change_feed.since(since, limit)
+    if events is None:
+        raise HTTPException(status_code=410, detail=_EVENTS_GONE_DETAIL)
+    # Los eventos ya están serializados: se concatenan sin volver a codificarlos
+    head = dumps({"epoch": change_feed.epoch, "last_seq": change_feed.last_seq})[:-1]
+    return Response(head + b',"events":[' + b",".join(events) + b"]}", media_type="application/json")
+
+def _sse(event: str, data: dict) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + dumps(data) + b"\n\n"
+
+async def _change_stream(since: int):
+    """Stream SSE del feed: hello, eventos desde `since` y heartbeats mientras no hay cambios"""
+    yield _sse("hello", {"epoch": change_feed.epoch, "seq": change_feed.last_seq})
+    while True:
+        events = change_feed.since(since, EXPORT_CHUNK_SIZE)
+        if events is None:
+            yield _sse("reset", {"detail": _EVENTS_GONE_DETAIL})
+            return
+        if events:
+            yield b"".join(
+                b"id: %d\ndata: %s\n\n" % (seq, event) for seq, event in enumerate(events, since + 1)
+            )
+            since += len(events)
+            await asyncio.sleep(0)
+        elif not await change_feed.wait(since, config.CHANGE_FEED_HEARTBEAT_SECONDS):
+            yield _sse("heartbeat", {"seq": change_feed.last_seq, "ts": time.time()})
+
+@app.get("/changes/stream")
+async def stream_changes(
+    request: Request,
+    since: int = Query(0, ge=0),
+    admin_token: str = Depends(verify_admin_token)
+):
+    """Eventos de cambio en tiempo real como Server-Sent Events (solo administradores)
+
+    Admite la cabecera Last-Event-ID para reanudar tras una desconexión.
+    """
+    require_change_feed()
+    last_event_id = request.headers.get("last-event-id")
+    if last_event_id and last_event_id.isdigit():
+        since = max(since, int(last_event_id))
+    return StreamingResponse(
+        _change_stream(since),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+async def _snapshot_lines():
+    """Instantánea NDJSON: cabecera con la época y la seq, y una línea por key"""
+    # La seq se toma antes de leer las keys: los eventos posteriores se
+    # aplican encima de forma idempotente
+    yield dumps({"epoch": change_feed.epoch, "seq": change_feed.last_seq}) + b"\n"
+    after = 0
+    key_filter = KeyFilter()
+    while after is not None:
+        records, after = key_store.page(after, EXPORT_CHUNK_SIZE, key_filter, 0.0)
+        if records:
+            yield b"".join(
+                dumps({
+                    "key": record.key,
+                    "user_id": record.user_id,
+                    "created_at": record.created_at,
+                    "expires_at": record.expires_at,
+                    "max_uses": record.max_uses,
+                    "current_uses": record.current_uses,
+                    "is_active": record.is_active,
+                    "rate_limit": record.rate_limit,
+                    "rate_limit_window": record.rate_limit_window
+                }) + b"\n"
+                for record in records
+            )
+        await asyncio.sleep(0)
+
+@app.get("/changes/snapshot")
+async def changes_snapshot(admin_token: str = Depends(verify_admin_token)):
+    """Todas las keys con sus fechas en epoch, para inicializar una réplica (solo administradores)"""
+    require_change_feed()
+    return StreamingResponse(_snapshot_lines(), media_type="application/x-ndjson")
 
 # Para desarrollo local
 if __name__ == "__main__":
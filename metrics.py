@@ -0,0 +1,150 @@
+"""
+📈 Métricas en formato Prometheus
+Middleware ASGI que cuenta peticiones por ruta, mide su latencia con un
+histograma de buckets fijos y lleva las peticiones en curso, más contadores
+de dominio (resultados de validación, keys generadas).
+
+Las métricas se registran en el hilo del bucle de eventos sin locks; cada
+worker tiene las suyas y Prometheus las agrega por instancia.
+"""
+
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Tuple
+
+# Límites superiores (segundos) de los buckets del histograma de latencia
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Etiqueta de las peticiones que no corresponden a ninguna ruta (evita una serie por URL)
+UNMATCHED_ROUTE = "other"
+
+
+def _escape(value: str) -> str:
+    """Escapa el valor de una etiqueta para el formato de texto de Prometheus"""
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class RouteMetrics:
+    """Contadores e histograma de latencia de una ruta y método"""
+
+    __slots__ = ("statuses", "buckets", "total_seconds", "count")
+
+    def __init__(self):
+        self.statuses: Dict[int, int] = {}
+        # Un contador por bucket más el de +Inf (no acumulados; se acumulan al exportar)
+        self.buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total_seconds = 0.0
+        self.count = 0
+
+
+class Metrics:
+    """Registro de métricas de un worker"""
+
+    def __init__(self, validation_outcomes: Iterable[str]):
+        self.routes: Dict[Tuple[str, str], RouteMetrics] = {}
+        self.in_flight = 0
+        self.validations = dict.fromkeys(validation_outcomes, 0)
+        self.generated = 0
+
+    def observe(self, route: str, method: str, status: int, seconds: float):
+        """Registra una petición terminada"""
+        metrics = self.routes.get((route, method))
+        if metrics is None:
+            metrics = self.routes[(route, method)] = RouteMetrics()
+        metrics.statuses[status] = metrics.statuses.get(status, 0) + 1
+        metrics.buckets[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+        metrics.total_seconds += seconds
+        metrics.count += 1
+
+    def validation(self, outcome: str, count: int = 1):
+        """Cuenta resultados de validación"""
+        self.validations[outcome] += count
+
+    def render(self, store_stats: Dict[str, int]) -> str:
+        """Exporta las métricas en el formato de texto de Prometheus
+
+        `store_stats` son los contadores del almacenamiento (KeyStore.stats)
+        """
+        lines: List[str] = [
+            "# HELP apikey_http_requests_total Peticiones HTTP atendidas",
+            "# TYPE apikey_http_requests_total counter",
+        ]
+        routes = sorted(self.routes.items())
+        for (route, method), metrics in routes:
+            labels = f'route="{_escape(route)}",method="{method}"'
+            for status, count in sorted(metrics.statuses.items()):
+                lines.append(f'apikey_http_requests_total{{{labels},status="{status}"}} {count}')
+
+        lines += [
+            "# HELP apikey_http_request_duration_seconds Latencia de las peticiones HTTP",
+            "# TYPE apikey_http_request_duration_seconds histogram",
+        ]
+        for (route, method), metrics in routes:
+            labels = f'route="{_escape(route)}",method="{method}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, metrics.buckets):
+                cumulative += count
+                lines.append(
+                    f'apikey_http_request_duration_seconds_bucket{{{labels},le="{bound!r}"}} {cumulative}'
+                )
+            lines.append(f'apikey_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {metrics.count}')
+            lines.append(f"apikey_http_request_duration_seconds_sum{{{labels}}} {metrics.total_seconds}")
+            lines.append(f"apikey_http_request_duration_seconds_count{{{labels}}} {metrics.count}")
+
+        lines += [
+            "# HELP apikey_http_requests_in_flight Peticiones HTTP en curso",
+            "# TYPE apikey_http_requests_in_flight gauge",
+            f"apikey_http_requests_in_flight {self.in_flight}",
+            "# HELP apikey_validations_total Validaciones de keys por resultado",
+            "# TYPE apikey_validations_total counter",
+        ]
+        for outcome, count in self.validations.items():
+            lines.append(f'apikey_validations_total{{outcome="{outcome}"}} {count}')
+
+        lines += [
+            "# HELP apikey_keys_generated_total Keys generadas por este worker",
+            "# TYPE apikey_keys_generated_total counter",
+            f"apikey_keys_generated_total {self.generated}",
+            "# HELP apikey_keys Keys almacenadas por estado",
+            "# TYPE apikey_keys gauge",
+        ]
+        for field, value in store_stats.items():
+            if field.endswith("_keys"):
+                lines.append(f'apikey_keys{{state="{field[:-len("_keys")]}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+class MetricsMiddleware:
+    """Middleware ASGI que mide cada petición HTTP"""
+
+    def __init__(self, app, metrics: Metrics):
+        self.app = app
+        self.metrics = metrics
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        metrics = self.metrics
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        metrics.in_flight += 1
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            metrics.in_flight -= 1
+            # El router deja la ruta resuelta en el scope: se etiqueta con la plantilla
+            route = scope.get("route")
+            metrics.observe(
+                route.path if route is not None else UNMATCHED_ROUTE,
+                scope["method"],
+                status,
+                time.perf_counter() - start
+            )
@@ -0,0 +1,241 @@
+"""
+🔥 Perfilado de peticiones
+Middleware ASGI que perfila una fracción de las peticiones, o las que llevan la
+cabecera X-Debug-Profile firmada con un token de administrador, y acumula en
+memoria, por ruta, el tiempo pasado en cada pila de llamadas. GET /debug/profile
+lo devuelve como "collapsed stacks" (una línea por pila: marcos separados por
+";" y los microsegundos al final), el formato que leen flamegraph.pl, inferno
+y speedscope.
+
+Mientras hay alguna petición perfilada se instala una función de perfilado
+(sys.setprofile) en el hilo del bucle de eventos: en cada llamada o retorno, si
+ha pasado el intervalo de muestreo, recorre la pila y atribuye el tiempo
+transcurrido a la petición perfilada en cuya pila está; el de las peticiones
+no perfiladas que se intercalan se descarta. Sin peticiones perfiladas no queda
+nada instalado, y con PROFILING desactivado ni siquiera se añade el middleware.
+
+Solo se perfila el hilo del bucle de eventos: los endpoints síncronos (def),
+que FastAPI ejecuta en su pool de hilos, no aparecen.
+"""
+
+import hashlib
+import hmac
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, Iterable, Optional, Tuple
+
+from metrics import UNMATCHED_ROUTE
+
+# Cabecera para perfilar una petición concreta: "<epoch>.<HMAC-SHA256 en hex>"
+DEBUG_HEADER = b"x-debug-profile"
+# Segundos durante los que es válida una firma (en ambos sentidos, por desfase de relojes)
+SIGNATURE_MAX_AGE = 300
+
+# Pila donde se acumulan las muestras de una ruta que ya tiene PROFILE_MAX_STACKS pilas
+OTHER_STACKS = ("[otras pilas]",)
+
+
+def _signature(token: str, timestamp: str, path: str) -> str:
+    return hmac.new(token.encode(), f"{timestamp}:{path}".encode(), hashlib.sha256).hexdigest()
+
+
+def sign_debug_header(token: str, path: str, now: float) -> str:
+    """Valor de X-Debug-Profile que pide perfilar una petición a `path`"""
+    timestamp = str(int(now))
+    return f"{timestamp}.{_signature(token, timestamp, path)}"
+
+
+def verify_debug_header(value: str, path: str, tokens: Iterable[str], now: float) -> bool:
+    """Comprueba que la cabecera está firmada para `path` por alguno de los tokens y no ha caducado"""
+    timestamp, _, signature = value.partition(".")
+    try:
+        age = now - int(timestamp)
+    except ValueError:
+        return False
+    if abs(age) > SIGNATURE_MAX_AGE:
+        return False
+    return any(hmac.compare_digest(_signature(token, timestamp, path), signature) for token in tokens)
+
+
+def _builtin_label(function) -> str:
+    """Nombre de una función implementada en C (datetime.fromisoformat, orjson.dumps...)"""
+    name = getattr(function, "__qualname__", None) or type(function).__name__
+    module = getattr(function, "__module__", None)
+    return f"{module}.{name}" if module and module != "builtins" else name
+
+
+class RouteProfile:
+    """Tiempo acumulado de una ruta: peticiones perfiladas y segundos por pila"""
+
+    __slots__ = ("requests", "seconds", "stacks")
+
+    def __init__(self):
+        self.requests = 0
+        self.seconds = 0.0
+        self.stacks: Dict[Tuple[str, ...], float] = {}
+
+
+class Profiler:
+    """Muestras de pila de las peticiones perfiladas, agregadas por ruta"""
+
+    def __init__(self, sample_rate: float, interval: float, max_stacks: int, tokens: Iterable[str],
+                 clock: Callable[[], float] = time.time, rng: Callable[[], float] = random.random):
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.tokens = tuple(tokens)
+        self.clock = clock
+        self.rng = rng
+        self.routes: Dict[str, RouteProfile] = {}
+        # Peticiones en curso: marco del middleware -> segundos por pila
+        self._active: Dict[object, Dict[Tuple[str, ...], float]] = {}
+        self._last = 0.0
+        self._labels: Dict[object, str] = {}
+
+        # Métricas
+        self.sampled = 0
+        self.signed = 0
+        self.bad_signatures = 0
+        self.skipped = 0
+
+    def wants(self, scope) -> bool:
+        """Decide si perfilar una petición: por muestreo o por cabecera firmada"""
+        if self.sample_rate and self.rng() < self.sample_rate:
+            self.sampled += 1
+            return True
+        for name, value in scope["headers"]:
+            if name == DEBUG_HEADER:
+                if verify_debug_header(value.decode("latin-1"), scope["path"], self.tokens, self.clock()):
+                    self.signed += 1
+                    return True
+                self.bad_signatures += 1
+                return False
+        return False
+
+    def start(self, frame) -> bool:
+        """Empieza a perfilar la petición cuyo middleware se ejecuta en `frame`"""
+        if not self._active:
+            if sys.getprofile() is not None:
+                # Ya hay otro perfilador o depurador en este hilo: no se le quita
+                self.skipped += 1
+                return False
+            sys.setprofile(self._sample)
+            self._last = time.perf_counter()
+        self._active[frame] = {}
+        return True
+
+    def finish(self, frame, route: str, seconds: float):
+        """Termina una petición perfilada y suma sus pilas a las de su ruta"""
+        stacks = self._active.pop(frame)
+        if not self._active:
+            sys.setprofile(None)
+        profile = self.routes.get(route)
+        if profile is None:
+            profile = self.routes[route] = RouteProfile()
+        profile.requests += 1
+        profile.seconds += seconds
+        totals = profile.stacks
+        for stack, elapsed in stacks.items():
+            if stack not in totals and len(totals) >= self.max_stacks:
+                stack = OTHER_STACKS
+            totals[stack] = totals.get(stack, 0.0) + elapsed
+
+    def _sample(self, frame, event, arg):
+        """Función de perfilado: atribuye el tiempo desde la muestra anterior a la pila actual"""
+        now = time.perf_counter()
+        elapsed = now - self._last
+        if elapsed < self.interval:
+            return
+        self._last = now
+
+        stack = []
+        if event == "call":
+            # El tiempo transcurrido es de quien llama, no de la función que empieza
+            frame = frame.f_back
+        elif event == "c_return" or event == "c_exception":
+            stack.append(_builtin_label(arg))
+        active, labels = self._active, self._labels
+        while frame is not None:
+            stacks = active.get(frame)
+            if stacks is not None:
+                stack.reverse()
+                key = tuple(stack)
+                stacks[key] = stacks.get(key, 0.0) + elapsed
+                return
+            code = frame.f_code
+            label = labels.get(code)
+            if label is None:
+                name = getattr(code, "co_qualname", code.co_name)
+                label = labels[code] = f"{os.path.basename(code.co_filename)}:{name}"
+            stack.append(label)
+            frame = frame.f_back
+
+    def collapsed(self, route: Optional[str] = None) -> str:
+        """Pilas acumuladas en formato collapsed ("ruta;marco;...;marco microsegundos")
+
+        `route` filtra por la plantilla de la ruta (por ejemplo /validate-key).
+        """
+        lines = []
+        for name, profile in sorted(self.routes.items()):
+            if route is not None and name.partition(" ")[2] != route:
+                continue
+            for stack, seconds in profile.stacks.items():
+                micros = round(seconds * 1e6)
+                if micros:
+                    lines.append(f"{';'.join((name,) + stack)} {micros}")
+        return "".join(line + "\n" for line in lines)
+
+    def reset(self):
+        """Descarta las pilas acumuladas"""
+        self.routes = {}
+
+    def metrics(self) -> dict:
+        """Métricas del perfilado para el endpoint de estadísticas"""
+        return {
+            "sample_rate": self.sample_rate,
+            "interval_seconds": self.interval,
+            "sampled_requests": self.sampled,
+            "signed_requests": self.signed,
+            "invalid_signatures": self.bad_signatures,
+            "skipped": self.skipped,
+            "in_flight": len(self._active),
+            "routes": {
+                name: {
+                    "requests": profile.requests,
+                    "wall_seconds": profile.seconds,
+                    "profiled_seconds": sum(profile.stacks.values()),
+                    "stacks": len(profile.stacks),
+                }
+                for name, profile in sorted(self.routes.items())
+            },
+        }
+
+
+class ProfilerMiddleware:
+    """Middleware ASGI que perfila las peticiones elegidas por el Profiler"""
+
+    def __init__(self, app, profiler: Profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        profiler = self.profiler
+        if scope["type"] != "http" or not profiler.wants(scope):
+            return await self.app(scope, receive, send)
+
+        # Las muestras se atribuyen a esta petición buscando este marco en la pila
+        frame = sys._getframe()
+        if not profiler.start(frame):
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route = scope.get("route")
+            profiler.finish(
+                frame,
+                f"{scope['method']} {route.path if route is not None else UNMATCHED_ROUTE}",
+                time.perf_counter() - start
+            )
@@ -0,0 +1,260 @@
+"""
+🚦 Límite de peticiones por cliente
+Middleware ASGI con token buckets por IP de cliente (y opcionalmente por
+prefijo de key) y límites configurables por ruta. Los buckets viven en una
+estructura LRU de tamaño fijo o, en modo compartido, en un archivo SQLite
+común a todos los workers del host.
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from starlette.routing import Match
+
+from store import StoreBusy
+
+# Cuerpos precodificados de las respuestas 429 y 503
+_TOO_MANY_REQUESTS_BODY = b'{"detail":"Demasiadas peticiones"}'
+_BUSY_BODY = b'{"detail":"Almacenamiento ocupado, reintenta en unos instantes"}'
+
+# Longitud del prefijo de key usado para agrupar peticiones
+KEY_PREFIX_LENGTH = 8
+
+
+def parse_limits(spec: str) -> Dict[str, Tuple[float, float]]:
+    """Interpreta "ruta=peticiones_por_segundo/ráfaga,..." como {ruta: (rate, burst)}
+
+    Lanza ValueError si un límite no tiene un ritmo positivo y una ráfaga de al
+    menos una petición (un bucket así no podría dejar pasar ninguna).
+    """
+    limits = {}
+    for item in spec.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        path, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        rate = float(rate)
+        burst = float(burst) if burst else rate
+        # Comparaciones negadas para rechazar también NaN
+        if not rate > 0:
+            raise ValueError(f"RATE_LIMITS: el ritmo de {path.strip()} debe ser mayor que 0")
+        if not burst >= 1:
+            raise ValueError(f"RATE_LIMITS: la ráfaga de {path.strip()} debe ser de al menos 1 petición")
+        limits[path.strip()] = (rate, burst)
+    return limits
+
+
+class LocalBuckets:
+    """Token buckets en memoria del proceso, en un LRU de como máximo `max_entries` clientes"""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._buckets: "OrderedDict[str, List[float]]" = OrderedDict()
+
+    def take(self, key: str, rate: float, burst: float, now: float) -> float:
+        """Consume un token; devuelve 0 si se permite o los segundos hasta el siguiente token"""
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = [burst, now]
+            if len(self._buckets) > self.max_entries:
+                # El cliente menos reciente pierde su bucket (vuelve a empezar lleno)
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(key)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / rate
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+_SQL_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS buckets ("
+    "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL) WITHOUT ROWID"
+)
+_SQL_SELECT = "SELECT tokens, updated FROM buckets WHERE key = ?"
+_SQL_UPSERT = (
+    "INSERT INTO buckets (key, tokens, updated) VALUES (?, ?, ?) "
+    "ON CONFLICT (key) DO UPDATE SET tokens = excluded.tokens, updated = excluded.updated"
+)
+_SQL_PRUNE = "DELETE FROM buckets WHERE updated < ?"
+
+
+class SharedBuckets:
+    """Token buckets en SQLite, compartidos por todos los workers del host
+
+    Como SQLiteKeyStore, se ejecuta en el bucle de eventos: si otro worker tiene
+    el archivo bloqueado más de `busy_timeout` milisegundos, lanza StoreBusy.
+    """
+
+    # Cada cuántas operaciones se eliminan los buckets inactivos
+    PRUNE_EVERY = 10000
+
+    def __init__(self, path: str, max_idle: float, busy_timeout: int = 100):
+        # Importado aquí: sin modo compartido no se carga sqlite3 al arrancar
+        import sqlite3
+
+        self.max_idle = max_idle
+        self._operations = 0
+        self._lock = threading.Lock()
+        self._busy_error = sqlite3.OperationalError
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        self._conn.execute(_SQL_SCHEMA)
+
+    def take(self, key: str, rate: float, burst: float, now: float) -> float:
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+            except self._busy_error as exc:
+                raise StoreBusy(str(exc)) from exc
+            try:
+                row = self._conn.execute(_SQL_SELECT, (key,)).fetchone()
+                tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+                allowed = tokens >= 1
+                if allowed:
+                    tokens -= 1
+                self._conn.execute(_SQL_UPSERT, (key, tokens, now))
+
+                self._operations += 1
+                if self._operations % self.PRUNE_EVERY == 0:
+                    # Un bucket inactivo más de max_idle ya estaría lleno: equivale a no tenerlo
+                    self._conn.execute(_SQL_PRUNE, (now - self.max_idle,))
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+        return 0.0 if allowed else (1 - tokens) / rate
+
+
+class RateLimiter:
+    """Aplica los límites por ruta a las peticiones y lleva las métricas"""
+
+    def __init__(self, limits: Dict[str, Tuple[float, float]], buckets, clock,
+                 by_key_prefix: bool = False, trust_forwarded: bool = False):
+        self.limits = limits
+        self.buckets = buckets
+        self.clock = clock
+        self.by_key_prefix = by_key_prefix
+        self.trust_forwarded = trust_forwarded
+
+        # Métricas
+        self.allowed = 0
+        self.rejected = 0
+        self.busy = 0
+
+    def _match(self, path: str) -> Optional[str]:
+        """Ruta configurada que corresponde a `path` (exacta o como prefijo de segmento)"""
+        if path in self.limits:
+            return path
+        for route in self.limits:
+            if path.startswith(route + "/"):
+                return route
+        return None
+
+    def _client(self, scope) -> str:
+        if self.trust_forwarded:
+            for name, value in scope["headers"]:
+                if name == b"x-forwarded-for":
+                    return value.split(b",", 1)[0].strip().decode("latin-1")
+        client = scope.get("client")
+        return client[0] if client else "unknown"
+
+    def check(self, scope) -> float:
+        """0 si la petición puede pasar; si no, segundos hasta que pueda reintentarse"""
+        path = scope["path"]
+        route = self._match(path)
+        if route is None:
+            return 0.0
+
+        bucket_key = f"{route}|{self._client(scope)}"
+        if self.by_key_prefix and path != route:
+            # Rutas con la key en la URL (p. ej. /key-info/{key})
+            bucket_key += "|" + path[len(route) + 1:][:KEY_PREFIX_LENGTH]
+
+        rate, burst = self.limits[route]
+        try:
+            retry_after = self.buckets.take(bucket_key, rate, burst, self.clock())
+        except StoreBusy:
+            self.busy += 1
+            raise
+        if retry_after:
+            self.rejected += 1
+        else:
+            self.allowed += 1
+        return retry_after
+
+    def metrics(self) -> dict:
+        """Métricas del límite de peticiones para el endpoint de estadísticas"""
+        return {
+            "limits": {route: {"rate": rate, "burst": burst} for route, (rate, burst) in self.limits.items()},
+            "shared": isinstance(self.buckets, SharedBuckets),
+            "tracked_clients": len(self.buckets) if isinstance(self.buckets, LocalBuckets) else None,
+            "allowed": self.allowed,
+            "rejected": self.rejected,
+            "busy": self.busy,
+        }
+
+
+class RateLimitMiddleware:
+    """Middleware ASGI que rechaza con 429 antes de llegar a FastAPI
+
+    Las conexiones WebSocket cuentan como una petición al abrirse (no por
+    mensaje) y se rechazan cerrándolas durante el handshake (HTTP 403).
+    Si los buckets compartidos están bloqueados (StoreBusy) responde 503.
+
+    `routes` son las rutas de la aplicación: las respuestas rechazadas no pasan
+    por el router, así que el middleware resuelve la ruta para las métricas.
+    """
+
+    def __init__(self, app, limiter: RateLimiter, routes: Optional[list] = None):
+        self.app = app
+        self.limiter = limiter
+        self.routes = routes or []
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            return await self.app(scope, receive, send)
+        try:
+            retry_after = self.limiter.check(scope)
+        except StoreBusy:
+            status, body, retry_after = 503, _BUSY_BODY, 1.0
+        else:
+            if not retry_after:
+                return await self.app(scope, receive, send)
+            status, body = 429, _TOO_MANY_REQUESTS_BODY
+
+        if scope["type"] == "websocket":
+            # Policy Violation o Try Again Later
+            await send({"type": "websocket.close", "code": 1008 if status == 429 else 1013})
+            return
+
+        self._resolve_route(scope)
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(math.ceil(retry_after)).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
+
+    def _resolve_route(self, scope):
+        """Deja en el scope la ruta que habría atendido la petición, como hace el router"""
+        for route in self.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                scope["route"] = route
+                return
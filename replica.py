@@ -0,0 +1,249 @@
+"""
+🛰️ Réplica de lectura
+Mantiene una copia local de las keys de un primario siguiendo su feed de
+cambios (changes.py): descarga una instantánea (GET /changes/snapshot), aplica
+los eventos del stream SSE (GET /changes/stream) y vuelve a descargar la
+instantánea si se pierden eventos o el primario reinicia (cambio de época).
+
+Los eventos se aplican de forma idempotente (crear solo si no existe, usos que
+solo suben, revocar y eliminar), así que da igual que la instantánea incluya
+cambios posteriores a su seq: al aplicar después esos eventos no cambia nada.
+
+Las validaciones de keys válidas se reenvían al primario, que es el único que
+consume usos: así max_uses y la cuota por ventana nunca se superan, a costa de
+un viaje de ida y vuelta por validación con éxito.
+
+Requiere httpx (incluido en requirements.txt).
+"""
+
+import asyncio
+import json
+import time
+from typing import AsyncIterator, Optional, Tuple
+
+from store import (
+    STATUS_VALID, STATUS_INVALID, STATUS_REVOKED, STATUS_EXPIRED, STATUS_EXHAUSTED,
+    MemoryKeyStore,
+)
+
+
+class ResyncNeeded(Exception):
+    """El primario ya no tiene los eventos pendientes o reinició: hay que descargar la instantánea"""
+
+
+class PrimaryUnavailable(Exception):
+    """No se pudo reenviar una petición al primario"""
+
+
+def check_key(store: MemoryKeyStore, key: str, now: float) -> str:
+    """Estado de una key en la copia local, sin consumir usos.
+
+    La cuota por ventana no se comprueba: la aplica el primario al consumir.
+    """
+    record = store.get(key)
+    if record is None:
+        return STATUS_INVALID
+    if not record.is_active:
+        return STATUS_REVOKED
+    if now > record.expires_at:
+        return STATUS_EXPIRED
+    if record.current_uses >= record.max_uses:
+        return STATUS_EXHAUSTED
+    return STATUS_VALID
+
+
+async def sse_events(lines: AsyncIterator[str]) -> AsyncIterator[Tuple[str, str]]:
+    """Convierte las líneas de un stream SSE en pares (tipo de evento, datos)"""
+    event, data = "message", []
+    async for line in lines:
+        if not line:
+            if data:
+                yield event, "\n".join(data)
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+
+class Replica:
+    """Sigue el feed de cambios de un primario y lo aplica a un almacenamiento en memoria"""
+
+    def __init__(self, primary_url: str, token: str, store: MemoryKeyStore,
+                 retry_seconds: float = 1.0, read_timeout: float = 60.0):
+        self.primary_url = primary_url.rstrip("/")
+        self.store = store
+        self.retry_seconds = retry_seconds
+        self.read_timeout = read_timeout
+        self._headers = {"Authorization": f"Bearer {token}"}
+        self._client = None
+
+        # Estado de la replicación
+        self.epoch: Optional[str] = None
+        self.applied_seq = 0
+        self.primary_seq = 0
+        self.synced = False
+        self.connected = False
+
+        # Métricas
+        self.resyncs = 0
+        self.events_applied = 0
+        self.errors = 0
+        self.last_error: Optional[str] = None
+        self.last_contact: Optional[float] = None
+        self.last_event_lag = 0.0
+
+    @property
+    def client(self):
+        """Cliente HTTP hacia el primario (httpx se importa solo en modo réplica)"""
+        if self._client is None:
+            import httpx
+            # El primario envía un heartbeat cada pocos segundos: un stream sin datos
+            # durante `read_timeout` se da por caído y se reconecta
+            self._client = httpx.AsyncClient(
+                base_url=self.primary_url, timeout=httpx.Timeout(10.0, read=self.read_timeout)
+            )
+        return self._client
+
+    def apply(self, event: dict):
+        """Aplica un evento del feed a la copia local"""
+        store, op = self.store, event["op"]
+        if op == "create":
+            for key in event["keys"]:
+                if store.get(key) is None:
+                    store.create(
+                        key, event["user_id"], event["created_at"], event["expires_at"], event["max_uses"],
+                        event["rate_limit"], event["rate_limit_window"]
+                    )
+        elif op == "consume":
+            store.set_uses(event["key"], event["uses"], event["ts"])
+        elif op == "revoke":
+            store.revoke(event["key"], event["ts"])
+        elif op == "revoke_user":
+            store.revoke_user(event["user_id"], event["ts"])
+        elif op == "evict":
+            for key in event["keys"]:
+                store.delete(key)
+
+        now = time.time()
+        self.applied_seq = event["seq"]
+        self.primary_seq = max(self.primary_seq, self.applied_seq)
+        self.events_applied += 1
+        self.last_contact = now
+        self.last_event_lag = max(0.0, now - event["ts"])
+
+    def _apply_record(self, record: dict, now: float):
+        """Aplica una key de la instantánea"""
+        store, key = self.store, record["key"]
+        if store.get(key) is None:
+            store.create(
+                key, record["user_id"], record["created_at"], record["expires_at"], record["max_uses"],
+                record["rate_limit"], record["rate_limit_window"]
+            )
+        store.set_uses(key, record["current_uses"], now)
+        if not record["is_active"]:
+            store.revoke(key, now)
+
+    async def resync(self):
+        """Descarga la instantánea del primario y elimina las keys locales que ya no existen"""
+        seen = set()
+        async with self.client.stream("GET", "/changes/snapshot", headers=self._headers) as response:
+            response.raise_for_status()
+            lines = response.aiter_lines()
+            header = json.loads(await lines.__anext__())
+            now = time.time()
+            count = 0
+            async for line in lines:
+                record = json.loads(line)
+                self._apply_record(record, now)
+                seen.add(record["key"])
+                count += 1
+                if count % 1000 == 0:
+                    # Ceder el bucle de eventos: la réplica sigue atendiendo peticiones
+                    await asyncio.sleep(0)
+
+        # Keys desalojadas en el primario durante el tiempo sin eventos
+        for key in [record.key for record in self.store.list() if record.key not in seen]:
+            self.store.delete(key)
+        self.epoch = header["epoch"]
+        self.applied_seq = self.primary_seq = header["seq"]
+        self.last_contact = time.time()
+        self.synced = True
+        self.resyncs += 1
+
+    async def follow(self):
+        """Aplica los eventos del stream SSE hasta que se corte la conexión"""
+        params = {"since": self.applied_seq}
+        async with self.client.stream("GET", "/changes/stream", params=params, headers=self._headers) as response:
+            response.raise_for_status()
+            self.connected = True
+            applied = 0
+            async for event, data in sse_events(response.aiter_lines()):
+                payload = json.loads(data)
+                if event == "message":
+                    self.apply(payload)
+                    applied += 1
+                    if applied % 1000 == 0:
+                        await asyncio.sleep(0)
+                elif event == "hello":
+                    if payload["epoch"] != self.epoch:
+                        raise ResyncNeeded("el primario reinició")
+                    self.primary_seq = payload["seq"]
+                    self.last_contact = time.time()
+                elif event == "heartbeat":
+                    self.primary_seq = payload["seq"]
+                    self.last_contact = time.time()
+                elif event == "reset":
+                    raise ResyncNeeded(payload.get("detail", "eventos perdidos"))
+
+    async def run(self):
+        """Bucle de replicación; se cancela al apagar la aplicación"""
+        import httpx
+
+        while True:
+            try:
+                if not self.synced:
+                    await self.resync()
+                await self.follow()
+            except ResyncNeeded as e:
+                self.synced = False
+                self.last_error = str(e)
+                continue
+            except (httpx.HTTPError, ValueError, KeyError, StopAsyncIteration) as e:
+                self.errors += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+            finally:
+                self.connected = False
+            await asyncio.sleep(self.retry_seconds)
+
+    async def forward(self, path: str, payload: dict):
+        """Envía una petición POST al primario (validaciones que consumen usos)"""
+        import httpx
+
+        try:
+            return await self.client.post(path, json=payload)
+        except httpx.HTTPError as e:
+            raise PrimaryUnavailable(f"{type(e).__name__}: {e}") from e
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+
+    def metrics(self) -> dict:
+        """Estado y retraso de la replicación para el endpoint de estadísticas"""
+        now = time.time()
+        return {
+            "primary": self.primary_url,
+            "epoch": self.epoch,
+            "synced": self.synced,
+            "connected": self.connected,
+            "applied_seq": self.applied_seq,
+            "primary_seq": self.primary_seq,
+            "lag_events": self.primary_seq - self.applied_seq,
+            "last_event_lag_seconds": self.last_event_lag,
+            "seconds_since_contact": now - self.last_contact if self.last_contact is not None else None,
+            "events_applied": self.events_applied,
+            "resyncs": self.resyncs,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
@@ -0,0 +1,60 @@
+"""
+⚡ Serialización rápida de respuestas
+Escribe los bytes JSON directamente (con orjson si está instalado) en lugar de
+construir y revalidar modelos pydantic. La salida es semánticamente equivalente
+a la de JSONResponse de FastAPI (JSON compacto en UTF-8 sin escapar caracteres
+no ASCII), pero no siempre idéntica byte a byte: orjson escribe los floats con
+exponente en otra forma (1e16 y 1e-7 frente a 1e+16 y 1e-07).
+"""
+
+import json
+from typing import Any, Optional
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # Dependencia opcional
+    orjson = None
+
+
+def _json_dumps(content: Any) -> bytes:
+    """Mismo formato que JSONResponse.render"""
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def dumps(content: Any) -> bytes:
+    """Serializa `content` a bytes JSON equivalentes a los de JSONResponse"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(content)
+        except TypeError:
+            # Enteros de más de 64 bits, cadenas con surrogates, tipos no nativos...
+            pass
+    return _json_dumps(content)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse que serializa con `dumps`"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+def api_body(success: bool, message: str, data: Optional[dict], timestamp: str) -> bytes:
+    """Cuerpo con el formato de ApiResponse, sin pasar por el modelo"""
+    return dumps({"success": success, "message": message, "data": data, "timestamp": timestamp})
+
+
+class ResponseTemplate:
+    """Cuerpo ApiResponse constante precodificado al que solo le falta el timestamp"""
+
+    def __init__(self, success: bool, message: str):
+        # Se quita el cierre '"}' para poder añadir el timestamp
+        self._prefix = api_body(success, message, None, "")[:-2]
+
+    def render(self, timestamp: str) -> bytes:
+        # El timestamp ISO es ASCII y no necesita escaparse
+        return self._prefix + timestamp.encode("ascii") + b'"}'
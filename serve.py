@@ -0,0 +1,62 @@
+"""
+🚀 Arranque con varios workers
+Lanza la API con N procesos uvicorn que comparten la tabla de keys en memoria
+compartida (KEY_STORE=shared): una key generada en un worker es válida en
+todos y los límites de usos se cumplen entre todos. Las respuestas guardadas
+por Idempotency-Key, en cambio, son de cada worker.
+
+Uso: python serve.py --workers 4 [--host 0.0.0.0] [--port 8000] [--capacity 1000000] [--reset]
+
+Con gunicorn, las mismas variables de entorno sirven:
+  KEY_STORE=shared KEY_STORE_PATH=/dev/shm/apikey-keys.tbl SECRET_KEY=... \\
+    gunicorn main:app -w 4 -k uvicorn.workers.UvicornWorker
+"""
+
+import argparse
+import os
+import secrets
+import sys
+
+
+def default_path(name: str) -> str:
+    """Archivo en /dev/shm (tmpfs) si existe; si no, en el directorio actual"""
+    return os.path.join("/dev/shm", name) if os.path.isdir("/dev/shm") else name
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="procesos (por defecto, uno por CPU)")
+    parser.add_argument("--host", default="127.0.0.1", help="dirección de escucha (127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8000, help="puerto (8000)")
+    parser.add_argument("--capacity", type=int, help="máximo de keys de la tabla (SHARED_STORE_CAPACITY)")
+    parser.add_argument("--reset", action="store_true", help="borra la tabla existente antes de arrancar")
+    args = parser.parse_args()
+
+    os.environ.setdefault("KEY_STORE", "shared")
+    os.environ.setdefault("KEY_STORE_PATH", default_path("apikey-keys.tbl"))
+    if args.capacity:
+        os.environ["SHARED_STORE_CAPACITY"] = str(args.capacity)
+    if args.reset and os.path.exists(os.environ["KEY_STORE_PATH"]):
+        os.remove(os.environ["KEY_STORE_PATH"])
+
+    # Todos los workers deben firmar y cifrar con la misma clave
+    if not os.environ.get("SECRET_KEY"):
+        os.environ["SECRET_KEY"] = secrets.token_urlsafe(32)
+        print("⚠️  SECRET_KEY no está configurada: se usa una clave temporal común a los workers", file=sys.stderr)
+
+    # Límite de peticiones común a todos los workers (si está configurado)
+    if os.environ.get("RATE_LIMITS"):
+        os.environ.setdefault("RATE_LIMIT_SHARED_PATH", default_path("apikey-ratelimit.db"))
+
+    print(
+        f"🚀 {args.workers} workers en http://{args.host}:{args.port} | "
+        f"almacenamiento: {os.environ['KEY_STORE']} ({os.environ['KEY_STORE_PATH']})",
+        file=sys.stderr
+    )
+
+    import uvicorn
+    uvicorn.run("main:app", host=args.host, port=args.port, workers=args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,835 @@
+"""
+🧠 Almacenamiento en memoria compartida
+Tabla de keys en un archivo mapeado en memoria (mmap) que comparten todos los
+workers de un mismo host: una key generada en un worker es válida en los demás
+y los límites de usos se respetan entre todos. Cada validación lee y escribe la
+tabla directamente, sin servicios externos ni IPC por petición.
+
+Concurrencia entre procesos con locks de rango de fcntl (advisory):
+- byte 0: lock de estructura, compartido para buscar, consumir y revocar y
+  exclusivo para insertar y desalojar
+- byte 1: lock de los índices de expiración, para modificarlos con el lock de
+  estructura compartido (al agotarse una key y al contar las expiradas)
+- un byte por registro: consumir un uso o revocar una key es atómico sin
+  bloquear al resto de keys
+- un byte por entrada de usuario: sus contadores de estado, que cambian
+  al consumir, revocar y contar expiradas con el lock de estructura compartido
+Los contadores globales de estadísticas van en franjas, una por proceso, que
+solo escribe su dueño (sin locks); al leerlos se suman todas. Los de cada
+usuario van en su entrada de la tabla de usuarios, y los usuarios con keys
+forman una lista enlazada, así que las estadísticas por usuario no recorren
+sus keys ni la tabla.
+
+Como en MemoryKeyStore, dos índices de expiración (expiryindex.py) evitan
+recorrer la tabla: un heap por momento de desalojo, para que el coste de
+evict() sea proporcional a las keys eliminadas, y los grupos de keys aún no
+contadas como expiradas, que stats() va contando a medida que expiran.
+
+Solo Linux/Unix (fcntl). Para no tocar el disco, usa un archivo en /dev/shm.
+"""
+
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from typing import Dict, List
+
+from counters import (
+    STATE_FIELDS, TOTAL, ACTIVE, REVOKED, EXPIRED, EXHAUSTED, USES,
+    GENERATED, HOURLY_USES, HOURLY_REVOKED, HOURLY_FIELDS, hour_of, state_dict,
+)
+from store import (
+    STATUS_VALID, STATUS_INVALID, STATUS_REVOKED, STATUS_EXPIRED, STATUS_EXHAUSTED, STATUS_RATE_LIMITED,
+    KeyFilter, KeyRecord, KeyStore, gcra,
+)
+from expiryindex import ExpiryGroups, IndexedHeap
+
+_MAGIC = b"APIKEYS1"
+_VERSION = 4
+_HEADER_SIZE = 4096
+_EXPIRY_LOCK = 1
+
+# Franjas de contadores: una por proceso vivo (máximo de workers por host).
+# Cada proceso reserva la suya con un lock exclusivo sobre su byte
+MAX_WORKERS = 64
+_STRIPE_LOCK_BASE = 1024
+
+# Campos int64 de la cabecera, a partir del byte 8. Los cuatro primeros fijan
+# la geometría al crear el archivo
+(_M_VERSION, _M_CAPACITY, _M_INDEX_CAPACITY, _M_HOURLY_WINDOW,
+ _M_NEXT_SEQ, _M_USED, _M_LIVE, _M_FREE_HEAD, _M_INDEX_TOMBSTONES,
+ _M_USERS_LIVE, _M_USER_TOMBSTONES, _M_ORDER_LEN, _M_EVICT_LEN, _M_PENDING_LEN,
+ _M_GROUPS_FREE, _M_GROUPS_USED, _M_LAST_GROUP, _M_USERS_HEAD) = range(18)
+_META_FIELDS = 18
+# Tras los campos int64, un double: las keys con expires_at anterior ya están
+# contadas como expiradas
+_WATERMARK_OFFSET = 8 + 8 * _META_FIELDS
+
+# Registro de una key: estado, activa, longitud de la key, usuario (entrada de
+# la tabla de usuarios), anterior y siguiente del mismo usuario, hash, seq,
+# created_at, max_uses, current_uses y la cuota por ventana (límite, ventana y
+# tat de GCRA); después, los bytes de la key.
+# expires_at va en un array aparte, junto a los índices de expiración
+_RECORD = struct.Struct("<BBHiiiQQdqqidd")
+_RECORD_SIZE = 256
+_MAX_KEY_BYTES = _RECORD_SIZE - _RECORD.size
+_OFF_ACTIVE = 1
+_OFF_USER = 4
+_OFF_PREV = 8
+_OFF_NEXT = 12
+_OFF_USES = 48
+_OFF_TAT = 68
+
+# Entrada de la tabla de usuarios: estado, longitud del user_id, primera y
+# última key, número de keys y hash; después, el usuario con keys anterior y
+# siguiente, los contadores de estado (STATE_FIELDS) y los bytes del user_id
+_USER = struct.Struct("<BxHiiiQ")
+_USER_COUNTS = struct.Struct(f"<{len(STATE_FIELDS)}q")
+_USER_SIZE = 184
+_OFF_HEAD = 4
+_OFF_TAIL = 8
+_OFF_COUNT = 12
+_OFF_USER_PREV = _USER.size
+_OFF_USER_NEXT = _USER.size + 4
+_OFF_USER_COUNTS = _USER.size + 8
+_OFF_USER_NAME = _OFF_USER_COUNTS + _USER_COUNTS.size
+_MAX_USER_BYTES = _USER_SIZE - _OFF_USER_NAME
+
+_INT32 = struct.Struct("<i")
+_INT64 = struct.Struct("<q")
+_DOUBLE = struct.Struct("<d")
+_UINT8 = struct.Struct("<B")
+
+# Estados de registros y usuarios
+_FREE, _USED, _DELETED = 0, 1, 2
+# Máxima ocupación (incluidas las lápidas) de las tablas hash antes de reconstruirlas
+_MAX_LOAD = 0.75
+
+_NEVER = float("inf")
+
+
+def _hash(data: bytes) -> int:
+    """Hash estable entre procesos (el hash() de Python cambia en cada proceso)"""
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+class SharedMemoryKeyStore(KeyStore):
+    """Tabla de keys de capacidad fija en un archivo mapeado en memoria, compartida entre procesos.
+
+    Los registros no se mueven nunca: un índice hash (direccionamiento abierto)
+    apunta a ellos, las keys de cada usuario forman una lista doblemente
+    enlazada y un array de (seq, registro) da el orden de creación.
+    """
+
+    def __init__(self, path: str, capacity: int, hourly_window: int = 48):
+        self._lock = threading.Lock()
+        index_capacity = 1 << max(4, (2 * capacity - 1).bit_length())
+        stripe_size = 8 * (len(STATE_FIELDS) + (1 + len(HOURLY_FIELDS)) * hourly_window)
+
+        # Regiones del archivo
+        self._stripes_offset = _HEADER_SIZE
+        self._stripe_size = stripe_size
+        self._records_offset = self._stripes_offset + MAX_WORKERS * stripe_size
+        expires_offset = self._records_offset + capacity * _RECORD_SIZE
+        # Índices de expiración: un array de `capacity` elementos por campo (hay
+        # como mucho un grupo de expiración por key)
+        expiry_offset = expires_offset + capacity * 8
+        expiry_formats = "dddiiiiiiii"
+        expiry_offsets = [expiry_offset]
+        for fmt in expiry_formats:
+            expiry_offsets.append(expiry_offsets[-1] + capacity * struct.calcsize(fmt))
+        index_hashes_offset = expiry_offsets[-1]
+        index_slots_offset = index_hashes_offset + index_capacity * 8
+        order_seqs_offset = index_slots_offset + index_capacity * 4
+        order_slots_offset = order_seqs_offset + 2 * capacity * 8
+        self._users_offset = order_slots_offset + 2 * capacity * 4
+        self._users_size = index_capacity * _USER_SIZE
+        size = self._users_offset + self._users_size
+
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        # El primer proceso crea el archivo; los demás esperan y comprueban su geometría
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            geometry = (_VERSION, capacity, index_capacity, hourly_window)
+            header = os.pread(self._fd, 8 + 8 * len(geometry), 0)
+            if header[:8] != _MAGIC:
+                if os.fstat(self._fd).st_size:
+                    raise ValueError(f"{path} no es una tabla de keys compartida")
+                # Archivo disperso: las páginas se reservan al escribirlas
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, _MAGIC + struct.pack(f"<{_META_FIELDS}q", *geometry, 1, *[0] * (_META_FIELDS - 5)), 0)
+            else:
+                existing = struct.unpack_from(f"<{len(geometry)}q", header, 8)
+                if existing[0] != _VERSION:
+                    raise ValueError(
+                        f"{path} tiene el formato de una versión anterior ({existing[0]}); "
+                        "bórralo (serve.py --reset) para crearlo de nuevo"
+                    )
+                if existing != geometry:
+                    raise ValueError(
+                        f"{path} se creó con capacidad {existing[1]} y ventana horaria {existing[3]}; "
+                        "bórralo o usa la misma configuración"
+                    )
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+        self._mm = mmap.mmap(self._fd, size)
+        view = memoryview(self._mm)
+        self._view = view
+        self._meta = view[8:8 + 8 * _META_FIELDS].cast("q")
+        self._expires = view[expires_offset:expiry_offset].cast("d")
+        (eviction_at, pending_at, group_expires, eviction_slots, eviction_positions, pending_groups,
+         pending_positions, group_counts, group_tags, free_groups, slot_groups) = [
+            view[start:end].cast(fmt)
+            for start, end, fmt in zip(expiry_offsets, expiry_offsets[1:], expiry_formats)
+        ]
+        meta = self._meta
+        # Por momento de desalojo (expires_at, o el momento en que se agotó)
+        self._eviction = IndexedHeap(
+            eviction_at, eviction_slots, eviction_positions, meta[_M_EVICT_LEN:_M_EVICT_LEN + 1]
+        )
+        # Keys aún no contadas como expiradas
+        self._pending_expiry = ExpiryGroups(
+            IndexedHeap(pending_at, pending_groups, pending_positions, meta[_M_PENDING_LEN:_M_PENDING_LEN + 1]),
+            group_expires, group_counts, group_tags, slot_groups, free_groups,
+            meta[_M_GROUPS_FREE:_M_LAST_GROUP + 1], view[_WATERMARK_OFFSET:_WATERMARK_OFFSET + 8].cast("d")
+        )
+        self._index_hashes = view[index_hashes_offset:index_slots_offset].cast("Q")
+        self._index_bytes = view[index_slots_offset:order_seqs_offset]
+        self._index_slots = self._index_bytes.cast("i")
+        self._order_seqs = view[order_seqs_offset:order_slots_offset].cast("Q")
+        self._order_slots = view[order_slots_offset:self._users_offset].cast("i")
+        self._capacity = capacity
+        self._index_mask = index_capacity - 1
+        self._hourly_window = hourly_window
+        self._stripe_counts = struct.Struct(f"<{len(STATE_FIELDS)}q")
+        self._stripe_hourly = struct.Struct(f"<{(1 + len(HOURLY_FIELDS)) * hourly_window}q")
+
+        self._claim_stripe()
+        # Los locks de fcntl no se heredan: un proceso hijo reserva su propia franja
+        os.register_at_fork(after_in_child=self._claim_stripe)
+
+    # Locks
+
+    def _claim_stripe(self):
+        """Reserva una franja de contadores libre para este proceso"""
+        for stripe in range(MAX_WORKERS):
+            try:
+                fcntl.lockf(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, _STRIPE_LOCK_BASE + stripe)
+            except OSError:
+                continue
+            offset = self._stripes_offset + stripe * self._stripe_size
+            middle = offset + 8 * len(STATE_FIELDS)
+            self._counts = self._view[offset:middle].cast("q")
+            self._hourly = self._view[middle:offset + self._stripe_size].cast("q")
+            return
+        raise RuntimeError(f"Más de {MAX_WORKERS} procesos usan la tabla de keys compartida")
+
+    @contextmanager
+    def _locked(self, mode: int):
+        """Lock de estructura (LOCK_SH o LOCK_EX), también entre hilos del proceso"""
+        with self._lock:
+            fcntl.lockf(self._fd, mode, 1, 0)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    @contextmanager
+    def _expiry_locked(self):
+        """Lock de los índices de expiración (con el lock de estructura compartido ya tomado)"""
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, _EXPIRY_LOCK)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, _EXPIRY_LOCK)
+
+    @contextmanager
+    def _slot_locked(self, slot: int):
+        """Lock exclusivo de un registro (con el lock de estructura ya tomado)"""
+        offset = self._records_offset + slot * _RECORD_SIZE
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield offset
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    @contextmanager
+    def _user_locked(self, user: int):
+        """Lock exclusivo de los contadores de un usuario (con el lock de estructura compartido)"""
+        offset = self._users_offset + user * _USER_SIZE
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, offset)
+        try:
+            yield
+        finally:
+            fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, offset)
+
+    # Contadores de la franja de este proceso
+
+    def _count(self, field: int, delta: int = 1):
+        self._counts[field] += delta
+
+    def _event(self, now: float, field: int, count: int = 1):
+        hour = hour_of(now)
+        base = (hour // 3600 % self._hourly_window) * (1 + len(HOURLY_FIELDS))
+        hourly = self._hourly
+        if hourly[base] != hour:
+            hourly[base] = hour
+            for i in range(len(HOURLY_FIELDS)):
+                hourly[base + 1 + i] = 0
+        hourly[base + 1 + field] += count
+
+    # Contadores de cada usuario (con el lock de su entrada o el exclusivo)
+
+    def _count_user(self, user: int, field: int, delta: int = 1):
+        offset = self._users_offset + user * _USER_SIZE + _OFF_USER_COUNTS + 8 * field
+        _INT64.pack_into(self._mm, offset, _INT64.unpack_from(self._mm, offset)[0] + delta)
+
+    def _user_values(self, user: int) -> List[int]:
+        return list(_USER_COUNTS.unpack_from(self._mm, self._users_offset + user * _USER_SIZE + _OFF_USER_COUNTS))
+
+    # Registros y usuarios
+
+    def _record(self, slot: int) -> KeyRecord:
+        offset = self._records_offset + slot * _RECORD_SIZE
+        (_, active, key_len, user, _, _, _, seq, created_at, max_uses, uses,
+         rate_limit, rate_limit_window, tat) = _RECORD.unpack_from(self._mm, offset)
+        start = offset + _RECORD.size
+        return KeyRecord(
+            self._mm[start:start + key_len].decode(), self._user_id(user), created_at,
+            self._expires[slot], max_uses, uses, bool(active), seq, rate_limit, rate_limit_window, tat
+        )
+
+    def _user_id(self, user: int) -> str:
+        offset = self._users_offset + user * _USER_SIZE
+        start = offset + _OFF_USER_NAME
+        return self._mm[start:start + _USER.unpack_from(self._mm, offset)[1]].decode()
+
+    def _user_slots(self, user: int) -> List[int]:
+        """Registros de un usuario en orden de creación"""
+        mm = self._mm
+        slots = []
+        slot = _INT32.unpack_from(mm, self._users_offset + user * _USER_SIZE + _OFF_HEAD)[0]
+        while slot >= 0:
+            slots.append(slot)
+            slot = _INT32.unpack_from(mm, self._records_offset + slot * _RECORD_SIZE + _OFF_NEXT)[0]
+        return slots
+
+    def _find(self, key: bytes, key_hash: int) -> int:
+        """Registro de una key, o -1 si no existe"""
+        mm = self._mm
+        hashes, slots, mask = self._index_hashes, self._index_slots, self._index_mask
+        i = key_hash & mask
+        while True:
+            entry = slots[i]
+            if entry == 0:
+                return -1
+            if entry > 0 and hashes[i] == key_hash:
+                offset = self._records_offset + (entry - 1) * _RECORD_SIZE
+                start = offset + _RECORD.size
+                key_len = _RECORD.unpack_from(mm, offset)[2]
+                if mm[start:start + key_len] == key:
+                    return entry - 1
+            i = (i + 1) & mask
+
+    def _find_user(self, user_id: bytes, user_hash: int) -> int:
+        """Entrada de un usuario, o -1 si no tiene keys"""
+        mm, mask = self._mm, self._index_mask
+        i = user_hash & mask
+        while True:
+            offset = self._users_offset + i * _USER_SIZE
+            state, length, _, _, _, stored_hash = _USER.unpack_from(mm, offset)
+            if state == _FREE:
+                return -1
+            if state == _USED and stored_hash == user_hash:
+                start = offset + _OFF_USER_NAME
+                if mm[start:start + length] == user_id:
+                    return i
+            i = (i + 1) & mask
+
+    def _index_insert(self, key_hash: int, slot: int):
+        hashes, slots, mask = self._index_hashes, self._index_slots, self._index_mask
+        i = key_hash & mask
+        while slots[i] > 0:
+            i = (i + 1) & mask
+        if slots[i] < 0:
+            self._meta[_M_INDEX_TOMBSTONES] -= 1
+        hashes[i] = key_hash
+        slots[i] = slot + 1
+
+    def _index_remove(self, key_hash: int, slot: int):
+        slots, mask = self._index_slots, self._index_mask
+        i = key_hash & mask
+        while slots[i] != slot + 1:
+            i = (i + 1) & mask
+        slots[i] = -1
+        self._meta[_M_INDEX_TOMBSTONES] += 1
+
+
+    def _rebuild_index(self):
+        """Reconstruye el índice sin lápidas (con el lock exclusivo)"""
+        self._index_bytes[:] = bytes(len(self._index_bytes))
+        self._meta[_M_INDEX_TOMBSTONES] = 0
+        mm = self._mm
+        for slot in range(self._meta[_M_USED]):
+            state, _, _, _, _, _, key_hash, *_ = _RECORD.unpack_from(mm, self._records_offset + slot * _RECORD_SIZE)
+            if state == _USED:
+                self._index_insert(key_hash, slot)
+
+    def _add_user(self, user_id: bytes, user_hash: int) -> int:
+        """Crea la entrada de un usuario sin keys (con el lock exclusivo)"""
+        meta = self._meta
+        if meta[_M_USERS_LIVE] + meta[_M_USER_TOMBSTONES] + 1 > _MAX_LOAD * (self._index_mask + 1):
+            self._rebuild_users()
+        mm, mask = self._mm, self._index_mask
+        i = user_hash & mask
+        while _UINT8.unpack_from(mm, self._users_offset + i * _USER_SIZE)[0] == _USED:
+            i = (i + 1) & mask
+        offset = self._users_offset + i * _USER_SIZE
+        if _UINT8.unpack_from(mm, offset)[0] == _DELETED:
+            meta[_M_USER_TOMBSTONES] -= 1
+        _USER.pack_into(mm, offset, _USED, len(user_id), -1, -1, 0, user_hash)
+        _USER_COUNTS.pack_into(mm, offset + _OFF_USER_COUNTS, *[0] * len(STATE_FIELDS))
+        mm[offset + _OFF_USER_NAME:offset + _OFF_USER_NAME + len(user_id)] = user_id
+        self._link_user(i)
+        meta[_M_USERS_LIVE] += 1
+        return i
+
+    def _link_user(self, user: int):
+        """Añade un usuario al principio de la lista de usuarios con keys (con el lock exclusivo)"""
+        mm, meta = self._mm, self._meta
+        offset = self._users_offset + user * _USER_SIZE
+        head = meta[_M_USERS_HEAD] - 1
+        _INT32.pack_into(mm, offset + _OFF_USER_PREV, -1)
+        _INT32.pack_into(mm, offset + _OFF_USER_NEXT, head)
+        if head >= 0:
+            _INT32.pack_into(mm, self._users_offset + head * _USER_SIZE + _OFF_USER_PREV, user)
+        meta[_M_USERS_HEAD] = user + 1
+
+    def _unlink_user(self, user: int):
+        """Saca un usuario de la lista de usuarios con keys (con el lock exclusivo)"""
+        mm = self._mm
+        offset = self._users_offset + user * _USER_SIZE
+        prev = _INT32.unpack_from(mm, offset + _OFF_USER_PREV)[0]
+        nxt = _INT32.unpack_from(mm, offset + _OFF_USER_NEXT)[0]
+        if prev >= 0:
+            _INT32.pack_into(mm, self._users_offset + prev * _USER_SIZE + _OFF_USER_NEXT, nxt)
+        else:
+            self._meta[_M_USERS_HEAD] = nxt + 1
+        if nxt >= 0:
+            _INT32.pack_into(mm, self._users_offset + nxt * _USER_SIZE + _OFF_USER_PREV, prev)
+
+    def _live_users(self) -> List[int]:
+        """Entradas de los usuarios con keys (con el lock de estructura)"""
+        users = []
+        user = self._meta[_M_USERS_HEAD] - 1
+        while user >= 0:
+            users.append(user)
+            user = _INT32.unpack_from(self._mm, self._users_offset + user * _USER_SIZE + _OFF_USER_NEXT)[0]
+        return users
+
+    def _rebuild_users(self):
+        """Reconstruye la tabla de usuarios sin lápidas y reenlaza sus keys (con el lock exclusivo)"""
+        mm = self._mm
+        users = [
+            (old, mm[offset:offset + _USER_SIZE], self._user_slots(old))
+            for old, offset in ((old, self._users_offset + old * _USER_SIZE) for old in self._live_users())
+        ]
+        self._view[self._users_offset:self._users_offset + self._users_size] = bytes(self._users_size)
+        self._meta[_M_USER_TOMBSTONES] = 0
+        self._meta[_M_USERS_HEAD] = 0
+        mask = self._index_mask
+        moved = {}
+        for old, entry, slots in reversed(users):
+            i = _USER.unpack_from(entry)[5] & mask
+            while _UINT8.unpack_from(mm, self._users_offset + i * _USER_SIZE)[0] == _USED:
+                i = (i + 1) & mask
+            offset = self._users_offset + i * _USER_SIZE
+            mm[offset:offset + _USER_SIZE] = entry
+            self._link_user(i)
+            moved[old] = i
+            for slot in slots:
+                _INT32.pack_into(mm, self._records_offset + slot * _RECORD_SIZE + _OFF_USER, i)
+        # Los grupos de expiración pendientes llevan como etiqueta la entrada de su usuario
+        groups = self._pending_expiry
+        for group in range(groups.state[1]):
+            if groups.counts[group]:
+                groups.tags[group] = moved[groups.tags[group]]
+
+    def _append_order(self, seq: int, slot: int):
+        """Añade una key al orden de creación, compactándolo si está lleno (con el lock exclusivo)"""
+        meta, seqs, slots = self._meta, self._order_seqs, self._order_slots
+        if meta[_M_ORDER_LEN] == len(seqs):
+            # Se descartan las entradas de keys desalojadas (como mucho hay `capacity` vivas)
+            kept = 0
+            for i in range(len(seqs)):
+                if self._order_alive(seqs[i], slots[i]):
+                    seqs[kept], slots[kept] = seqs[i], slots[i]
+                    kept += 1
+            meta[_M_ORDER_LEN] = kept
+        n = meta[_M_ORDER_LEN]
+        seqs[n] = seq
+        slots[n] = slot
+        meta[_M_ORDER_LEN] = n + 1
+
+    def _order_alive(self, seq: int, slot: int) -> bool:
+        """Indica si una entrada del orden de creación sigue apuntando a su key"""
+        offset = self._records_offset + slot * _RECORD_SIZE
+        state, _, _, _, _, _, _, record_seq, *_ = _RECORD.unpack_from(self._mm, offset)
+        return state == _USED and record_seq == seq
+
+    def _insert(self, key: str, user_id: str, created_at: float, expires_at: float, max_uses: int,
+                rate_limit: int, rate_limit_window: float) -> KeyRecord:
+        """Almacena una key (con el lock exclusivo)"""
+        key_bytes = key.encode()
+        user_bytes = user_id.encode()
+        if len(key_bytes) > _MAX_KEY_BYTES:
+            raise ValueError(f"La key supera los {_MAX_KEY_BYTES} bytes del almacenamiento compartido")
+        if len(user_bytes) > _MAX_USER_BYTES:
+            raise ValueError(f"El user_id supera los {_MAX_USER_BYTES} bytes del almacenamiento compartido")
+        meta, mm = self._meta, self._mm
+        if meta[_M_LIVE] >= self._capacity:
+            raise ValueError(f"Almacenamiento compartido lleno ({self._capacity} keys)")
+        key_hash = _hash(key_bytes)
+        if self._find(key_bytes, key_hash) >= 0:
+            raise ValueError("La key ya existe")
+        if meta[_M_LIVE] + meta[_M_INDEX_TOMBSTONES] + 1 > _MAX_LOAD * (self._index_mask + 1):
+            self._rebuild_index()
+
+        user_hash = _hash(user_bytes)
+        user = self._find_user(user_bytes, user_hash)
+        if user < 0:
+            user = self._add_user(user_bytes, user_hash)
+        user_offset = self._users_offset + user * _USER_SIZE
+        _, _, head, tail, count, _ = _USER.unpack_from(mm, user_offset)
+
+        # Registro libre: primero los liberados, después los nunca usados
+        if meta[_M_FREE_HEAD]:
+            slot = meta[_M_FREE_HEAD] - 1
+            meta[_M_FREE_HEAD] = _INT32.unpack_from(mm, self._records_offset + slot * _RECORD_SIZE + _OFF_NEXT)[0] + 1
+        else:
+            slot = meta[_M_USED]
+            meta[_M_USED] = slot + 1
+        seq = meta[_M_NEXT_SEQ]
+        meta[_M_NEXT_SEQ] = seq + 1
+
+        offset = self._records_offset + slot * _RECORD_SIZE
+        _RECORD.pack_into(mm, offset, _USED, 1, len(key_bytes), user, tail, -1, key_hash, seq,
+                          created_at, max_uses, 0, rate_limit, rate_limit_window, 0.0)
+        mm[offset + _RECORD.size:offset + _RECORD.size + len(key_bytes)] = key_bytes
+        self._expires[slot] = expires_at
+        self._eviction.push(slot, expires_at)
+        self._count_user(user, TOTAL)
+        self._count_user(user, ACTIVE)
+        if self._pending_expiry.add(slot, expires_at, user):
+            self._count(EXPIRED)
+            self._count_user(user, EXPIRED)
+
+        # Al final de la lista del usuario
+        if tail >= 0:
+            _INT32.pack_into(mm, self._records_offset + tail * _RECORD_SIZE + _OFF_NEXT, slot)
+        else:
+            _INT32.pack_into(mm, user_offset + _OFF_HEAD, slot)
+        _INT32.pack_into(mm, user_offset + _OFF_TAIL, slot)
+        _INT32.pack_into(mm, user_offset + _OFF_COUNT, count + 1)
+
+        self._index_insert(key_hash, slot)
+        self._append_order(seq, slot)
+        meta[_M_LIVE] += 1
+        return KeyRecord(
+            key, user_id, created_at, expires_at, max_uses, seq=seq,
+            rate_limit=rate_limit, rate_limit_window=rate_limit_window
+        )
+
+    def _delete(self, slot: int) -> KeyRecord:
+        """Elimina una key y devuelve su último registro (con el lock exclusivo)"""
+        meta, mm = self._meta, self._mm
+        record = self._record(slot)
+        offset = self._records_offset + slot * _RECORD_SIZE
+        _, _, _, user, prev, nxt, key_hash, *_ = _RECORD.unpack_from(mm, offset)
+        self._count_user(user, ACTIVE if record.is_active else REVOKED, -1)
+        if record.current_uses >= record.max_uses:
+            self._count_user(user, EXHAUSTED, -1)
+        self._count_user(user, USES, -record.current_uses)
+        self._count_user(user, TOTAL, -1)
+
+        # Fuera de la lista del usuario
+        user_offset = self._users_offset + user * _USER_SIZE
+        if prev >= 0:
+            _INT32.pack_into(mm, self._records_offset + prev * _RECORD_SIZE + _OFF_NEXT, nxt)
+        else:
+            _INT32.pack_into(mm, user_offset + _OFF_HEAD, nxt)
+        if nxt >= 0:
+            _INT32.pack_into(mm, self._records_offset + nxt * _RECORD_SIZE + _OFF_PREV, prev)
+        else:
+            _INT32.pack_into(mm, user_offset + _OFF_TAIL, prev)
+        count = _INT32.unpack_from(mm, user_offset + _OFF_COUNT)[0] - 1
+        _INT32.pack_into(mm, user_offset + _OFF_COUNT, count)
+        if not count:
+            _UINT8.pack_into(mm, user_offset, _DELETED)
+            self._unlink_user(user)
+            meta[_M_USERS_LIVE] -= 1
+            meta[_M_USER_TOMBSTONES] += 1
+
+        self._index_remove(key_hash, slot)
+        self._eviction.remove(slot)
+        if self._pending_expiry.remove(slot)[0]:
+            self._count(EXPIRED, -1)
+            self._count_user(user, EXPIRED, -1)
+        # A la lista de libres (enlazada por el campo "siguiente")
+        _UINT8.pack_into(mm, offset, _FREE)
+        _INT32.pack_into(mm, offset + _OFF_NEXT, meta[_M_FREE_HEAD] - 1)
+        meta[_M_FREE_HEAD] = slot + 1
+        self._expires[slot] = _NEVER
+        meta[_M_LIVE] -= 1
+        return record
+
+    # Interfaz KeyStore
+
+    def create(self, key, user_id, created_at, expires_at, max_uses, rate_limit=0, rate_limit_window=0.0):
+        return self.create_many([key], user_id, created_at, expires_at, max_uses, rate_limit, rate_limit_window)[0]
+
+    def create_many(self, keys, user_id, created_at, expires_at, max_uses, rate_limit=0, rate_limit_window=0.0):
+        with self._locked(fcntl.LOCK_EX):
+            records = [
+                self._insert(key, user_id, created_at, expires_at, max_uses, rate_limit, rate_limit_window)
+                for key in keys
+            ]
+            self._count(TOTAL, len(records))
+            self._count(ACTIVE, len(records))
+            self._event(created_at, GENERATED, len(records))
+        return records
+
+    def _consume(self, key: str, now: float):
+        """Consume un uso (con el lock de estructura compartido)"""
+        key_bytes = key.encode()
+        slot = self._find(key_bytes, _hash(key_bytes))
+        if slot < 0:
+            return STATUS_INVALID, None
+        # Ruta más usada: locks sin contextmanager
+        mm, fd = self._mm, self._fd
+        offset = self._records_offset + slot * _RECORD_SIZE
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, offset)
+        try:
+            _, active, _, user, _, _, _, _, _, max_uses, uses, rate_limit, window, tat = _RECORD.unpack_from(mm, offset)
+            if not active:
+                return STATUS_REVOKED, None
+            if now > self._expires[slot]:
+                return STATUS_EXPIRED, None
+            if uses >= max_uses:
+                return STATUS_EXHAUSTED, None
+            if rate_limit:
+                # Cuota por ventana, también bajo el lock del registro
+                tat = gcra(tat, now, rate_limit, window)
+                if tat is None:
+                    return STATUS_RATE_LIMITED, None
+                _DOUBLE.pack_into(mm, offset + _OFF_TAT, tat)
+            # Lectura y escritura bajo el lock del registro: nunca se supera max_uses
+            _INT64.pack_into(mm, offset + _OFF_USES, uses + 1)
+            exhausted = uses + 1 >= max_uses
+            if exhausted:
+                # Agotada: se desaloja a partir de ahora en lugar de al expirar
+                fcntl.lockf(fd, fcntl.LOCK_EX, 1, _EXPIRY_LOCK)
+                try:
+                    if now < self._eviction.priority(slot):
+                        self._eviction.update(slot, now)
+                finally:
+                    fcntl.lockf(fd, fcntl.LOCK_UN, 1, _EXPIRY_LOCK)
+                self._count(EXHAUSTED)
+            record = self._record(slot)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, offset)
+        self._count(USES)
+        self._event(now, HOURLY_USES)
+        user_offset = self._users_offset + user * _USER_SIZE
+        fcntl.lockf(fd, fcntl.LOCK_EX, 1, user_offset)
+        try:
+            self._count_user(user, USES)
+            if exhausted:
+                self._count_user(user, EXHAUSTED)
+        finally:
+            fcntl.lockf(fd, fcntl.LOCK_UN, 1, user_offset)
+        return STATUS_VALID, record
+
+    def consume(self, key, now):
+        with self._lock:
+            fcntl.lockf(self._fd, fcntl.LOCK_SH, 1, 0)
+            try:
+                return self._consume(key, now)
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+
+    def consume_many(self, keys, now):
+        with self._locked(fcntl.LOCK_SH):
+            return [self._consume(key, now) for key in keys]
+
+    def get(self, key):
+        key_bytes = key.encode()
+        with self._locked(fcntl.LOCK_SH):
+            slot = self._find(key_bytes, _hash(key_bytes))
+            return self._record(slot) if slot >= 0 else None
+
+    def list(self):
+        # Por bloques, sin retener el lock entre bloques
+        key_filter = KeyFilter()
+        after = 0
+        while after is not None:
+            records, after = self.page(after, 1000, key_filter, 0.0)
+            yield from records
+
+    def page(self, after, limit, key_filter, now):
+        records = []
+        with self._locked(fcntl.LOCK_SH):
+            if key_filter.user_id is not None:
+                # Solo las keys del usuario, recorriendo su lista
+                user_bytes = key_filter.user_id.encode()
+                user = self._find_user(user_bytes, _hash(user_bytes))
+                candidates = [(None, slot) for slot in self._user_slots(user)] if user >= 0 else []
+                start = 0
+            else:
+                n = self._meta[_M_ORDER_LEN]
+                seqs, slots = self._order_seqs, self._order_slots
+                candidates = range(n)
+                start = bisect_right(seqs[:n], after)
+            for i in range(start, len(candidates)):
+                if key_filter.user_id is None:
+                    seq, slot = seqs[i], slots[i]
+                    if not self._order_alive(seq, slot):
+                        continue
+                else:
+                    slot = candidates[i][1]
+                record = self._record(slot)
+                if record.seq <= after or not key_filter.matches(record, now):
+                    continue
+                records.append(record)
+                if len(records) == limit:
+                    more = i + 1 < len(candidates)
+                    return records, record.seq if more else None
+        return records, None
+
+    def revoke(self, key, now):
+        key_bytes = key.encode()
+        with self._locked(fcntl.LOCK_SH):
+            slot = self._find(key_bytes, _hash(key_bytes))
+            if slot < 0:
+                return False
+            with self._slot_locked(slot) as offset:
+                if not _UINT8.unpack_from(self._mm, offset + _OFF_ACTIVE)[0]:
+                    return True
+                _UINT8.pack_into(self._mm, offset + _OFF_ACTIVE, 0)
+                user = _INT32.unpack_from(self._mm, offset + _OFF_USER)[0]
+            self._count(ACTIVE, -1)
+            self._count(REVOKED)
+            self._event(now, HOURLY_REVOKED)
+            with self._user_locked(user):
+                self._count_user(user, ACTIVE, -1)
+                self._count_user(user, REVOKED)
+        return True
+
+    def user_keys(self, user_id):
+        user_bytes = user_id.encode()
+        with self._locked(fcntl.LOCK_SH):
+            user = self._find_user(user_bytes, _hash(user_bytes))
+            return [self._record(slot) for slot in self._user_slots(user)] if user >= 0 else []
+
+    def revoke_user(self, user_id, now):
+        user_bytes = user_id.encode()
+        revoked = 0
+        with self._locked(fcntl.LOCK_SH):
+            user = self._find_user(user_bytes, _hash(user_bytes))
+            for slot in self._user_slots(user) if user >= 0 else ():
+                with self._slot_locked(slot) as offset:
+                    if _UINT8.unpack_from(self._mm, offset + _OFF_ACTIVE)[0]:
+                        _UINT8.pack_into(self._mm, offset + _OFF_ACTIVE, 0)
+                        revoked += 1
+            if revoked:
+                self._count(ACTIVE, -revoked)
+                self._count(REVOKED, revoked)
+                self._event(now, HOURLY_REVOKED, revoked)
+                with self._user_locked(user):
+                    self._count_user(user, ACTIVE, -revoked)
+                    self._count_user(user, REVOKED, revoked)
+        return revoked
+
+    def _advance_expired(self, now: float):
+        """Cuenta como expiradas las keys cuyo expires_at ya pasó (O(log n) por lote de keys)"""
+        with self._locked(fcntl.LOCK_SH), self._expiry_locked():
+            expired = 0
+            # Cada grupo lleva como etiqueta la entrada de su usuario
+            for user, count in self._pending_expiry.advance(now):
+                expired += count
+                with self._user_locked(user):
+                    self._count_user(user, EXPIRED, count)
+            if expired:
+                self._count(EXPIRED, expired)
+
+    def stats(self, now):
+        self._advance_expired(now)
+        # Suma de las franjas de todos los procesos (incluidos los que ya terminaron)
+        values = [0] * len(STATE_FIELDS)
+        hourly: Dict[int, List[int]] = {}
+        since = hour_of(now) - self._hourly_window * 3600
+        entry = 1 + len(HOURLY_FIELDS)
+        for stripe in range(MAX_WORKERS):
+            offset = self._stripes_offset + stripe * self._stripe_size
+            for field, value in enumerate(self._stripe_counts.unpack_from(self._mm, offset)):
+                values[field] += value
+            counts = self._stripe_hourly.unpack_from(self._mm, offset + self._stripe_counts.size)
+            for base in range(0, len(counts), entry):
+                hour = counts[base]
+                if hour > since:
+                    totals = hourly.setdefault(hour, [0] * len(HOURLY_FIELDS))
+                    for i in range(len(HOURLY_FIELDS)):
+                        totals[i] += counts[base + 1 + i]
+        stats = state_dict(values)
+        stats["hourly"] = [
+            {"hour": hour, **dict(zip(HOURLY_FIELDS, counts))} for hour, counts in sorted(hourly.items())
+        ]
+        return stats
+
+    def user_stats(self, user_id, now):
+        self._advance_expired(now)
+        user_bytes = user_id.encode()
+        with self._locked(fcntl.LOCK_SH):
+            user = self._find_user(user_bytes, _hash(user_bytes))
+            if user < 0:
+                return None
+            with self._user_locked(user):
+                return state_dict(self._user_values(user))
+
+    def users_stats(self, now):
+        self._advance_expired(now)
+        users = {}
+        with self._locked(fcntl.LOCK_SH):
+            for user in self._live_users():
+                with self._user_locked(user):
+                    users[self._user_id(user)] = state_dict(self._user_values(user))
+        return users
+
+    def evict(self, cutoff, limit):
+        # El heap solo contiene keys vivas: cada entrada extraída es una key desalojada
+        expired = exhausted = 0
+        evicted = []
+        heap = self._eviction
+        with self._locked(fcntl.LOCK_EX):
+            while len(heap) and expired + exhausted < limit:
+                at, slot = heap.peek()
+                if at > cutoff:
+                    break
+                record = self._delete(slot)
+                evicted.append(record.key)
+                if record.current_uses >= record.max_uses:
+                    exhausted += 1
+                    self._count(EXHAUSTED, -1)
+                else:
+                    expired += 1
+                self._count(ACTIVE if record.is_active else REVOKED, -1)
+                self._count(USES, -record.current_uses)
+                self._count(TOTAL, -1)
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+        return expired, exhausted
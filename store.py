@@ -0,0 +1,906 @@
+"""
+🗄️ Almacenamiento de keys
+Interfaz común para los backends de almacenamiento y sus implementaciones:
+memoria (por proceso) y SQLite en modo WAL (persistente y compartido entre procesos).
+La tabla en memoria compartida entre workers está en sharedstore.py
+"""
+
+import heapq
+import threading
+from bisect import bisect_right
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from counters import (
+    STATE_FIELDS, TOTAL, ACTIVE, REVOKED, EXPIRED, EXHAUSTED, USES,
+    GENERATED, HOURLY_USES, HOURLY_REVOKED, HOURLY_FIELDS, KeyCounters, hour_of, state_dict,
+)
+
+# Resultados posibles de una validación
+STATUS_VALID = "valid"
+STATUS_INVALID = "invalid"
+STATUS_REVOKED = "revoked"
+STATUS_EXPIRED = "expired"
+STATUS_EXHAUSTED = "exhausted"
+STATUS_RATE_LIMITED = "rate_limited"
+
+# Margen para comparar instantes en epoch (la precisión de un float ronda el microsegundo)
+_QUOTA_EPSILON = 1e-6
+
+
+def to_iso(timestamp: float) -> str:
+    """Convierte un epoch al formato ISO usado en las respuestas de la API"""
+    return datetime.fromtimestamp(timestamp).isoformat()
+
+
+def gcra(tat: float, now: float, limit: int, window: float) -> Optional[float]:
+    """Cuota de `limit` usos por `window` segundos con GCRA (generic cell rate algorithm).
+
+    `tat` (theoretical arrival time) es todo el estado de la cuota: cada uso lo
+    adelanta window/limit segundos y se rechaza si quedaría más de `window` por
+    delante de `now`. Devuelve el nuevo tat, o None si la cuota está agotada.
+    """
+    interval = window / limit
+    tat = max(tat, now)
+    if tat - now > window - interval + _QUOTA_EPSILON:
+        return None
+    return tat + interval
+
+
+def quota_dict(record: "KeyRecord", now: float) -> dict:
+    """Estado de la cuota de una key para las respuestas de validación"""
+    interval = record.rate_limit_window / record.rate_limit
+    tat = max(record.tat, now)
+    remaining = int((record.rate_limit_window - (tat - now)) / interval + _QUOTA_EPSILON)
+    # Segundos hasta el siguiente uso permitido (0 si quedan usos)
+    retry_after = 0.0 if remaining else max(0.0, tat - record.rate_limit_window + interval - now)
+    return {
+        "limit": record.rate_limit,
+        "window_seconds": record.rate_limit_window,
+        "remaining": remaining,
+        "retry_after": round(retry_after, 3),
+        # Momento en que la cuota vuelve a estar completa
+        "reset_at": to_iso(tat)
+    }
+
+
+class KeyRecord:
+    """Registro compacto de una key.
+
+    Usa __slots__ (sin dict por instancia) y guarda las fechas como epoch en
+    segundos; las cadenas ISO solo se generan en las respuestas de la API.
+    """
+
+    __slots__ = ("key", "user_id", "created_at", "expires_at", "max_uses", "current_uses",
+                 "is_active", "seq", "rate_limit", "rate_limit_window", "tat")
+
+    def __init__(self, key: str, user_id: str, created_at: float, expires_at: float,
+                 max_uses: int, current_uses: int = 0, is_active: bool = True, seq: int = 0,
+                 rate_limit: int = 0, rate_limit_window: float = 0.0, tat: float = 0.0):
+        self.key = key
+        self.user_id = user_id
+        self.created_at = created_at
+        self.expires_at = expires_at
+        self.max_uses = max_uses
+        self.current_uses = current_uses
+        self.is_active = is_active
+        # Número de secuencia creciente: orden estable para la paginación
+        self.seq = seq
+        # Cuota de usos por ventana (0: sin cuota) y su estado GCRA (ver gcra())
+        self.rate_limit = rate_limit
+        self.rate_limit_window = rate_limit_window
+        self.tat = tat
+
+    def to_dict(self) -> dict:
+        """Convierte el registro al formato de la API (fechas ISO)"""
+        return {
+            "key": self.key,
+            "user_id": self.user_id,
+            "created_at": to_iso(self.created_at),
+            "expires_at": to_iso(self.expires_at),
+            "max_uses": self.max_uses,
+            "current_uses": self.current_uses,
+            "is_active": self.is_active,
+            "rate_limit": self.rate_limit or None,
+            "rate_limit_window": self.rate_limit_window if self.rate_limit else None
+        }
+
+
+class KeyFilter:
+    """Filtros del listado de keys; None en un campo significa sin filtrar por él"""
+
+    __slots__ = ("user_id", "active", "expired", "exhausted", "created_from", "created_to")
+
+    def __init__(self, user_id: Optional[str] = None, active: Optional[bool] = None,
+                 expired: Optional[bool] = None, exhausted: Optional[bool] = None,
+                 created_from: Optional[float] = None, created_to: Optional[float] = None):
+        self.user_id = user_id
+        self.active = active
+        self.expired = expired
+        self.exhausted = exhausted
+        self.created_from = created_from
+        self.created_to = created_to
+
+    def matches(self, record: KeyRecord, now: float) -> bool:
+        """Indica si un registro cumple todos los filtros"""
+        return (
+            (self.user_id is None or record.user_id == self.user_id)
+            and (self.active is None or record.is_active == self.active)
+            and (self.expired is None or (now > record.expires_at) == self.expired)
+            and (self.exhausted is None
+                 or (record.current_uses >= record.max_uses) == self.exhausted)
+            and (self.created_from is None or record.created_at >= self.created_from)
+            and (self.created_to is None or record.created_at <= self.created_to)
+        )
+
+    def sql(self, now: float) -> Tuple[str, list]:
+        """Condiciones SQL equivalentes a matches() y sus parámetros"""
+        conditions, params = [], []
+        if self.user_id is not None:
+            conditions.append("user_id = ?")
+            params.append(self.user_id)
+        if self.active is not None:
+            conditions.append("is_active = ?")
+            params.append(int(self.active))
+        if self.expired is not None:
+            conditions.append("expires_at < ?" if self.expired else "expires_at >= ?")
+            params.append(now)
+        if self.exhausted is not None:
+            conditions.append("current_uses >= max_uses" if self.exhausted else "current_uses < max_uses")
+        if self.created_from is not None:
+            conditions.append("created_at >= ?")
+            params.append(self.created_from)
+        if self.created_to is not None:
+            conditions.append("created_at <= ?")
+            params.append(self.created_to)
+        return " AND ".join(conditions), params
+
+
+class StoreBusy(Exception):
+    """Otro proceso tiene bloqueado el almacenamiento más tiempo del que se espera"""
+
+
+class KeyStore:
+    """Interfaz de almacenamiento usada por todos los endpoints"""
+
+    # Se llama con las keys eliminadas por cada evict() (feed de cambios)
+    on_evict: Optional[Callable[[List[str]], None]] = None
+
+    def create(self, key: str, user_id: str, created_at: float, expires_at: float, max_uses: int,
+               rate_limit: int = 0, rate_limit_window: float = 0.0) -> KeyRecord:
+        """Almacena una nueva key (fechas en epoch) y devuelve su registro.
+
+        Con `rate_limit` > 0 la key admite como mucho `rate_limit` usos cada
+        `rate_limit_window` segundos, además del límite total `max_uses`.
+        """
+        raise NotImplementedError
+
+    def create_many(self, keys: List[str], user_id: str, created_at: float, expires_at: float,
+                    max_uses: int, rate_limit: int = 0, rate_limit_window: float = 0.0) -> List[KeyRecord]:
+        """Almacena varias keys con los mismos parámetros"""
+        return [
+            self.create(key, user_id, created_at, expires_at, max_uses, rate_limit, rate_limit_window)
+            for key in keys
+        ]
+
+    def consume(self, key: str, now: float) -> Tuple[str, Optional[KeyRecord]]:
+        """Valida una key y consume un uso si es válida y su cuota lo permite.
+
+        Devuelve (estado, registro); el registro es None si la key no es válida.
+        Un uso rechazado por la cuota (STATUS_RATE_LIMITED) no se cuenta.
+        """
+        raise NotImplementedError
+
+    def consume_many(self, keys: List[str], now: float) -> List[Tuple[str, Optional[KeyRecord]]]:
+        """Valida y consume varias keys, manteniendo el orden de entrada"""
+        return [self.consume(key, now) for key in keys]
+
+    def get(self, key: str) -> Optional[KeyRecord]:
+        """Obtiene el registro de una key, o None si no existe"""
+        raise NotImplementedError
+
+    def list(self) -> Iterator[KeyRecord]:
+        """Itera sobre los registros de todas las keys"""
+        raise NotImplementedError
+
+    def page(self, after: int, limit: int, key_filter: KeyFilter,
+             now: float) -> Tuple[List[KeyRecord], Optional[int]]:
+        """Devuelve hasta `limit` registros con seq > `after` que cumplen los filtros.
+
+        Los registros se ordenan por seq. El segundo valor es el cursor para la
+        siguiente página, o None si se llegó al final.
+        """
+        raise NotImplementedError
+
+    def revoke(self, key: str, now: float) -> bool:
+        """Revoca una key; devuelve False si no existe"""
+        raise NotImplementedError
+
+    def user_keys(self, user_id: str) -> List[KeyRecord]:
+        """Registros de las keys de un usuario en orden de creación (O(keys del usuario))"""
+        raise NotImplementedError
+
+    def revoke_user(self, user_id: str, now: float) -> int:
+        """Revoca todas las keys activas de un usuario; devuelve cuántas se revocaron"""
+        raise NotImplementedError
+
+    def stats(self, now: float) -> dict:
+        """Contadores de estado globales (ver counters.STATE_FIELDS) y eventos por hora"""
+        raise NotImplementedError
+
+    def user_stats(self, user_id: str, now: float) -> Optional[dict]:
+        """Contadores de estado de un usuario, o None si no tiene keys"""
+        raise NotImplementedError
+
+    def users_stats(self, now: float) -> Dict[str, dict]:
+        """Contadores de estado de todos los usuarios con keys"""
+        raise NotImplementedError
+
+    def exact_stats(self, now: float) -> dict:
+        """Recalcula los contadores de estado recorriendo todas las keys (O(n))"""
+        values = [0] * len(STATE_FIELDS)
+        for record in self.list():
+            values[TOTAL] += 1
+            values[ACTIVE if record.is_active else REVOKED] += 1
+            if now > record.expires_at:
+                values[EXPIRED] += 1
+            if record.current_uses >= record.max_uses:
+                values[EXHAUSTED] += 1
+            values[USES] += record.current_uses
+        return state_dict(values)
+
+    def evict(self, cutoff: float, limit: int) -> Tuple[int, int]:
+        """Elimina hasta `limit` keys expiradas o agotadas antes de `cutoff`.
+
+        El trabajo es proporcional al número de keys eliminadas.
+        Devuelve (expiradas, agotadas).
+        """
+        raise NotImplementedError
+
+
+class MemoryKeyStore(KeyStore):
+    """Almacenamiento en un diccionario del proceso (se pierde al reiniciar)"""
+
+    def __init__(self, hourly_window: int = 48):
+        self._keys = {}
+        # Índice de expiración: min-heap de (momento de desalojo, key). Las
+        # entradas obsoletas (keys ya eliminadas) se descartan al extraerlas y
+        # se compactan cuando son mayoría (ver _compact_expiry)
+        self._expiry = []
+        # Keys aún no contadas como expiradas: min-heap de (expires_at, key).
+        # Las keys con expires_at < _expired_watermark ya están contadas
+        self._pending_expiry = []
+        self._expired_watermark = 0.0
+        self._counters = KeyCounters(hourly_window)
+        # Orden de inserción para la paginación: listas paralelas de seq y key.
+        # Las keys desalojadas se saltan y se compactan cuando son mayoría
+        self._next_seq = 1
+        self._order_seqs = []
+        self._order_keys = []
+        self._order_stale = 0
+        # Índice secundario user_id -> keys. Un dict como conjunto ordenado:
+        # conserva el orden de creación y elimina en O(1)
+        self._by_user = {}
+
+    def create(self, key, user_id, created_at, expires_at, max_uses, rate_limit=0, rate_limit_window=0.0):
+        record = KeyRecord(
+            key, user_id, created_at, expires_at, max_uses, seq=self._next_seq,
+            rate_limit=rate_limit, rate_limit_window=float(rate_limit_window)
+        )
+        self._next_seq += 1
+        self._keys[key] = record
+        self._order_seqs.append(record.seq)
+        self._order_keys.append(key)
+        self._by_user.setdefault(user_id, {})[key] = None
+        heapq.heappush(self._expiry, (expires_at, key))
+
+        counters = self._counters
+        counters.add(user_id, TOTAL)
+        counters.add(user_id, ACTIVE)
+        counters.event(created_at, GENERATED)
+        if expires_at < self._expired_watermark:
+            counters.add(user_id, EXPIRED)
+        else:
+            heapq.heappush(self._pending_expiry, (expires_at, key))
+        return record
+
+    def consume(self, key, now):
+        record = self._keys.get(key)
+        if record is None:
+            return STATUS_INVALID, None
+
+        # Verificar si la key está activa
+        if not record.is_active:
+            return STATUS_REVOKED, None
+
+        # Verificar si ha expirado
+        if now > record.expires_at:
+            return STATUS_EXPIRED, None
+
+        # Verificar si se ha excedido el límite de usos
+        if record.current_uses >= record.max_uses:
+            return STATUS_EXHAUSTED, None
+
+        # Verificar la cuota por ventana (O(1): solo se guarda el tat)
+        if record.rate_limit:
+            tat = gcra(record.tat, now, record.rate_limit, record.rate_limit_window)
+            if tat is None:
+                return STATUS_RATE_LIMITED, None
+            record.tat = tat
+
+        # Incrementar contador de usos
+        record.current_uses += 1
+        self._counters.add(record.user_id, USES)
+        self._counters.event(now, HOURLY_USES)
+        if record.current_uses >= record.max_uses:
+            # Agotada: se desaloja a partir de ahora en lugar de al expirar
+            heapq.heappush(self._expiry, (now, key))
+            self._counters.add(record.user_id, EXHAUSTED)
+        return STATUS_VALID, record
+
+    def get(self, key):
+        return self._keys.get(key)
+
+    def list(self):
+        return iter(self._keys.values())
+
+    def page(self, after, limit, key_filter, now):
+        records = []
+        if key_filter.user_id is not None:
+            # Solo las keys del usuario, usando el índice secundario
+            candidates = self.user_keys(key_filter.user_id)
+            start = bisect_right([record.seq for record in candidates], after)
+        else:
+            keys = self._keys
+            candidates = self._order_keys
+            start = bisect_right(self._order_seqs, after)
+        for i in range(start, len(candidates)):
+            record = candidates[i]
+            if key_filter.user_id is None:
+                record = keys.get(record)
+            if record is None or not key_filter.matches(record, now):
+                continue
+            records.append(record)
+            if len(records) == limit:
+                more = i + 1 < len(candidates)
+                return records, record.seq if more else None
+        return records, None
+
+    def _compact_order(self):
+        """Elimina del orden de inserción las keys desalojadas"""
+        alive = [(seq, key) for seq, key in zip(self._order_seqs, self._order_keys) if key in self._keys]
+        self._order_seqs = [seq for seq, _ in alive]
+        self._order_keys = [key for _, key in alive]
+        self._order_stale = 0
+
+    def revoke(self, key, now):
+        record = self._keys.get(key)
+        if record is None:
+            return False
+        if record.is_active:
+            record.is_active = False
+            self._counters.add(record.user_id, ACTIVE, -1)
+            self._counters.add(record.user_id, REVOKED)
+            self._counters.event(now, HOURLY_REVOKED)
+        return True
+
+    def user_keys(self, user_id):
+        keys = self._keys
+        return [keys[key] for key in self._by_user.get(user_id, ())]
+
+    def revoke_user(self, user_id, now):
+        revoked = 0
+        for record in self.user_keys(user_id):
+            if record.is_active:
+                record.is_active = False
+                revoked += 1
+        if revoked:
+            self._counters.add(user_id, ACTIVE, -revoked)
+            self._counters.add(user_id, REVOKED, revoked)
+            self._counters.event(now, HOURLY_REVOKED, revoked)
+        return revoked
+
+    def _advance_expired(self, now: float):
+        """Cuenta como expiradas las keys cuyo expires_at ya pasó (amortizado O(1))"""
+        heap = self._pending_expiry
+        while heap and heap[0][0] < now:
+            _, key = heapq.heappop(heap)
+            record = self._keys.get(key)
+            if record is not None:
+                self._counters.add(record.user_id, EXPIRED)
+        self._expired_watermark = max(self._expired_watermark, now)
+
+    def stats(self, now):
+        self._advance_expired(now)
+        stats = state_dict(self._counters.totals)
+        stats["hourly"] = self._counters.hourly_list(hour_of(now) - self._counters.hourly_window * 3600)
+        return stats
+
+    def user_stats(self, user_id, now):
+        self._advance_expired(now)
+        values = self._counters.user(user_id)
+        return state_dict(values) if values is not None else None
+
+    def users_stats(self, now):
+        self._advance_expired(now)
+        return {user_id: state_dict(values) for user_id, values in self._counters.users.items()}
+
+    def evict(self, cutoff, limit):
+        expired = exhausted = 0
+        evicted = []
+        heap = self._expiry
+        while heap and heap[0][0] <= cutoff and expired + exhausted < limit:
+            _, key = heapq.heappop(heap)
+            record = self._keys.get(key)
+            if record is None:
+                continue
+            if record.current_uses >= record.max_uses:
+                exhausted += 1
+            elif record.expires_at <= cutoff:
+                expired += 1
+            else:
+                continue
+            self._remove(record)
+            evicted.append(key)
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+        return expired, exhausted
+
+    def _remove(self, record: KeyRecord):
+        """Elimina una key de todos los índices y contadores"""
+        del self._keys[record.key]
+        self._unindex(record)
+        self._uncount(record)
+        self._order_stale += 1
+        if self._order_stale > len(self._order_keys) // 2:
+            self._compact_order()
+        # Cada key viva tiene como mucho tres entradas en los heaps (expiración,
+        # agotamiento y pendiente de contar como expirada)
+        if len(self._expiry) + len(self._pending_expiry) > 6 * len(self._keys) + 64:
+            self._compact_expiry()
+
+    def _compact_expiry(self):
+        """Elimina de los heaps de expiración las entradas de keys eliminadas.
+
+        Una key agotada y desalojada deja en ellos su entrada por expires_at, que
+        retendría la key hasta esa fecha. Se filtra en el sitio: evict() sigue
+        usando la misma lista
+        """
+        keys = self._keys
+        for heap in (self._expiry, self._pending_expiry):
+            heap[:] = [entry for entry in heap if entry[1] in keys]
+            heapq.heapify(heap)
+
+    def delete(self, key: str) -> bool:
+        """Elimina una key (réplicas: aplica los desalojos del primario)"""
+        record = self._keys.get(key)
+        if record is None:
+            return False
+        self._remove(record)
+        return True
+
+    def set_uses(self, key: str, uses: int, now: float) -> bool:
+        """Sube current_uses hasta `uses` sin comprobar el estado de la key (réplicas).
+
+        Nunca lo baja, así que aplicar dos veces el mismo evento no cambia nada.
+        """
+        record = self._keys.get(key)
+        if record is None:
+            return False
+        delta = uses - record.current_uses
+        if delta <= 0:
+            return True
+        was_exhausted = record.current_uses >= record.max_uses
+        record.current_uses = uses
+        self._counters.add(record.user_id, USES, delta)
+        self._counters.event(now, HOURLY_USES, delta)
+        if not was_exhausted and uses >= record.max_uses:
+            heapq.heappush(self._expiry, (now, key))
+            self._counters.add(record.user_id, EXHAUSTED)
+        return True
+
+    def _unindex(self, record: KeyRecord):
+        """Elimina una key desalojada del índice por usuario"""
+        user_keys = self._by_user[record.user_id]
+        del user_keys[record.key]
+        if not user_keys:
+            del self._by_user[record.user_id]
+
+    def _uncount(self, record: KeyRecord):
+        """Descuenta de los contadores de estado una key eliminada"""
+        counters = self._counters
+        user_id = record.user_id
+        counters.add(user_id, ACTIVE if record.is_active else REVOKED, -1)
+        if record.current_uses >= record.max_uses:
+            counters.add(user_id, EXHAUSTED, -1)
+        if record.expires_at < self._expired_watermark:
+            counters.add(user_id, EXPIRED, -1)
+        counters.add(user_id, USES, -record.current_uses)
+        # TOTAL al final: al llegar a 0 se elimina la entrada del usuario
+        counters.add(user_id, TOTAL, -1)
+
+
+# Sentencias SQL constantes: sqlite3 las prepara una vez y las reutiliza
+# desde su caché de sentencias por conexión
+# AUTOINCREMENT: sin él SQLite reutiliza el id más alto tras borrarlo y el seq
+# (cursor de paginación) dejaría de ser creciente
+_SCHEMA_TABLE = """
+CREATE TABLE IF NOT EXISTS {table} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    key TEXT NOT NULL,
+    user_id TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    expires_at REAL NOT NULL,
+    max_uses INTEGER NOT NULL,
+    current_uses INTEGER NOT NULL DEFAULT 0,
+    is_active INTEGER NOT NULL DEFAULT 1
+)
+"""
+# Columnas añadidas después de la primera versión del esquema
+_SCHEMA_COLUMNS = {
+    "exhausted_at": "REAL",
+    "rate_limit": "INTEGER NOT NULL DEFAULT 0",
+    "rate_limit_window": "REAL NOT NULL DEFAULT 0",
+    "tat": "REAL NOT NULL DEFAULT 0",
+}
+_TABLE_COLUMNS = (
+    "id, key, user_id, created_at, expires_at, max_uses, current_uses, is_active, "
+    + ", ".join(_SCHEMA_COLUMNS)
+)
+_SCHEMA_INDEXES = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_keys_key ON keys (key);
+CREATE INDEX IF NOT EXISTS idx_keys_expires_at ON keys (expires_at);
+CREATE INDEX IF NOT EXISTS idx_keys_exhausted_at ON keys (exhausted_at) WHERE exhausted_at IS NOT NULL;
+CREATE INDEX IF NOT EXISTS idx_keys_user_id ON keys (user_id, expires_at);
+"""
+# Contadores de estado (scope "" = global, "user:<id>" = por usuario) y eventos por hora.
+# expired_keys no se guarda: se cuenta con el índice de expires_at
+_SCHEMA_COUNTERS = """
+CREATE TABLE IF NOT EXISTS counters (
+    scope TEXT NOT NULL,
+    field TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (scope, field)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hourly (
+    hour INTEGER NOT NULL,
+    field TEXT NOT NULL,
+    value INTEGER NOT NULL,
+    PRIMARY KEY (hour, field)
+) WITHOUT ROWID;
+"""
+_USER_SCOPE = "user:"
+_COLUMNS = (
+    "key, user_id, created_at, expires_at, max_uses, current_uses, is_active, id, "
+    "rate_limit, rate_limit_window, tat"
+)
+_SQL_INSERT = (
+    "INSERT INTO keys (key, user_id, created_at, expires_at, max_uses, rate_limit, rate_limit_window) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?)"
+)
+_SQL_SELECT = f"SELECT {_COLUMNS} FROM keys WHERE key = ?"
+# La cuota (GCRA, ver gcra()) se comprueba y actualiza en el mismo UPDATE atómico
+_SQL_CONSUME = (
+    "UPDATE keys SET current_uses = current_uses + 1, "
+    "exhausted_at = CASE WHEN current_uses + 1 >= max_uses THEN :now ELSE exhausted_at END, "
+    "tat = CASE WHEN rate_limit > 0 THEN MAX(tat, :now) + rate_limit_window / rate_limit ELSE tat END "
+    "WHERE key = :key AND is_active = 1 AND expires_at >= :now AND current_uses < max_uses "
+    "AND (rate_limit = 0 OR MAX(tat, :now) - :now <= "
+    f"rate_limit_window - rate_limit_window / rate_limit + {_QUOTA_EPSILON})"
+)
+_SQL_REVOKE = "UPDATE keys SET is_active = 0 WHERE key = ? AND is_active = 1"
+_SQL_SELECT_USER = "SELECT user_id FROM keys WHERE key = ?"
+_SQL_COUNTER_ADD = (
+    "INSERT INTO counters (scope, field, value) VALUES (?, ?, ?) "
+    "ON CONFLICT (scope, field) DO UPDATE SET value = value + excluded.value"
+)
+_SQL_HOURLY_ADD = (
+    "INSERT INTO hourly (hour, field, value) VALUES (?, ?, ?) "
+    "ON CONFLICT (hour, field) DO UPDATE SET value = value + excluded.value"
+)
+_SQL_SELECT_USER_KEYS = f"SELECT {_COLUMNS} FROM keys WHERE user_id = ? ORDER BY id"
+_SQL_REVOKE_USER = "UPDATE keys SET is_active = 0 WHERE user_id = ? AND is_active = 1"
+_SQL_COUNTERS = "SELECT field, value FROM counters WHERE scope = ?"
+_SQL_USER_COUNTERS = "SELECT scope, field, value FROM counters WHERE scope > ? AND scope < ?"
+_SQL_HOURLY = "SELECT hour, field, value FROM hourly WHERE hour > ? ORDER BY hour"
+_SQL_HOURLY_PRUNE = "DELETE FROM hourly WHERE hour <= ?"
+_SQL_COUNT_EXPIRED = "SELECT COUNT(*) FROM keys WHERE expires_at < ?"
+_SQL_COUNT_USER_EXPIRED = "SELECT COUNT(*) FROM keys WHERE user_id = ? AND expires_at < ?"
+_SQL_COUNT_EXPIRED_BY_USER = "SELECT user_id, COUNT(*) FROM keys WHERE expires_at < ? GROUP BY user_id"
+_SQL_COUNTS_BY_USER = (
+    "SELECT user_id, COUNT(*), SUM(is_active), SUM(1 - is_active), "
+    "SUM(current_uses >= max_uses), SUM(current_uses) FROM keys GROUP BY user_id"
+)
+_EVICT_COLUMNS = "id, key, user_id, is_active, current_uses >= max_uses, current_uses"
+_SQL_EVICT_EXHAUSTED = (
+    f"SELECT {_EVICT_COLUMNS} FROM keys "
+    "WHERE exhausted_at IS NOT NULL AND exhausted_at <= ? ORDER BY exhausted_at LIMIT ?"
+)
+_SQL_EVICT_EXPIRED = (
+    f"SELECT {_EVICT_COLUMNS} FROM keys WHERE expires_at <= ? ORDER BY expires_at LIMIT ?"
+)
+_SQL_DELETE = "DELETE FROM keys WHERE id = ?"
+
+# Contadores de estado guardados en la tabla counters
+_STORED_FIELDS = tuple(f for i, f in enumerate(STATE_FIELDS) if i != EXPIRED)
+
+
+def _row_to_record(row) -> KeyRecord:
+    """Convierte una fila de SQLite en un KeyRecord"""
+    return KeyRecord(row[0], row[1], row[2], row[3], row[4], row[5], bool(row[6]), row[7], row[8], row[9], row[10])
+
+
+class SQLiteKeyStore(KeyStore):
+    """Almacenamiento persistente en SQLite (modo WAL), compartido entre procesos del mismo host.
+
+    Los contadores de estadísticas se guardan en la propia base de datos y se
+    actualizan en la misma transacción que cada cambio, así que son
+    consistentes entre procesos.
+
+    Las consultas se ejecutan en el hilo que las llama (el bucle de eventos):
+    mientras otro proceso escribe, se espera como mucho `busy_timeout`
+    milisegundos para empezar una escritura y después se lanza StoreBusy.
+    En modo WAL las lecturas no esperan a las escrituras.
+    """
+
+    def __init__(self, path: str, hourly_window: int = 48, busy_timeout: int = 100):
+        # Importado aquí: con el backend en memoria no se carga sqlite3 al arrancar
+        import sqlite3
+
+        self._lock = threading.Lock()
+        self._hourly_window = hourly_window
+        self._busy_error = sqlite3.OperationalError
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA busy_timeout={int(busy_timeout)}")
+        self._conn.execute(_SCHEMA_TABLE.format(table="keys"))
+        self._migrate()
+        self._conn.executescript(_SCHEMA_INDEXES)
+        self._conn.executescript(_SCHEMA_COUNTERS)
+        self._rebuild_counters()
+
+    def _migrate(self):
+        """Añade las columnas que falten en bases de datos creadas con versiones anteriores"""
+        existing = {row[1] for row in self._conn.execute("PRAGMA table_info(keys)")}
+        for column, definition in _SCHEMA_COLUMNS.items():
+            if column not in existing:
+                self._conn.execute(f"ALTER TABLE keys ADD COLUMN {column} {definition}")
+
+        # Tablas creadas sin AUTOINCREMENT: se reconstruyen una vez conservando los ids
+        # (los índices se vuelven a crear después con _SCHEMA_INDEXES)
+        if not self._autoincrement():
+            with self._transaction() as conn:
+                if self._autoincrement():
+                    return
+                conn.execute(_SCHEMA_TABLE.format(table="keys_autoincrement"))
+                for column, definition in _SCHEMA_COLUMNS.items():
+                    conn.execute(f"ALTER TABLE keys_autoincrement ADD COLUMN {column} {definition}")
+                conn.execute(
+                    f"INSERT INTO keys_autoincrement ({_TABLE_COLUMNS}) SELECT {_TABLE_COLUMNS} FROM keys"
+                )
+                conn.execute("DROP TABLE keys")
+                conn.execute("ALTER TABLE keys_autoincrement RENAME TO keys")
+
+    def _autoincrement(self) -> bool:
+        """Si la tabla de keys declara su id con AUTOINCREMENT"""
+        row = self._conn.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'keys'").fetchone()
+        return "AUTOINCREMENT" in row[0].upper()
+
+    @contextmanager
+    def _transaction(self):
+        """Transacción de escritura (BEGIN IMMEDIATE) protegida por el lock del proceso"""
+        with self._lock:
+            try:
+                self._conn.execute("BEGIN IMMEDIATE")
+            except self._busy_error as exc:
+                raise StoreBusy(str(exc)) from exc
+            try:
+                yield self._conn
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._conn.execute("COMMIT")
+
+    def _rebuild_counters(self):
+        """Inicializa los contadores en bases de datos creadas antes de existir la tabla"""
+        with self._transaction() as conn:
+            if conn.execute("SELECT 1 FROM counters LIMIT 1").fetchone() is not None:
+                return
+            totals = [0] * len(_STORED_FIELDS)
+            for user_id, *values in conn.execute(_SQL_COUNTS_BY_USER).fetchall():
+                for field, value in zip(_STORED_FIELDS, values):
+                    conn.execute(_SQL_COUNTER_ADD, (_USER_SCOPE + user_id, field, value))
+                totals = [t + v for t, v in zip(totals, values)]
+            for field, value in zip(_STORED_FIELDS, totals):
+                conn.execute(_SQL_COUNTER_ADD, ("", field, value))
+
+    def _count(self, user_id: str, field: int, delta: int = 1):
+        """Suma `delta` a un contador global y del usuario (dentro de una transacción)"""
+        name = STATE_FIELDS[field]
+        self._conn.execute(_SQL_COUNTER_ADD, ("", name, delta))
+        self._conn.execute(_SQL_COUNTER_ADD, (_USER_SCOPE + user_id, name, delta))
+
+    def _event(self, now: float, field: int, count: int = 1):
+        """Cuenta eventos en la hora actual (dentro de una transacción)"""
+        self._conn.execute(_SQL_HOURLY_ADD, (hour_of(now), HOURLY_FIELDS[field], count))
+
+    def create(self, key, user_id, created_at, expires_at, max_uses, rate_limit=0, rate_limit_window=0.0):
+        return self.create_many([key], user_id, created_at, expires_at, max_uses, rate_limit, rate_limit_window)[0]
+
+    def create_many(self, keys, user_id, created_at, expires_at, max_uses, rate_limit=0, rate_limit_window=0.0):
+        records = []
+        params = (user_id, created_at, expires_at, max_uses, rate_limit, rate_limit_window)
+        with self._transaction() as conn:
+            for key in keys:
+                seq = conn.execute(_SQL_INSERT, (key, *params)).lastrowid
+                records.append(KeyRecord(
+                    key, user_id, created_at, expires_at, max_uses, seq=seq,
+                    rate_limit=rate_limit, rate_limit_window=rate_limit_window
+                ))
+            self._count(user_id, TOTAL, len(keys))
+            self._count(user_id, ACTIVE, len(keys))
+            self._event(created_at, GENERATED, len(keys))
+        return records
+
+    def _consume(self, key: str, now: float):
+        """Consume un uso dentro de una transacción ya abierta"""
+        # El UPDATE condicional es atómico: nunca se supera max_uses
+        updated = self._conn.execute(_SQL_CONSUME, {"now": now, "key": key}).rowcount
+        row = self._conn.execute(_SQL_SELECT, (key,)).fetchone()
+        if row is None:
+            return STATUS_INVALID, None
+        if updated:
+            record = _row_to_record(row)
+            self._count(record.user_id, USES)
+            self._event(now, HOURLY_USES)
+            if record.current_uses >= record.max_uses:
+                self._count(record.user_id, EXHAUSTED)
+            return STATUS_VALID, record
+
+        # El UPDATE no aplicó: determinar el motivo
+        if not row[6]:
+            return STATUS_REVOKED, None
+        if now > row[3]:
+            return STATUS_EXPIRED, None
+        if row[5] >= row[4]:
+            return STATUS_EXHAUSTED, None
+        return STATUS_RATE_LIMITED, None
+
+    def consume(self, key, now):
+        return self.consume_many([key], now)[0]
+
+    def consume_many(self, keys, now):
+        with self._transaction():
+            return [self._consume(key, now) for key in keys]
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(_SQL_SELECT, (key,)).fetchone()
+        return _row_to_record(row) if row is not None else None
+
+    def list(self):
+        # Por bloques, sin cargar toda la tabla en memoria
+        key_filter = KeyFilter()
+        after = 0
+        while after is not None:
+            records, after = self.page(after, 1000, key_filter, 0.0)
+            yield from records
+
+    def page(self, after, limit, key_filter, now):
+        conditions, params = key_filter.sql(now)
+        where = f"id > ? AND {conditions}" if conditions else "id > ?"
+        # Se pide un registro extra para saber si hay más páginas
+        sql = f"SELECT {_COLUMNS} FROM keys WHERE {where} ORDER BY id LIMIT ?"
+        with self._lock:
+            rows = self._conn.execute(sql, [after, *params, limit + 1]).fetchall()
+        records = [_row_to_record(row) for row in rows[:limit]]
+        return records, records[-1].seq if len(rows) > limit else None
+
+    def revoke(self, key, now):
+        with self._transaction() as conn:
+            row = conn.execute(_SQL_SELECT_USER, (key,)).fetchone()
+            if row is None:
+                return False
+            if conn.execute(_SQL_REVOKE, (key,)).rowcount:
+                self._count(row[0], ACTIVE, -1)
+                self._count(row[0], REVOKED)
+                self._event(now, HOURLY_REVOKED)
+            return True
+
+    def user_keys(self, user_id):
+        with self._lock:
+            rows = self._conn.execute(_SQL_SELECT_USER_KEYS, (user_id,)).fetchall()
+        return [_row_to_record(row) for row in rows]
+
+    def revoke_user(self, user_id, now):
+        with self._transaction() as conn:
+            revoked = conn.execute(_SQL_REVOKE_USER, (user_id,)).rowcount
+            if revoked:
+                self._count(user_id, ACTIVE, -revoked)
+                self._count(user_id, REVOKED, revoked)
+                self._event(now, HOURLY_REVOKED, revoked)
+        return revoked
+
+    def _counters(self, scope: str) -> List[int]:
+        """Lee los contadores guardados de un scope"""
+        stored = dict(self._conn.execute(_SQL_COUNTERS, (scope,)).fetchall())
+        return [stored.get(field, 0) for field in STATE_FIELDS]
+
+    def stats(self, now):
+        with self._lock:
+            values = self._counters("")
+            values[EXPIRED] = self._conn.execute(_SQL_COUNT_EXPIRED, (now,)).fetchone()[0]
+            since = hour_of(now) - self._hourly_window * 3600
+            hourly = {}
+            for hour, field, value in self._conn.execute(_SQL_HOURLY, (since,)):
+                hourly.setdefault(hour, {"hour": hour, **dict.fromkeys(HOURLY_FIELDS, 0)})[field] = value
+        stats = state_dict(values)
+        stats["hourly"] = list(hourly.values())
+        return stats
+
+    def user_stats(self, user_id, now):
+        with self._lock:
+            values = self._counters(_USER_SCOPE + user_id)
+            if not values[TOTAL]:
+                return None
+            values[EXPIRED] = self._conn.execute(_SQL_COUNT_USER_EXPIRED, (user_id, now)).fetchone()[0]
+        return state_dict(values)
+
+    def users_stats(self, now):
+        users = {}
+        with self._lock:
+            # "user;" es el primer scope posterior a todos los "user:<id>"
+            rows = self._conn.execute(_SQL_USER_COUNTERS, (_USER_SCOPE, "user;")).fetchall()
+            expired = dict(self._conn.execute(_SQL_COUNT_EXPIRED_BY_USER, (now,)).fetchall())
+        for scope, field, value in rows:
+            users.setdefault(scope[len(_USER_SCOPE):], dict.fromkeys(STATE_FIELDS, 0))[field] = value
+        for user_id, values in users.items():
+            values["expired_keys"] = expired.get(user_id, 0)
+        return {user_id: values for user_id, values in users.items() if values["total_keys"]}
+
+    def evict(self, cutoff, limit):
+        with self._transaction() as conn:
+            exhausted = conn.execute(_SQL_EVICT_EXHAUSTED, (cutoff, limit)).fetchall()
+            expired = conn.execute(_SQL_EVICT_EXPIRED, (cutoff, limit - len(exhausted))).fetchall()
+            seen = set()
+            evicted = []
+            for row_id, key, user_id, is_active, is_exhausted, uses in exhausted + expired:
+                if row_id in seen:
+                    continue
+                seen.add(row_id)
+                evicted.append(key)
+                conn.execute(_SQL_DELETE, (row_id,))
+                self._count(user_id, ACTIVE if is_active else REVOKED, -1)
+                if is_exhausted:
+                    self._count(user_id, EXHAUSTED, -1)
+                if uses:
+                    self._count(user_id, USES, -uses)
+                self._count(user_id, TOTAL, -1)
+            # Eventos por hora fuera de la ventana
+            conn.execute(_SQL_HOURLY_PRUNE, (hour_of(cutoff) - self._hourly_window * 3600,))
+        if evicted and self.on_evict is not None:
+            self.on_evict(evicted)
+        return len(seen) - len(exhausted), len(exhausted)
+
+
+def create_key_store(backend: str, path: str, hourly_window: int = 48,
+                     capacity: int = 1000000, busy_timeout: int = 100) -> KeyStore:
+    """Crea el backend de almacenamiento configurado
+
+    `capacity` solo se usa con el backend "shared" (tabla de tamaño fijo) y
+    `busy_timeout` (ms) con "sqlite"
+    """
+    if backend == "memory":
+        return MemoryKeyStore(hourly_window)
+    if backend == "sqlite":
+        return SQLiteKeyStore(path, hourly_window, busy_timeout)
+    if backend == "shared":
+        # Importado aquí: fcntl y mmap solo se cargan con este backend
+        from sharedstore import SharedMemoryKeyStore
+        return SharedMemoryKeyStore(path, capacity, hourly_window)
+    if backend == "hashed":
+        from hashedstore import HashedKeyStore
+        return HashedKeyStore(hourly_window)
+    raise ValueError(f"Backend de almacenamiento desconocido: {backend}")
@@ -0,0 +1,69 @@
+"""
+🧹 Desalojo de keys expiradas y agotadas
+Tarea asyncio en segundo plano que elimina del almacenamiento las keys que
+expiraron o alcanzaron su límite de usos hace más de un periodo de gracia
+"""
+
+import asyncio
+import time
+
+from store import KeyStore, StoreBusy, to_iso
+
+
+class ExpirySweeper:
+    """Desaloja periódicamente keys usando el índice de expiración del almacenamiento"""
+
+    def __init__(self, store: KeyStore, interval: float, grace: float, batch_size: int):
+        self.store = store
+        self.interval = interval
+        self.grace = grace
+        self.batch_size = batch_size
+
+        # Métricas
+        self.sweeps = 0
+        self.evicted_expired = 0
+        self.evicted_exhausted = 0
+        self.last_sweep_at = None
+        self.last_sweep_duration = 0.0
+        self.lag = 0.0
+
+    def sweep(self, now: float) -> int:
+        """Ejecuta un lote de desalojo y devuelve el número de keys eliminadas"""
+        start = time.perf_counter()
+        expired, exhausted = self.store.evict(now - self.grace, self.batch_size)
+
+        self.sweeps += 1
+        self.evicted_expired += expired
+        self.evicted_exhausted += exhausted
+        self.last_sweep_at = now
+        self.last_sweep_duration = time.perf_counter() - start
+        return expired + exhausted
+
+    async def run(self):
+        """Bucle principal; se cancela al apagar la aplicación"""
+        loop = asyncio.get_running_loop()
+        while True:
+            scheduled = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            # Retraso del bucle de eventos respecto a la hora programada
+            self.lag = max(0.0, loop.time() - scheduled)
+
+            # Lotes acotados, cediendo el control entre lotes completos
+            try:
+                while self.sweep(time.time()) >= self.batch_size:
+                    await asyncio.sleep(0)
+            except StoreBusy:
+                # Otro proceso está escribiendo: se reintenta en el siguiente barrido
+                pass
+
+    def metrics(self) -> dict:
+        """Métricas del desalojo para el endpoint de estadísticas"""
+        return {
+            "sweeps": self.sweeps,
+            "evicted_expired": self.evicted_expired,
+            "evicted_exhausted": self.evicted_exhausted,
+            "last_sweep_at": to_iso(self.last_sweep_at) if self.last_sweep_at else None,
+            "last_sweep_duration_seconds": self.last_sweep_duration,
+            "lag_seconds": self.lag,
+            "grace_seconds": self.grace,
+        }
@@ -0,0 +1,68 @@
+"""
+🧪 Pruebas del registro de auditoría
+La tarea de escritura sigue funcionando tras eventos no codificables en UTF-8
+y tras lotes que fallan al escribirse en disco.
+
+Uso: python -m pytest test_audit.py
+"""
+
+import asyncio
+import json
+import os
+import shutil
+
+from audit import AuditLog, query
+
+START = 1_700_000_000.0
+
+
+async def wait_for(condition, timeout: float = 5.0):
+    """Espera a que `condition()` se cumpla mientras la tarea de escritura avanza"""
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while not condition():
+        assert loop.time() < deadline, "la tarea de auditoría no avanzó"
+        await asyncio.sleep(0.01)
+
+
+def test_writer_survives_bad_events_and_write_errors(tmp_path):
+    directory = str(tmp_path / "audit")
+    log = AuditLog(directory, segment_bytes=1 << 20, flush_interval=0.01, batch_size=10, queue_size=100)
+
+    async def scenario():
+        task = asyncio.create_task(log.run())
+
+        # user_id con un surrogate suelto (llega así desde un JSON válido)
+        log.record("generate", START, user_id="\ud800", key="a" * 16, count=1)
+        await wait_for(lambda: log.written == 1)
+
+        # Sin directorio la escritura falla (OSError): el lote se pierde y se cuenta
+        shutil.rmtree(directory)
+        log.record("revoke", START + 1, user_id="u", key="b" * 16, count=1)
+        await wait_for(lambda: log.failed == 1)
+        assert not task.done()
+
+        # Los eventos posteriores se siguen escribiendo
+        os.makedirs(directory)
+        log.record("revoke", START + 2, user_id="u", key="c" * 16, count=1)
+        await wait_for(lambda: log.written == 2)
+
+        log.close()
+        await task
+
+    asyncio.run(scenario())
+
+    events = [json.loads(line) for line in query(directory, START, START + 10)]
+    assert [(event["event"], event["key"]) for event in events] == [("revoke", "c" * 16)]
+    assert log.metrics()["failed"] == 1
+
+
+def test_surrogate_user_id_round_trips(tmp_path):
+    directory = str(tmp_path / "audit")
+    log = AuditLog(directory, segment_bytes=1 << 20, flush_interval=0.01, batch_size=10, queue_size=100)
+    log.record("generate", START, user_id="usuario-\udcff-ñ", key="a" * 16, count=1)
+
+    asyncio.run(log._flush())
+
+    [line] = query(directory, START, START + 1)
+    assert json.loads(line)["user_id"] == "usuario-\udcff-ñ"
@@ -0,0 +1,433 @@
+"""
+🧪 Pruebas de los endpoints de la API
+El recorrido de test_api.py (generar, validar, consultar y revocar) y las
+funciones opcionales (keys firmadas, caché negativa, límite de peticiones,
+auditoría, Idempotency-Key, métricas, perfilado y WebSocket) sin servidor: la
+aplicación se ejecuta en el proceso con TestClient. Cada prueba vuelve a
+importar main.py con su propia configuración.
+
+Uso: python -m pytest test_endpoints.py
+"""
+
+import csv
+import glob
+import importlib
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+ADMIN = {"Authorization": "Bearer admin_token_123"}
+
+
+def load_main(monkeypatch, **env):
+    """Importa main.py de nuevo con la configuración de `env` (config.py la lee al importarse)"""
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    for module in ("config", "main"):
+        sys.modules.pop(module, None)
+    return importlib.import_module("main")
+
+
+def make_client(monkeypatch, **env):
+    main = load_main(monkeypatch, **env)
+    return TestClient(main.app), main
+
+
+def generate(client, user_id="ana", **fields):
+    response = client.post("/generate-key", json={"user_id": user_id, **fields}, headers=ADMIN)
+    assert response.status_code == 200, response.text
+    return response.json()["data"]["key"]
+
+
+def validate(client, key):
+    return client.post("/validate-key", json={"key": key}).json()
+
+
+def test_key_lifecycle(monkeypatch):
+    client, _ = make_client(monkeypatch)
+    assert client.get("/").json()["status"] == "running"
+    assert client.get("/health").json()["status"] == "healthy"
+    assert client.post("/generate-key", json={"user_id": "ana"}).status_code == 403
+    assert client.post("/generate-key", json={"user_id": "ana"}, headers={"Authorization": "Bearer otro"}).status_code == 403
+
+    key = generate(client, max_uses=2)
+    first = validate(client, key)
+    assert (first["success"], first["data"]["remaining_uses"]) == (True, 1)
+    assert validate(client, key)["data"]["remaining_uses"] == 0
+    assert validate(client, key)["message"] == "Key ha alcanzado el límite de usos"
+    assert validate(client, "no-existe")["message"] == "Key inválida"
+
+    other = generate(client)
+    assert client.delete(f"/revoke-key/{other}", headers=ADMIN).json()["data"] == {"key": other}
+    assert validate(client, other)["message"] == "Key revocada"
+    assert client.delete("/revoke-key/no-existe", headers=ADMIN).status_code == 404
+
+
+@pytest.mark.parametrize("fast", ["false", "true"])
+def test_batch_validation(monkeypatch, fast):
+    client, main = make_client(monkeypatch, FAST_RESPONSES=fast)
+    once = generate(client, max_uses=1)
+    revoked = generate(client)
+    client.delete(f"/revoke-key/{revoked}", headers=ADMIN)
+    expired = generate(client, duration_hours=0)
+
+    response = client.post("/validate-keys", json={"keys": [once, "no-existe", revoked, once, expired]})
+    data = response.json()["data"]
+    assert (data["total"], data["valid"], data["invalid"]) == (5, 1, 4)
+    assert [result["message"] for result in data["results"]] == [
+        "Key válida", "Key inválida", "Key revocada", "Key ha alcanzado el límite de usos", "Key expirada"
+    ]
+    assert data["results"][0]["data"]["remaining_uses"] == 0
+
+    too_many = ["x"] * (main.MAX_BATCH_SIZE + 1)
+    assert client.post("/validate-keys", json={"keys": too_many}).status_code == 413
+
+
+def test_key_info_formats_epoch_times(monkeypatch):
+    client, _ = make_client(monkeypatch)
+    key = generate(client, duration_hours=48, max_uses=3)
+    validate(client, key)
+
+    info = client.get(f"/key-info/{key}").json()
+    created_at = datetime.fromisoformat(info["created_at"])
+    expires_at = datetime.fromisoformat(info["expires_at"])
+    assert abs(expires_at - created_at - timedelta(hours=48)) <= timedelta(microseconds=1)
+    assert (info["user_id"], info["max_uses"], info["current_uses"], info["is_active"]) == ("ana", 3, 1, True)
+    assert client.get("/keys", headers=ADMIN).json()["items"] == [info]
+    assert client.get("/key-info/no-existe").status_code == 404
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite", "shared"])
+def test_stats_counters(monkeypatch, tmp_path, backend):
+    client, _ = make_client(
+        monkeypatch, KEY_STORE=backend, KEY_STORE_PATH=str(tmp_path / "keys"), SHARED_STORE_CAPACITY="100"
+    )
+    used = generate(client, max_uses=1)
+    revoked = generate(client)
+    generate(client, user_id="bea", max_uses=5)
+    validate(client, used)
+    client.delete(f"/revoke-key/{revoked}", headers=ADMIN)
+
+    assert client.get("/stats").status_code == 403
+    stats = client.get("/stats", params={"user_id": "ana", "by_user": True, "exact": True}, headers=ADMIN).json()
+    expected = {
+        "total_keys": 3, "active_keys": 2, "revoked_keys": 1,
+        "expired_keys": 0, "exhausted_keys": 1, "uses_consumed": 1,
+    }
+    assert {field: stats[field] for field in expected} == expected
+    assert stats["user"] == {**expected, "total_keys": 2, "active_keys": 1}
+    assert stats["users"]["bea"]["active_keys"] == 1
+    assert stats["exact"] == expected
+    assert set(stats["drift"].values()) == {0}
+    assert stats["hourly"][-1]["generated"] == 3
+
+
+@pytest.mark.parametrize("format", ["json", "ndjson", "csv"])
+def test_generate_keys(monkeypatch, format):
+    client, _ = make_client(monkeypatch, MAX_GENERATE_COUNT="50")
+    body = {"user_id": "ana", "count": 50, "max_uses": 2}
+    response = client.post("/generate-keys", params={"format": format}, json=body, headers=ADMIN)
+    assert response.status_code == 200
+
+    if format == "json":
+        data = response.json()["data"]
+        assert (data["count"], data["user_id"], data["max_uses"]) == (50, "ana", 2)
+        keys = data["keys"]
+    elif format == "ndjson":
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        assert {(row["user_id"], row["max_uses"]) for row in rows} == {("ana", 2)}
+        keys = [row["key"] for row in rows]
+    else:
+        rows = list(csv.DictReader(response.text.splitlines()))
+        assert {(row["user_id"], row["max_uses"]) for row in rows} == {("ana", "2")}
+        keys = [row["key"] for row in rows]
+
+    assert len(set(keys)) == 50
+    assert validate(client, keys[-1])["data"]["remaining_uses"] == 1
+    assert client.get("/stats", headers=ADMIN).json()["total_keys"] == 50
+    assert client.post("/generate-keys", json={**body, "count": 51}, headers=ADMIN).status_code == 413
+    assert client.post("/generate-keys", json=body).status_code == 403
+
+
+def test_signed_keys(monkeypatch):
+    client, main = make_client(monkeypatch, KEY_FORMAT="signed", SECRET_KEY="secreto-de-prueba")
+    key = generate(client, max_uses=2)
+    assert key.startswith("k1.")
+    assert validate(client, key)["data"]["remaining_uses"] == 1
+
+    # Payload alterado: la firma ya no coincide
+    payload = key[3:]
+    tampered = "k1." + ("B" if payload[0] == "A" else "A") + payload[1:]
+    assert validate(client, tampered)["message"] == "Key inválida"
+    assert client.get(f"/key-info/{tampered}").status_code == 404
+    # Bien firmada pero nunca almacenada
+    unknown = main.key_signer.sign("0" * main.KEY_ID_LENGTH, "ana", 2 ** 40, 1)
+    assert validate(client, unknown)["message"] == "Key inválida"
+
+    expired = generate(client, duration_hours=0)
+    assert validate(client, expired)["message"] == "Key expirada"
+    assert client.post("/generate-key", json={"user_id": "ana", "max_uses": -1}, headers=ADMIN).status_code == 422
+
+
+def test_negative_cache(monkeypatch, tmp_path):
+    path = str(tmp_path / "keys.db")
+    client, _ = make_client(monkeypatch, KEY_STORE="sqlite", KEY_STORE_PATH=path)
+    stored = generate(client)
+    assert "negative_cache" not in client.get("/stats", headers=ADMIN).json()
+
+    # Con NEGATIVE_CACHE=on el filtro se construye con las keys ya almacenadas al arrancar
+    _, main = make_client(monkeypatch, KEY_STORE="sqlite", KEY_STORE_PATH=path, NEGATIVE_CACHE="on")
+    with TestClient(main.app) as client:
+        batch = client.post("/generate-keys", json={"user_id": "bea", "count": 3}, headers=ADMIN).json()["data"]["keys"]
+        assert validate(client, stored)["success"] is True
+        assert validate(client, generate(client))["success"] is True
+        assert validate(client, batch[0])["success"] is True
+        assert validate(client, "no-existe")["message"] == "Key inválida"
+        metrics = client.get("/stats", headers=ADMIN).json()["negative_cache"]
+
+    assert (metrics["ready"], metrics["rebuilds"], metrics["keys"]) == (True, 1, 5)
+    assert (metrics["checks"], metrics["rejected"]) == (4, 1)
+
+
+def test_rate_limit(monkeypatch):
+    client, _ = make_client(monkeypatch, RATE_LIMITS="/validate-key=0.01/2", RATE_LIMIT_TRUST_FORWARDED="true")
+
+    def post(client_ip):
+        return client.post("/validate-key", json={"key": "no-existe"}, headers={"X-Forwarded-For": client_ip})
+
+    responses = [post("10.0.0.1") for _ in range(3)]
+    assert [response.status_code for response in responses] == [200, 200, 429]
+    assert responses[2].json() == {"detail": "Demasiadas peticiones"}
+    assert int(responses[2].headers["retry-after"]) > 0
+    # Cada cliente tiene su bucket y las rutas sin límite no lo consumen
+    assert post("10.0.0.2").status_code == 200
+    assert client.post("/validate-keys", json={"keys": ["no-existe"]}).status_code == 200
+
+    metrics = client.get("/stats", headers=ADMIN).json()["rate_limit"]
+    assert (metrics["allowed"], metrics["rejected"], metrics["tracked_clients"]) == (3, 1, 2)
+    assert 'route="/validate-key",method="POST",status="429"} 1' in client.get("/metrics").text
+
+
+def test_metrics(monkeypatch):
+    client, _ = make_client(monkeypatch)
+    key = generate(client, max_uses=1)
+    client.post("/generate-keys", json={"user_id": "bea", "count": 3}, headers=ADMIN)
+    validate(client, key)
+    validate(client, key)
+    client.post("/validate-keys", json={"keys": ["no-existe", key]})
+    client.get(f"/key-info/{key}")
+    client.get("/key-info/no-existe")
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    samples = dict(line.rsplit(" ", 1) for line in response.text.splitlines() if not line.startswith("#"))
+
+    # Las rutas se etiquetan con su plantilla, no con la key pedida
+    assert samples['apikey_http_requests_total{route="/key-info/{key}",method="GET",status="200"}'] == "1"
+    assert samples['apikey_http_requests_total{route="/key-info/{key}",method="GET",status="404"}'] == "1"
+    assert samples['apikey_http_requests_total{route="/validate-key",method="POST",status="200"}'] == "2"
+    assert samples['apikey_http_request_duration_seconds_count{route="/validate-key",method="POST"}'] == "2"
+    assert samples['apikey_http_request_duration_seconds_bucket{route="/validate-key",method="POST",le="+Inf"}'] == "2"
+    assert key not in response.text
+
+    assert samples['apikey_validations_total{outcome="valid"}'] == "1"
+    assert samples['apikey_validations_total{outcome="exhausted"}'] == "2"
+    assert samples['apikey_validations_total{outcome="invalid"}'] == "1"
+    assert samples["apikey_keys_generated_total"] == "4"
+    assert (samples['apikey_keys{state="total"}'], samples['apikey_keys{state="exhausted"}']) == ("4", "1")
+
+
+def test_audit_log(monkeypatch, tmp_path):
+    from audit import key_fingerprint, query
+
+    directory = str(tmp_path / "audit")
+    _, main = make_client(monkeypatch, AUDIT_LOG_DIR=directory, AUDIT_FLUSH_SECONDS="0.01")
+    start = time.time()
+    with TestClient(main.app) as client:
+        key = generate(client, max_uses=1)
+        other = generate(client)
+        validate(client, key)
+        client.post("/validate-keys", json={"keys": [key, "no-existe"]})
+        client.delete(f"/revoke-key/{other}", headers=ADMIN)
+        client.post("/generate-keys", json={"user_id": "bea", "count": 2}, headers=ADMIN)
+        client.delete("/users/bea/keys", headers=ADMIN)
+    # Al apagar se escriben los eventos pendientes
+
+    events = [json.loads(line) for line in query(directory, start, time.time() + 1)]
+    assert [(event["event"], event.get("outcome"), event.get("count")) for event in events] == [
+        ("generate", None, 1), ("generate", None, 1), ("validate", "valid", None),
+        ("validate", "exhausted", None), ("validate", "invalid", None),
+        ("revoke", None, 1), ("generate", None, 2), ("revoke", None, 2),
+    ]
+    assert events[0]["actor"] == key_fingerprint("admin_token_123")
+    assert events[2]["user_id"] == "ana"
+    # Las keys y los tokens solo aparecen como huella
+    contents = "".join(open(path).read() for path in glob.glob(f"{directory}/*.jsonl"))
+    assert key not in contents and "admin_token_123" not in contents
+    by_key = query(directory, start, time.time() + 1, fingerprint=key_fingerprint(key))
+    assert [json.loads(line)["event"] for line in by_key] == ["generate", "validate", "validate"]
+    assert main.audit_log.metrics()["written"] == 8
+
+
+def test_idempotency_key(monkeypatch):
+    client, _ = make_client(monkeypatch)
+
+    def post(path, body, idempotency_key, token="admin_token_123", **params):
+        headers = {"Authorization": f"Bearer {token}", "Idempotency-Key": idempotency_key}
+        return client.post(path, json=body, headers=headers, params=params)
+
+    first = post("/generate-key", {"user_id": "ana"}, "a")
+    replay = post("/generate-key", {"user_id": "ana"}, "a")
+    assert "idempotent-replayed" not in first.headers
+    assert replay.headers["idempotent-replayed"] == "true"
+    assert replay.json()["data"] == first.json()["data"]
+    assert post("/generate-key", {"user_id": "bea"}, "a").status_code == 422
+    # Cada token de administrador tiene sus propias Idempotency-Key
+    other = post("/generate-key", {"user_id": "ana"}, "a", token="super_admin_456")
+    assert other.json()["data"]["key"] != first.json()["data"]["key"]
+    assert post("/generate-key", {"user_id": "ana"}, "").status_code == 400
+
+    body = {"user_id": "ana", "count": 3}
+    keys = post("/generate-keys", body, "b").json()["data"]["keys"]
+    rows = post("/generate-keys", body, "c", format="csv").text
+    csv_replay = post("/generate-keys", body, "c", format="csv")
+    assert (csv_replay.text, csv_replay.headers["idempotent-replayed"]) == (rows, "true")
+    assert post("/generate-keys", body, "b").json()["data"]["keys"] == keys
+    assert post("/generate-keys", body, "b", format="csv").status_code == 422
+
+    stats = client.get("/stats", headers=ADMIN).json()
+    assert stats["total_keys"] == 8
+    assert (stats["idempotency"]["replayed"], stats["idempotency"]["conflicts"]) == (3, 2)
+
+
+def test_hashed_store(monkeypatch):
+    from hashedstore import KEY_ID_PREFIX, key_digest
+
+    client, _ = make_client(monkeypatch, KEY_STORE="hashed")
+    key = generate(client, max_uses=2)
+    other = generate(client)
+    key_id = KEY_ID_PREFIX + key_digest(key).hex()
+
+    assert validate(client, key)["data"]["remaining_uses"] == 1
+    # Los listados solo muestran el identificador, que no sirve para validar
+    info = client.get(f"/key-info/{key}").json()
+    assert (info["key"], info["current_uses"]) == (key_id, 1)
+    listed = [item["key"] for item in client.get("/keys", headers=ADMIN).json()["items"]]
+    assert key_id in listed and key not in listed
+    assert [item["key"] for item in client.get("/users/ana/keys", headers=ADMIN).json()] == listed
+    assert validate(client, key_id)["message"] == "Key inválida"
+
+    assert client.delete(f"/revoke-key/{key_id}", headers=ADMIN).status_code == 200
+    assert validate(client, key)["message"] == "Key revocada"
+    assert client.delete(f"/revoke-key/{other}", headers=ADMIN).status_code == 200
+
+    # La caché de Idempotency-Key (keys en claro) está desactivada por defecto
+    headers = {**ADMIN, "Idempotency-Key": "a"}
+    responses = [client.post("/generate-key", json={"user_id": "ana"}, headers=headers) for _ in range(2)]
+    assert responses[0].json()["data"]["key"] != responses[1].json()["data"]["key"]
+    assert "idempotency" not in client.get("/stats", headers=ADMIN).json()
+
+    with pytest.raises(ValueError):
+        load_main(monkeypatch, KEY_STORE="hashed", CHANGE_FEED_SIZE="100")
+
+
+def test_profiler(monkeypatch):
+    client, _ = make_client(monkeypatch)
+    assert client.get("/debug/profile", headers=ADMIN).status_code == 404
+
+    from profiler import sign_debug_header
+
+    client, _ = make_client(monkeypatch, PROFILING="true", PROFILE_INTERVAL_SECONDS="0")
+    assert client.get("/debug/profile").status_code == 403
+
+    def validate_profiled(path, token="admin_token_123"):
+        header = sign_debug_header(token, path, time.time())
+        return client.post("/validate-key", json={"key": "no-existe"}, headers={"X-Debug-Profile": header})
+
+    validate(client, "no-existe")
+    assert validate_profiled("/validate-key").status_code == 200
+    # Firmada para otra ruta o con un token que no es de administrador: no se perfila
+    validate_profiled("/validate-keys")
+    validate_profiled("/validate-key", token="otro")
+
+    lines = client.get("/debug/profile", params={"route": "/validate-key"}, headers=ADMIN).text.splitlines()
+    stacks = dict(line.rsplit(" ", 1) for line in lines)
+    assert stacks and all(stack.split(";")[0] == "POST /validate-key" for stack in stacks)
+    assert all(int(micros) > 0 for micros in stacks.values())
+    assert any("main.py:validate_key_endpoint" in stack for stack in stacks)
+    assert client.get("/debug/profile", params={"route": "/keys"}, headers=ADMIN).text == ""
+
+    metrics = client.get("/stats", headers=ADMIN).json()["profiler"]
+    assert (metrics["signed_requests"], metrics["invalid_signatures"], metrics["in_flight"]) == (1, 2, 0)
+    assert metrics["routes"]["POST /validate-key"]["requests"] == 1
+
+    assert client.delete("/debug/profile", headers=ADMIN).json()["success"] is True
+    assert client.get("/debug/profile", headers=ADMIN).text == ""
+
+
+def test_websocket_validation(monkeypatch):
+    from starlette.websockets import WebSocketDisconnect
+
+    client, _ = make_client(monkeypatch, WS_MAX_CONNECTIONS="1")
+    key = generate(client, max_uses=1)
+
+    with client.websocket_connect("/ws/validate") as websocket:
+        for text in [
+            json.dumps({"id": 0, "key": key}), json.dumps({"id": 1, "key": key}),
+            json.dumps({"id": 2, "key": "no-existe"}), "no es json", json.dumps({"id": 4, "key": 4}),
+        ]:
+            websocket.send_text(text)
+        results = [websocket.receive_json() for _ in range(5)]
+
+        # Con WS_MAX_CONNECTIONS=1 la segunda conexión se cierra sin aceptarla
+        with pytest.raises(WebSocketDisconnect) as rejected:
+            with client.websocket_connect("/ws/validate"):
+                pass
+        assert rejected.value.code == 1013
+
+    assert [(result["id"], result["success"], result["message"]) for result in results[:3]] == [
+        (0, True, "Key válida"), (1, False, "Key ha alcanzado el límite de usos"), (2, False, "Key inválida"),
+    ]
+    assert results[0]["data"]["remaining_uses"] == 0 and "timestamp" in results[0]
+    assert [(result["id"], result["status"]) for result in results[3:]] == [(None, 422), (4, 422)]
+
+    stats = client.get("/stats", headers=ADMIN).json()
+    assert stats["websocket"] == {"connections": 0, "opened": 1, "rejected": 1, "messages": 5, "invalid_messages": 2}
+    assert stats["uses_consumed"] == 1
+    assert 'apikey_validations_total{outcome="exhausted"} 1' in client.get("/metrics").text
+
+
+def test_websocket_rate_limit(monkeypatch):
+    from starlette.websockets import WebSocketDisconnect
+
+    client, _ = make_client(monkeypatch, RATE_LIMITS="/ws/validate=0.01/1")
+    # Los mensajes no cuentan en el límite: solo la apertura de la conexión
+    with client.websocket_connect("/ws/validate") as websocket:
+        for message_id in range(3):
+            websocket.send_json({"id": message_id, "key": "no-existe"})
+            assert websocket.receive_json()["id"] == message_id
+
+    with pytest.raises(WebSocketDisconnect) as rejected:
+        with client.websocket_connect("/ws/validate"):
+            pass
+    assert rejected.value.code == 1008
+
+
+def test_import_defers_heavy_modules():
+    """Importar main.py con la configuración por defecto no carga los módulos que solo se usan a veces"""
+    code = (
+        "import sys, main; "
+        "print(','.join(m for m in ('cryptography', 'sqlite3', 'argparse', 'httpx') if m in sys.modules))"
+    )
+    env = {name: value for name, value in os.environ.items() if name not in ("KEY_STORE", "REPLICA_OF")}
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.abspath(__file__)),
+        env=env, capture_output=True, text=True, check=True
+    )
+    assert result.stdout.strip() == ""
@@ -0,0 +1,90 @@
+"""
+🧪 Pruebas de la caché de Idempotency-Key
+Repeticiones, conflictos, fallos, caducidad y los límites por entradas y por
+keys guardadas.
+
+Uso: python -m pytest test_idempotency.py
+"""
+
+import pytest
+
+from idempotency import IdempotencyCache, IdempotencyConflict
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_cache(max_entries=10, ttl=60.0, max_keys=100):
+    clock = Clock()
+    return IdempotencyCache(max_entries, ttl, max_keys, clock), clock
+
+
+def keys_result(count):
+    return [f"key-{i}" for i in range(count)]
+
+
+def test_replay_and_conflict():
+    cache, _ = make_cache()
+    calls = []
+
+    def produce():
+        calls.append(1)
+        return "resultado"
+
+    assert cache.run("a", b"peticion", produce) == ("resultado", False)
+    assert cache.run("a", b"peticion", produce) == ("resultado", True)
+    assert len(calls) == 1
+    with pytest.raises(IdempotencyConflict):
+        cache.run("a", b"otra peticion", produce)
+    assert cache.metrics()["replayed"] == 1
+    assert cache.metrics()["conflicts"] == 1
+
+
+def test_failure_is_not_stored():
+    cache, _ = make_cache()
+
+    def fail():
+        raise RuntimeError("fallo")
+
+    with pytest.raises(RuntimeError):
+        cache.run("a", b"peticion", fail)
+    assert cache.run("a", b"peticion", lambda: "resultado") == ("resultado", False)
+
+
+def test_entries_expire():
+    cache, clock = make_cache(ttl=60.0)
+    cache.run("a", b"peticion", lambda: "primero")
+    clock.now = 60.0
+    assert cache.run("a", b"peticion", lambda: "segundo") == ("segundo", False)
+    assert cache.metrics()["entries"] == 1
+
+
+def test_bounded_by_stored_keys():
+    cache, _ = make_cache(max_keys=100)
+    for name in "abc":
+        cache.run(name, b"peticion", lambda: keys_result(40), len)
+
+    # 120 keys no caben: se descarta la entrada más antigua
+    metrics = cache.metrics()
+    assert (metrics["entries"], metrics["keys"], metrics["evictions"]) == (2, 80, 1)
+    assert cache.run("a", b"peticion", lambda: keys_result(40), len)[1] is False
+
+    # Un resultado mayor que el límite se devuelve sin guardarlo ni desalojar nada
+    assert cache.run("d", b"peticion", lambda: keys_result(101), len)[1] is False
+    assert cache.run("d", b"peticion", lambda: keys_result(101), len)[1] is False
+    assert cache.metrics()["oversized"] == 2
+    assert cache.metrics()["keys"] == 80
+
+
+def test_bounded_by_entries():
+    cache, _ = make_cache(max_entries=2)
+    for name in "abc":
+        cache.run(name, b"peticion", lambda: "resultado")
+    assert cache.metrics()["entries"] == 2
+    assert cache.run("a", b"peticion", lambda: "nuevo") == ("nuevo", False)
+    assert cache.run("c", b"peticion", lambda: "nuevo") == ("resultado", True)
@@ -0,0 +1,83 @@
+"""
+🧪 Pruebas del límite de peticiones
+Límites inválidos, buckets compartidos bloqueados por otro worker (503) y
+métricas de las respuestas rechazadas etiquetadas con su ruta.
+
+Uso: python -m pytest test_ratelimit.py
+"""
+
+import sqlite3
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from metrics import Metrics, MetricsMiddleware
+from ratelimit import LocalBuckets, RateLimiter, RateLimitMiddleware, SharedBuckets, parse_limits
+from store import StoreBusy
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_700_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_client(buckets):
+    """Aplicación mínima con el mismo orden de middlewares que main.py"""
+    app = FastAPI()
+
+    @app.get("/key-info/{key}")
+    async def key_info(key: str):
+        return {"key": key}
+
+    limiter = RateLimiter(parse_limits("/key-info=1/2"), buckets, Clock())
+    metrics = Metrics(("valid",))
+    app.add_middleware(RateLimitMiddleware, limiter=limiter, routes=app.routes)
+    app.add_middleware(MetricsMiddleware, metrics=metrics)
+    return TestClient(app), limiter, metrics
+
+
+def requests_by_status(metrics):
+    return {
+        (route, status): count
+        for (route, _), route_metrics in metrics.routes.items()
+        for status, count in route_metrics.statuses.items()
+    }
+
+
+@pytest.mark.parametrize("spec", ["/a=0", "/a=-1/5", "/a=nan", "/a=5/0.5"])
+def test_invalid_limits(spec):
+    with pytest.raises(ValueError):
+        parse_limits(spec)
+
+
+def test_rejections_are_labelled_with_their_route():
+    client, limiter, metrics = make_client(LocalBuckets(100))
+    statuses = [client.get(f"/key-info/key-{i}").status_code for i in range(3)]
+
+    assert statuses == [200, 200, 429]
+    assert limiter.metrics()["rejected"] == 1
+    assert requests_by_status(metrics) == {("/key-info/{key}", 200): 2, ("/key-info/{key}", 429): 1}
+
+
+def test_shared_buckets_busy(tmp_path):
+    path = str(tmp_path / "buckets.db")
+    buckets = SharedBuckets(path, max_idle=60.0, busy_timeout=10)
+    client, limiter, metrics = make_client(buckets)
+    assert client.get("/key-info/a").status_code == 200
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(StoreBusy):
+        buckets.take("x", 1.0, 1.0, 0.0)
+    response = client.get("/key-info/b")
+    other.execute("ROLLBACK")
+
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+    assert limiter.metrics()["busy"] == 1
+    assert requests_by_status(metrics)[("/key-info/{key}", 503)] == 1
+    assert client.get("/key-info/c").status_code == 200
@@ -0,0 +1,229 @@
+"""
+🧪 Pruebas del feed de cambios y de las réplicas de lectura
+Buffer circular del feed, parser SSE, una réplica que se sincroniza con la
+instantánea y el stream de un primario real, y los endpoints en modo réplica
+(rechazos en local, validaciones reenviadas, escrituras con 405).
+
+Uso: python -m pytest test_replica.py
+"""
+
+import asyncio
+import importlib
+import json
+import sys
+import time
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from changes import ChangeFeed
+from replica import Replica, ResyncNeeded, check_key, sse_events
+from store import STATUS_INVALID, STATUS_REVOKED, STATUS_VALID, MemoryKeyStore
+
+START = 1_700_000_000.0
+ADMIN = {"Authorization": "Bearer admin_token_123"}
+
+
+def load_main(monkeypatch, **env):
+    """Importa main.py de nuevo con la configuración de `env` (config.py la lee al importarse)"""
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    for module in ("config", "main"):
+        sys.modules.pop(module, None)
+    return importlib.import_module("main")
+
+
+def generate(client, user_id, **fields):
+    response = client.post("/generate-key", json={"user_id": user_id, **fields}, headers=ADMIN)
+    assert response.status_code == 200, response.text
+    return response.json()["data"]["key"]
+
+
+def mock_client(replica, handler):
+    """Cliente httpx de la réplica que responde con `handler` en lugar de la red"""
+    return httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url=replica.primary_url)
+
+
+def test_feed_since_and_overflow():
+    feed = ChangeFeed(4)
+    for i in range(6):
+        feed.append("revoke", START + i, key=f"key-{i}")
+
+    assert (feed.first_seq, feed.last_seq) == (3, 6)
+    assert [json.loads(event)["seq"] for event in feed.since(2, 10)] == [3, 4, 5, 6]
+    assert [json.loads(event)["key"] for event in feed.since(3, 2)] == ["key-3", "key-4"]
+    assert feed.since(6, 10) == []
+    # El evento 2 ya salió del buffer
+    assert feed.since(1, 10) is None
+
+
+def test_feed_wait():
+    feed = ChangeFeed(4)
+
+    async def scenario():
+        assert not await feed.wait(0, 0.01)
+        waiter = asyncio.create_task(feed.wait(0, 5.0))
+        await asyncio.sleep(0)
+        feed.append("revoke", START, key="a")
+        assert await waiter
+        assert await feed.wait(0, 0.0)
+
+    asyncio.run(scenario())
+
+
+def test_sse_events():
+    lines = [
+        "event: hello", 'data: {"seq": 0}', "",
+        ": comentario", "id: 1", "data: a", "data: b", "", "",
+        # Un evento sin línea en blanco final está incompleto
+        "event: heartbeat", "data: {}",
+    ]
+
+    async def collect():
+        async def aiter():
+            for line in lines:
+                yield line
+        return [item async for item in sse_events(aiter())]
+
+    assert asyncio.run(collect()) == [("hello", '{"seq": 0}'), ("message", "a\nb")]
+
+
+async def read_stream(primary, since):
+    """Bloques del stream SSE del primario hasta el primer heartbeat"""
+    chunks = []
+    stream = primary._change_stream(since)
+    async for chunk in stream:
+        chunks.append(chunk)
+        if chunk.startswith(b"event: heartbeat"):
+            break
+    await stream.aclose()
+    return b"".join(chunks)
+
+
+def test_replica_follows_primary(monkeypatch):
+    primary = load_main(monkeypatch, CHANGE_FEED_SIZE="1000", CHANGE_FEED_HEARTBEAT_SECONDS="0.01")
+    client = TestClient(primary.app)
+    keys = [generate(client, "ana", max_uses=2) for _ in range(3)]
+    client.post("/validate-key", json={"key": keys[0]})
+    snapshot = client.get("/changes/snapshot", headers=ADMIN).content
+    since = json.loads(snapshot.split(b"\n", 1)[0])["seq"]
+
+    # Cambios posteriores a la instantánea: consumo, revocaciones, creación y desalojo
+    client.post("/validate-key", json={"key": keys[0]})
+    client.post("/validate-keys", json={"keys": [keys[1]]})
+    client.delete(f"/revoke-key/{keys[2]}", headers=ADMIN)
+    client.post("/generate-keys", json={"user_id": "bea", "count": 3}, headers=ADMIN)
+    client.delete("/users/bea/keys", headers=ADMIN)
+    assert primary.key_store.evict(time.time() + 1, 100) == (0, 1)
+    stream = asyncio.run(read_stream(primary, since))
+
+    requests = []
+
+    def handler(request):
+        requests.append(request)
+        body = {"/changes/snapshot": snapshot, "/changes/stream": stream}[request.url.path]
+        return httpx.Response(200, content=body)
+
+    replica = Replica("http://primario", "admin_token_123", MemoryKeyStore())
+    replica._client = mock_client(replica, handler)
+    # Una key local que el primario ya no tiene desaparece con la instantánea
+    replica.store.create("fantasma", "ana", START, START + 3600, 1)
+
+    async def sync():
+        await replica.resync()
+        await replica.follow()
+        await replica.close()
+
+    asyncio.run(sync())
+
+    assert requests[1].url.params["since"] == str(since)
+    assert all(request.headers["authorization"] == ADMIN["Authorization"] for request in requests)
+    expected = {
+        record.key: (record.user_id, record.expires_at, record.max_uses, record.current_uses, record.is_active)
+        for record in primary.key_store.list()
+    }
+    assert len(expected) == 5
+    assert {
+        record.key: (record.user_id, record.expires_at, record.max_uses, record.current_uses, record.is_active)
+        for record in replica.store.list()
+    } == expected
+
+    now = time.time()
+    assert check_key(replica.store, keys[0], now) == STATUS_INVALID
+    assert check_key(replica.store, keys[1], now) == STATUS_VALID
+    assert check_key(replica.store, keys[2], now) == STATUS_REVOKED
+    metrics = replica.metrics()
+    assert (metrics["applied_seq"], metrics["lag_events"]) == (primary.change_feed.last_seq, 0)
+    assert (metrics["resyncs"], metrics["errors"]) == (1, 0)
+
+
+@pytest.mark.parametrize("body", [
+    # El primario reinició: otra época
+    b'event: hello\ndata: {"epoch": "otra", "seq": 5}\n\n',
+    # La réplica se quedó atrás más que el buffer
+    b'event: hello\ndata: {"epoch": "actual", "seq": 5}\n\nevent: reset\ndata: {"detail": "perdidos"}\n\n',
+])
+def test_follow_requests_resync(body):
+    replica = Replica("http://primario", "admin_token_123", MemoryKeyStore())
+    replica.epoch = "actual"
+    replica._client = mock_client(replica, lambda request: httpx.Response(200, content=body))
+
+    async def follow():
+        try:
+            await replica.follow()
+        finally:
+            await replica.close()
+
+    with pytest.raises(ResyncNeeded):
+        asyncio.run(follow())
+
+
+def test_replica_endpoints(monkeypatch):
+    primary = load_main(monkeypatch, CHANGE_FEED_SIZE="1000")
+    primary_client = TestClient(primary.app)
+    key = generate(primary_client, "ana", max_uses=1)
+
+    replica_main = load_main(monkeypatch, CHANGE_FEED_SIZE="0", REPLICA_OF="http://primario")
+    replica = replica_main.replica
+    client = TestClient(replica_main.app)
+
+    def catch_up():
+        changes = primary_client.get("/changes", params={"since": replica.applied_seq}, headers=ADMIN)
+        for event in changes.json()["events"]:
+            replica.apply(event)
+
+    forwarded = []
+
+    def handler(request):
+        forwarded.append(request.url.path)
+        response = primary_client.post(
+            request.url.path, content=request.content, headers={"Content-Type": "application/json"}
+        )
+        return httpx.Response(response.status_code, content=response.content)
+
+    replica._client = mock_client(replica, handler)
+    catch_up()
+
+    # Las keys válidas consumen su uso en el primario
+    response = client.post("/validate-key", json={"key": key})
+    assert response.json()["success"] is True
+    assert forwarded == ["/validate-key"]
+    assert primary.key_store.get(key).current_uses == 1
+
+    # Agotada e inexistente se rechazan en local, sin contactar con el primario
+    catch_up()
+    assert client.post("/validate-key", json={"key": key}).json()["success"] is False
+    assert client.post("/validate-key", json={"key": "no-existe"}).json()["success"] is False
+    assert client.get(f"/key-info/{key}", headers=ADMIN).json()["current_uses"] == 1
+    assert forwarded == ["/validate-key"]
+
+    assert client.post("/generate-key", json={"user_id": "bea"}, headers=ADMIN).status_code == 405
+
+    def down(request):
+        raise httpx.ConnectError("primario caído")
+
+    other = generate(primary_client, "ana")
+    catch_up()
+    replica._client = mock_client(replica, down)
+    assert client.post("/validate-key", json={"key": other}).status_code == 503
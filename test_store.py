@@ -0,0 +1,280 @@
+"""
+🧪 Pruebas de los almacenamientos de keys
+Comparación aleatoria (diferencial) de los backends con MemoryKeyStore como
+referencia: la misma secuencia de operaciones debe dar los mismos resultados,
+contadores y desalojos. Además, consumo concurrente desde varios procesos
+(tabla compartida y SQLite, incluida la cuota por ventana), bloqueos de SQLite
+y keys no codificables del almacenamiento hasheado.
+
+Uso: python -m pytest test_store.py
+"""
+
+import multiprocessing
+import random
+import sqlite3
+import sys
+from collections import Counter
+
+import pytest
+
+from store import STATUS_RATE_LIMITED, STATUS_VALID, KeyFilter, MemoryKeyStore, StoreBusy, create_key_store
+
+pytestmark = pytest.mark.skipif(sys.platform == "win32", reason="la tabla compartida necesita fcntl")
+
+START = 1_700_000_000.0
+GRACE = 120.0
+
+
+def same_key(key):
+    return key
+
+
+def record_fields(record, key_id=same_key):
+    """Campos de un registro; `key_id` traduce la key a como la expone el backend"""
+    if record is None:
+        return None
+    return (
+        key_id(record.key), record.user_id, record.created_at, record.expires_at, record.max_uses,
+        record.current_uses, record.is_active, record.seq, record.rate_limit,
+        record.rate_limit_window, record.tat,
+    )
+
+
+def all_pages(store, key_filter, now, key_id=same_key, limit=7):
+    """Todas las páginas de un listado, siguiendo los cursores"""
+    records, after = [], 0
+    while after is not None:
+        page, after = store.page(after, limit, key_filter, now)
+        records += [record_fields(record, key_id) for record in page]
+    return records
+
+
+def run_differential(store, seed: int, steps: int = 3000, capacity: int = 64, users: int = 30, key_id=same_key):
+    """Aplica la misma secuencia aleatoria a `store` y a MemoryKeyStore y compara cada resultado
+
+    `key_id` convierte las keys de la referencia en las que devuelve `store`
+    (el almacenamiento hasheado solo guarda un digest).
+    """
+    rng = random.Random(seed)
+    reference = MemoryKeyStore()
+    stores = (reference, store)
+    now = START
+    counter = 0
+
+    for step in range(steps):
+        now += rng.expovariate(1 / 20)
+        live = list(reference._keys)
+        user_id = f"user_{rng.randrange(users)}"
+        op = rng.random()
+
+        if op < 0.2 and len(live) + 5 <= capacity:
+            keys = []
+            for _ in range(rng.randint(1, 5)):
+                counter += 1
+                keys.append(f"key-{seed}-{counter}")
+            expires_at = now + rng.choice((-10.0, 5.0, 60.0, 600.0, 3600.0))
+            max_uses = rng.randint(1, 4)
+            quota = (2, 10.0) if rng.random() < 0.3 else (0, 0.0)
+            created = [
+                [r for r in s.create_many(keys, user_id, now, expires_at, max_uses, *quota)]
+                if len(keys) > 1 else [s.create(keys[0], user_id, now, expires_at, max_uses, *quota)]
+                for s in stores
+            ]
+            assert [record_fields(r) for r in created[1]] == [record_fields(r, key_id) for r in created[0]]
+        elif op < 0.5:
+            key = rng.choice(live) if live and rng.random() < 0.9 else "no-existe"
+            # MemoryKeyStore devuelve su propio registro: se compara antes de la siguiente operación
+            results = [s.consume(key, now) for s in stores]
+            assert results[1][0] == results[0][0]
+            assert record_fields(results[1][1]) == record_fields(results[0][1], key_id)
+        elif op < 0.55:
+            keys = [rng.choice(live) for _ in range(3)] if live else ["no-existe"]
+            results = [[status for status, _ in s.consume_many(keys, now)] for s in stores]
+            assert results[1] == results[0]
+            assert [record_fields(store.get(key)) for key in keys] == [record_fields(reference.get(key), key_id) for key in keys]
+        elif op < 0.62 and live:
+            key = rng.choice(live)
+            assert store.revoke(key, now) == reference.revoke(key, now)
+        elif op < 0.65:
+            assert store.revoke_user(user_id, now) == reference.revoke_user(user_id, now)
+        elif op < 0.75:
+            cutoff = now - GRACE
+            assert store.evict(cutoff, 10 ** 6) == reference.evict(cutoff, 10 ** 6)
+        elif op < 0.82:
+            assert store.stats(now) == reference.stats(now)
+        elif op < 0.86:
+            assert store.user_stats(user_id, now) == reference.user_stats(user_id, now)
+        elif op < 0.88:
+            assert store.users_stats(now) == reference.users_stats(now)
+        else:
+            key_filter = KeyFilter(
+                user_id=user_id if rng.random() < 0.3 else None,
+                active=rng.choice((None, True, False)),
+                expired=rng.choice((None, True, False)),
+                exhausted=rng.choice((None, True, False)),
+            )
+            assert all_pages(store, key_filter, now) == all_pages(reference, key_filter, now, key_id)
+
+        assert sorted(r.key for r in store.user_keys(user_id)) == sorted(key_id(r.key) for r in reference.user_keys(user_id))
+
+    # Al final, todo desalojado salvo lo que sigue vigente
+    later = now + 10 ** 6
+    assert store.evict(later, 10 ** 6) == reference.evict(later, 10 ** 6)
+    assert store.stats(later) == reference.stats(later)
+    assert list(store.list()) == []
+
+
+def test_memory_store_eviction_releases_heaps():
+    """Las keys agotadas y desalojadas no quedan retenidas en los heaps hasta su expiración"""
+    store = MemoryKeyStore()
+    keys = [f"key-{i}" for i in range(10_000)]
+    store.create_many(keys, "user", START, START + 365 * 86400, 1)
+    for key in keys:
+        assert store.consume(key, START)[0] == STATUS_VALID
+
+    assert store.evict(START, 10 ** 6) == (0, len(keys))
+    assert len(store._keys) == 0
+    assert len(store._expiry) + len(store._pending_expiry) <= 64
+    assert store.stats(START + 365 * 86400 + 1)["expired_keys"] == 0
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_shared_store_matches_memory(tmp_path, seed):
+    from sharedstore import SharedMemoryKeyStore
+
+    # Capacidad pequeña y muchos usuarios que se quedan sin keys: fuerza
+    # reconstrucciones del índice y de la tabla de usuarios
+    store = SharedMemoryKeyStore(str(tmp_path / "keys.tbl"), 64)
+    run_differential(store, seed, users=200)
+
+
+def test_shared_store_user_counters_survive_rebuild(tmp_path):
+    """Los contadores por usuario y sus expiraciones pendientes se mueven con la tabla de usuarios"""
+    from sharedstore import SharedMemoryKeyStore
+
+    store = SharedMemoryKeyStore(str(tmp_path / "keys.tbl"), 100)
+    reference = MemoryKeyStore()
+    stores = (reference, store)
+
+    def churn(first, count):
+        """Usuarios de paso con una key agotada"""
+        for i in range(first, first + count):
+            for s in stores:
+                s.create(f"temp-{i}", f"temp_{i}", START, START + 1, 1)
+                s.consume(f"temp-{i}", START)
+
+    # Los usuarios que se quedan se insertan detrás de los de paso: al
+    # reconstruir la tabla sin sus lápidas cambian de entrada
+    churn(0, 80)
+    for i in range(8):
+        for s in stores:
+            s.create_many([f"key-{i}-a", f"key-{i}-b"], f"user_{i}", START, START + 600, 2)
+            s.consume(f"key-{i}-a", START)
+    for first in range(80, 800, 80):
+        for s in stores:
+            s.evict(START, 10 ** 6)
+        churn(first, 80)
+
+    for now in (START + 1, START + 601):
+        assert store.users_stats(now) == reference.users_stats(now)
+        assert store.user_stats("user_3", now) == reference.user_stats("user_3", now)
+    assert store.stats(START + 601) == reference.stats(START + 601)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_sqlite_store_matches_memory(tmp_path, seed):
+    from store import SQLiteKeyStore
+
+    # Compara también seq: debe crecer siempre, sin reutilizar los ids desalojados
+    run_differential(SQLiteKeyStore(str(tmp_path / "keys.db")), seed)
+
+
+@pytest.mark.parametrize("seed", range(3))
+def test_hashed_store_matches_memory(seed):
+    from hashedstore import KEY_ID_PREFIX, HashedKeyStore, key_digest
+
+    run_differential(HashedKeyStore(), seed, key_id=lambda key: KEY_ID_PREFIX + key_digest(key).hex())
+
+
+def test_hashed_store_surrogate_key():
+    """Una key con un surrogate suelto (JSON válido, UTF-8 no) no rompe el hash"""
+    from hashedstore import HashedKeyStore
+
+    store = HashedKeyStore()
+    store.create("key-\udcff", "user", START, START + 3600, 1)
+    assert store.consume("key-\udcff", START)[0] == STATUS_VALID
+    assert store.get("key-\ud800") is None
+
+
+def _consume(backend, path, keys, now, rounds, results):
+    store = create_key_store(backend, path, capacity=64)
+    results.put([store.consume(key, now)[0] for _ in range(rounds) for key in keys])
+
+
+def consume_concurrently(backend, path, keys, now, rounds, processes=4) -> Counter:
+    """Consume `rounds` veces cada key desde varios procesos; devuelve los resultados por estado"""
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [
+        context.Process(target=_consume, args=(backend, path, keys, now, rounds, results))
+        for _ in range(processes)
+    ]
+    for worker in workers:
+        worker.start()
+    statuses = Counter()
+    for _ in workers:
+        statuses.update(results.get(timeout=60))
+    for worker in workers:
+        worker.join()
+    return statuses
+
+
+@pytest.mark.parametrize("backend, filename", [("shared", "keys.tbl"), ("sqlite", "keys.db")])
+def test_concurrent_consume(tmp_path, backend, filename):
+    """Varios procesos consumiendo las mismas keys nunca superan max_uses"""
+    path, max_uses = str(tmp_path / filename), 60
+    store = create_key_store(backend, path, capacity=64)
+    keys = [f"key-{i}" for i in range(5)]
+    store.create_many(keys, "user", START, START + 3600, max_uses)
+
+    statuses = consume_concurrently(backend, path, keys, START + 1, 50)
+
+    assert statuses[STATUS_VALID] == len(keys) * max_uses
+    stats = store.stats(START + 1)
+    assert stats["uses_consumed"] == len(keys) * max_uses
+    assert stats["exhausted_keys"] == len(keys)
+    # Desalojadas por agotamiento, sin esperar a su expiración
+    assert store.evict(START + 1, 100) == (0, len(keys))
+    assert store.stats(START + 1)["total_keys"] == 0
+
+
+@pytest.mark.parametrize("backend, filename", [("shared", "keys.tbl"), ("sqlite", "keys.db")])
+def test_concurrent_quota(tmp_path, backend, filename):
+    """La cuota por ventana se comprueba y actualiza de forma atómica entre procesos"""
+    path = str(tmp_path / filename)
+    store = create_key_store(backend, path, capacity=64)
+    store.create("key", "user", START, START + 3600, 1000, rate_limit=10, rate_limit_window=60.0)
+
+    statuses = consume_concurrently(backend, path, ["key"], START + 1, 20)
+
+    assert statuses == {STATUS_VALID: 10, STATUS_RATE_LIMITED: 70}
+    assert store.get("key").current_uses == 10
+    # Cada uso se recupera tras window / rate_limit segundos
+    assert store.consume("key", START + 6)[0] == STATUS_RATE_LIMITED
+    assert store.consume("key", START + 7)[0] == STATUS_VALID
+
+
+def test_sqlite_store_busy(tmp_path):
+    """Con la base de datos bloqueada por otra conexión, escribir lanza StoreBusy tras la espera"""
+    path = str(tmp_path / "keys.db")
+    store = create_key_store("sqlite", path, busy_timeout=10)
+    store.create("key", "user", START, START + 3600, 5)
+
+    other = sqlite3.connect(path, isolation_level=None)
+    other.execute("BEGIN IMMEDIATE")
+    with pytest.raises(StoreBusy):
+        store.consume("key", START + 1)
+    # Las lecturas no esperan a la escritura en curso (WAL)
+    assert store.get("key").current_uses == 0
+    other.execute("ROLLBACK")
+    assert store.consume("key", START + 1)[0] == STATUS_VALID
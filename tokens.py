@@ -0,0 +1,88 @@
+"""
+🔏 Keys firmadas
+Formato opcional de key que incluye user_id, expiración, max_uses y un id
+aleatorio, autenticados con HMAC-SHA256. Las keys falsificadas, mal formadas
+o expiradas se rechazan sin consultar el almacenamiento.
+
+Formato: k1.<payload base64url>.<firma base64url>
+Payload: expires_at (u64) | max_uses (u64) | key_id (16 bytes) | user_id (utf-8)
+"""
+
+import base64
+import binascii
+import hashlib
+import hmac
+import struct
+from typing import Optional
+
+TOKEN_PREFIX = "k1."
+KEY_ID_LENGTH = 16
+_HEADER = struct.Struct(">QQ")
+_MAC_LENGTH = 16
+
+
+class TokenClaims:
+    """Datos autenticados de una key firmada"""
+
+    __slots__ = ("key_id", "user_id", "expires_at", "max_uses")
+
+    def __init__(self, key_id: str, user_id: str, expires_at: int, max_uses: int):
+        self.key_id = key_id
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.max_uses = max_uses
+
+
+def derive_key(secret: str, purpose: bytes) -> bytes:
+    """Deriva una clave de 32 bytes de SECRET_KEY para un uso concreto"""
+    return hmac.new(secret.encode(), purpose, hashlib.sha256).digest()
+
+
+def _b64encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+
+def _b64decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + "=" * (-len(data) % 4))
+
+
+class KeySigner:
+    """Firma y verifica keys con una clave HMAC"""
+
+    def __init__(self, signing_key: bytes):
+        self._signing_key = signing_key
+
+    def _mac(self, signed_part: str) -> bytes:
+        return hmac.new(self._signing_key, signed_part.encode("ascii"), hashlib.sha256).digest()[:_MAC_LENGTH]
+
+    def sign(self, key_id: str, user_id: str, expires_at: int, max_uses: int) -> str:
+        """Crea una key firmada"""
+        payload = _HEADER.pack(expires_at, max_uses) + key_id.encode("ascii") + user_id.encode("utf-8")
+        signed_part = TOKEN_PREFIX + _b64encode(payload)
+        return f"{signed_part}.{_b64encode(self._mac(signed_part))}"
+
+    def verify(self, token: str) -> Optional[TokenClaims]:
+        """Devuelve los datos de una key firmada, o None si está mal formada o falsificada"""
+        signed_part, _, mac = token.rpartition(".")
+        if not signed_part.startswith(TOKEN_PREFIX):
+            return None
+        try:
+            expected = _b64decode(mac)
+            payload = _b64decode(signed_part[len(TOKEN_PREFIX):])
+            actual = self._mac(signed_part)
+        except (binascii.Error, ValueError):
+            return None
+        if not hmac.compare_digest(expected, actual):
+            return None
+        if len(payload) < _HEADER.size + KEY_ID_LENGTH:
+            return None
+
+        expires_at, max_uses = _HEADER.unpack_from(payload)
+        key_id = payload[_HEADER.size:_HEADER.size + KEY_ID_LENGTH].decode("ascii")
+        user_id = payload[_HEADER.size + KEY_ID_LENGTH:].decode("utf-8")
+        return TokenClaims(key_id, user_id, expires_at, max_uses)
+
+
+def is_signed_key(key: str) -> bool:
+    """Indica si la key usa el formato firmado"""
+    return key.startswith(TOKEN_PREFIX)
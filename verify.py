@@ -1,16 +1,39 @@
 """
 ✅ Verificador de Keys - Script para validar keys de acceso
 Conecta con la API local para verificar la validez de las keys
+
+Modo interactivo: python verify.py
+Modo masivo:      python verify.py --bulk keys.txt --output resultados.jsonl
+                  cat keys.txt | python verify.py --bulk - > resultados.jsonl
+
+En modo masivo las keys (una por línea) se leen como stream y se verifican en
+paralelo con conexiones reutilizadas, usando POST /validate-keys por lotes si
+el servidor lo soporta. Cada validación consume un uso de la key, igual que en
+el modo interactivo. Código de salida: 0 si todas son válidas, 1 si alguna es
+inválida y 2 si hubo errores de conexión o del servidor.
 """
 
+import argparse
 import requests
 import json
 import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 # Configuración de la API
 API_BASE_URL = "http://127.0.0.1:8000"
 
+# Modo masivo: keys por petición a /validate-keys (máximo del servidor: 1000),
+# reintentos ante 429 y cada cuántos segundos se muestra el progreso
+BULK_BATCH_SIZE = 500
+BULK_MAX_RATE_LIMIT_RETRIES = 10
+BULK_PROGRESS_SECONDS = 2.0
+
 def print_banner():
     """Muestra el banner del verificador de keys"""
     print("=" * 60)
@@ -206,7 +229,202 @@ def get_key_info_option():
         else:
             print(f"   {result}")
 
+# ---------------------------------------------------------------------------
+# Modo masivo
+# ---------------------------------------------------------------------------
+
+_thread_local = threading.local()
+
+def get_session():
+    """Sesión HTTP del hilo actual; reutiliza las conexiones entre peticiones"""
+    session = getattr(_thread_local, "session", None)
+    if session is None:
+        session = requests.Session()
+        retries = Retry(total=3, connect=3, read=0, status=0, backoff_factor=0.2)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1, max_retries=retries)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        _thread_local.session = session
+    return session
+
+def post_json(base_url, path, payload, timeout=30):
+    """POST que espera y reintenta cuando el servidor responde 429 (Retry-After)"""
+    for _ in range(BULK_MAX_RATE_LIMIT_RETRIES):
+        response = get_session().post(f"{base_url}{path}", json=payload, timeout=timeout)
+        if response.status_code != 429:
+            return response
+        time.sleep(float(response.headers.get("Retry-After", "1")))
+    return response
+
+def supports_batch_validation(base_url):
+    """Indica si el servidor tiene POST /validate-keys"""
+    try:
+        return post_json(base_url, "/validate-keys", {"keys": []}, timeout=5).status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+
+def read_keys(stream):
+    """Lee keys de un stream, una por línea, ignorando líneas vacías y comentarios"""
+    for line in stream:
+        key = line.strip()
+        if key and not key.startswith("#"):
+            yield key
+
+def read_chunks(keys, size):
+    """Agrupa las keys en listas de `size` elementos sin leer todo el stream"""
+    chunk = []
+    for key in keys:
+        chunk.append(key)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def result_row(key, result):
+    """Fila JSONL de una key a partir de la respuesta de la API"""
+    return {
+        "key": key,
+        "valid": result["success"],
+        "message": result["message"],
+        "data": result.get("data"),
+    }
+
+def error_rows(keys, error):
+    """Filas JSONL de keys que no se pudieron verificar"""
+    return [{"key": key, "valid": False, "error": error} for key in keys]
+
+def verify_chunk(base_url, keys, use_batch):
+    """Verifica un grupo de keys; nunca lanza excepciones"""
+    try:
+        if use_batch:
+            response = post_json(base_url, "/validate-keys", {"keys": keys})
+            if response.status_code != 200:
+                return error_rows(keys, f"HTTP {response.status_code}: {response.text[:200]}")
+            results = response.json()["data"]["results"]
+            return [result_row(key, result) for key, result in zip(keys, results)]
+
+        rows = []
+        for key in keys:
+            response = post_json(base_url, "/validate-key", {"key": key})
+            if response.status_code != 200:
+                rows += error_rows([key], f"HTTP {response.status_code}: {response.text[:200]}")
+            else:
+                rows.append(result_row(key, response.json()))
+        return rows
+    except requests.exceptions.RequestException as e:
+        return error_rows(keys, f"Error de conexión: {str(e)}")
+    except (ValueError, KeyError) as e:
+        return error_rows(keys, f"Respuesta inesperada: {str(e)}")
+
+class BulkProgress:
+    """Contadores del modo masivo y resumen periódico por stderr"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.last_report = self.start
+        self.total = 0
+        self.valid = 0
+        self.invalid = 0
+        self.errors = 0
+
+    def add(self, rows):
+        for row in rows:
+            self.total += 1
+            if "error" in row:
+                self.errors += 1
+            elif row["valid"]:
+                self.valid += 1
+            else:
+                self.invalid += 1
+        now = time.perf_counter()
+        if now - self.last_report >= BULK_PROGRESS_SECONDS:
+            self.last_report = now
+            self.report()
+
+    def report(self, final=False):
+        elapsed = max(time.perf_counter() - self.start, 1e-9)
+        prefix = "🏁 Total" if final else "⏳ Progreso"
+        print(
+            f"{prefix}: {self.total} keys | ✅ {self.valid} válidas | ❌ {self.invalid} inválidas | "
+            f"⚠️  {self.errors} errores | {self.total / elapsed:.0f} keys/s | {elapsed:.1f}s",
+            file=sys.stderr
+        )
+
+    @property
+    def exit_code(self):
+        if self.errors:
+            return 2
+        return 1 if self.invalid else 0
+
+def write_rows(output, progress, rows):
+    """Escribe filas JSONL y actualiza el progreso"""
+    output.write("".join(json.dumps(row, ensure_ascii=False) + "\n" for row in rows))
+    progress.add(rows)
+
+def run_bulk(args):
+    """Verifica las keys de un archivo o stdin y escribe los resultados en JSONL"""
+    base_url = args.url.rstrip("/")
+    if not check_api_status():
+        print(f"❌ Error: La API no está funcionando en {base_url}", file=sys.stderr)
+        return 2
+
+    use_batch = not args.no_batch and supports_batch_validation(base_url)
+    chunk_size = args.batch_size if use_batch else 1
+    window = args.window or args.workers * 2
+    print(
+        f"🚀 Verificación masiva contra {base_url} "
+        f"({'/validate-keys por lotes de ' + str(chunk_size) if use_batch else '/validate-key'}, "
+        f"{args.workers} conexiones, hasta {window} peticiones en curso)",
+        file=sys.stderr
+    )
+
+    source = sys.stdin if args.bulk == "-" else open(args.bulk, encoding="utf-8")
+    output = sys.stdout if args.output == "-" else open(args.output, "w", encoding="utf-8")
+    progress = BulkProgress()
+    try:
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            # Ventana acotada de peticiones en curso; los resultados se escriben en orden de entrada
+            pending = deque()
+            for chunk in read_chunks(read_keys(source), chunk_size):
+                if len(pending) >= window:
+                    write_rows(output, progress, pending.popleft().result())
+                pending.append(executor.submit(verify_chunk, base_url, chunk, use_batch))
+            while pending:
+                write_rows(output, progress, pending.popleft().result())
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if output is not sys.stdout:
+            output.close()
+
+    progress.report(final=True)
+    return progress.exit_code
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Verificador de keys (interactivo o masivo)")
+    parser.add_argument("--bulk", metavar="ARCHIVO", help="verifica las keys de ARCHIVO (o '-' para stdin) sin preguntar")
+    parser.add_argument("--output", default="-", help="archivo JSONL de resultados (por defecto stdout)")
+    parser.add_argument("--url", default=API_BASE_URL, help=f"URL de la API (por defecto {API_BASE_URL})")
+    parser.add_argument("--workers", type=int, default=8, help="conexiones simultáneas (por defecto 8)")
+    parser.add_argument("--window", type=int, default=0, help="peticiones en curso como máximo (por defecto 2 x workers)")
+    parser.add_argument("--batch-size", type=int, default=BULK_BATCH_SIZE, help=f"keys por lote (por defecto {BULK_BATCH_SIZE})")
+    parser.add_argument("--no-batch", action="store_true", help="usa /validate-key aunque el servidor tenga /validate-keys")
+    return parser.parse_args()
+
 if __name__ == "__main__":
+    args = parse_args()
+    API_BASE_URL = args.url.rstrip("/")
+    if args.bulk:
+        try:
+            sys.exit(run_bulk(args))
+        except KeyboardInterrupt:
+            print("\n⚠️  Operación cancelada por el usuario", file=sys.stderr)
+            sys.exit(130)
+        except OSError as e:
+            print(f"❌ {str(e)}", file=sys.stderr)
+            sys.exit(2)
+
     try:
         main()
     except KeyboardInterrupt: